@@ -0,0 +1,398 @@
+# api_server.py
+"""Local HTTP API for requesting clips from other services.
+
+Endpoints:
+    POST   /jobs              submit a batch (the JSON of a batch file); returns the job with its id
+    GET    /jobs              every job's summary
+    GET    /jobs/<id>         one job, with the state of each of its clips
+    GET    /jobs/<id>/events  progress as Server-Sent Events (Accept: text/event-stream or
+                              ?format=sse) or as JSON lines; earlier events are replayed first
+                              and the stream ends when the job does
+    DELETE /jobs/<id>         cancel a queued or running job (or POST /jobs/<id>/cancel)
+
+A batch with "draft": true (or the options of a Draft, e.g. {"height": 240}) is rendered
+as quick low-resolution previews into each output location's drafts folder.
+
+The server is one asyncio event loop, so an open event stream costs a socket and a
+queue instead of a thread. Submitted batches are queued and run one at a time, each on
+the engine's full worker pool. Relative paths in a batch resolve against --root.
+Batch "hooks" are shell commands, so a batch that has any is rejected unless the
+server was started with --allow-hooks.
+
+Only local clients are served: the Host header (and Origin, when a browser sends one)
+must name this machine (localhost, a loopback address, --host or an --allowed-host),
+which stops other web pages and DNS rebinding, and a batch must be posted as
+application/json, which a cross-site form can't send without a CORS preflight.
+
+Usage:
+    python api_server.py [--port 8766] [--workers 4] [--compressed] [--verify] [--root DIR]
+    curl -X POST -H "Content-Type: application/json" --data @batch.json http://127.0.0.1:8766/jobs
+    curl -N http://127.0.0.1:8766/jobs/<id>/events
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+from batch import load_batch_config
+from engine import CancellationToken, ClipEngine, plan_batch
+from local_http import allowed_host_names, is_json, origin_error
+from progress_bus import LoopSink, ProgressBus
+from video_processing import Draft
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+REQUEST_TIMEOUT = 30.0
+KEEPALIVE_INTERVAL = 15.0
+MAX_FINISHED_JOBS = 500
+FINISHED_STATES = ("done", "failed", "cancelled")
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 415: "Unsupported Media Type", 500: "Internal Server Error"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class ApiJob:
+    """A submitted batch, its clips and its event history. Only touched from the event loop"""
+    def __init__(self, job_id, sources, draft=None):
+        self.id = job_id
+        self.sources = sources
+        self.draft = draft
+        self.status = "queued"
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.token = CancellationToken()
+        self.clips = {}
+        self.events = []
+        self.subscribers = set()
+
+    def set_clips(self, clip_jobs):
+        for clip_job in clip_jobs:
+            self.clips[clip_job.output_path] = {'clip': clip_job.describe(), 'status': "queued", 'progress': 0.0, 'eta': None, 'error': None}
+
+    def add_events(self, events):
+        for event in events:
+            clip = self.clips.get(event.get('clip'))
+            if clip is not None:
+                if event['type'] == 'clip_progress':
+                    clip.update(status="encoding", progress=event['progress'], eta=event.get('eta'))
+                elif event['type'] == 'clip_requeued':
+                    clip.update(status="encoding", progress=0.0, error=event.get('error'))
+                elif event['type'] == 'clip_done':
+                    clip.update(status="done" if event['success'] else "failed", error=event.get('error'))
+                    if event['success']:
+                        clip['progress'] = 100.0
+            self.emit(dict(event, job=self.id))
+
+    def emit(self, event):
+        # Progress is replayed from the clip states, so only the milestones are kept
+        if event['type'] not in ProgressBus.COALESCED_TYPES:
+            self.events.append(event)
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        if status in FINISHED_STATES:
+            self.finished = time.time()
+        self.emit({'type': 'job_status', 'job': self.id, 'status': status, 'error': error, 'time': time.time()})
+        if status in FINISHED_STATES:
+            for queue in self.subscribers:
+                queue.put_nowait(None)
+
+    def summary(self, clips=False):
+        done = sum(clip['status'] == "done" for clip in self.clips.values())
+        failed = sum(clip['status'] == "failed" for clip in self.clips.values())
+        summary = {'id': self.id, 'status': self.status, 'error': self.error, 'created': self.created,
+                   'finished': self.finished, 'total': len(self.clips), 'done': done, 'failed': failed}
+        if clips:
+            summary['clips'] = [dict(state, output=output) for output, state in self.clips.items()]
+        return summary
+
+class ClipApiServer:
+    """Accepts batches over HTTP and runs them through a ClipEngine built from engine_options.
+    Batches with hooks are only accepted with allow_hooks=True"""
+    def __init__(self, host="127.0.0.1", port=8766, base_dir=None, refresh_interval=0.5, allow_hooks=False, allowed_hosts=(),
+                 **engine_options):
+        self.host = host
+        self.allow_hooks = allow_hooks
+        # Names clients may use for this server, in the Host and Origin headers
+        self.allowed_hosts = allowed_host_names(host, allowed_hosts)
+        self.port = port
+        self.base_dir = os.path.abspath(base_dir or os.getcwd())
+        self.refresh_interval = refresh_interval
+        self.engine_options = engine_options
+        self.jobs = {}
+        self.queue = None
+        self.server = None
+        self.runner = None
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.runner = asyncio.create_task(self.run_jobs())
+        return self
+
+    async def close(self):
+        for job in self.jobs.values():
+            if job.status not in FINISHED_STATES:
+                job.token.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        self.runner.cancel()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Clip API listening on http://{self.host}:{self.port}")
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    # Running jobs
+
+    async def run_jobs(self):
+        while True:
+            job = await self.queue.get()
+            if job.status == "queued":
+                await self.run_job(job)
+
+    async def run_job(self, job):
+        loop = asyncio.get_running_loop()
+        job.set_status("running")
+        bus = ProgressBus(refresh_interval=self.refresh_interval)
+        bus.attach(LoopSink(loop, job.add_events))
+        engine = ClipEngine(bus=bus, draft=job.draft, **self.engine_options)
+        failures = 0
+        error = None
+        try:
+            # Probing runs FFprobe, so it stays off the event loop
+            job.set_clips(await loop.run_in_executor(None, plan_batch, job.sources, job.draft))
+            async for result in engine.run_async(job.sources, job.token):
+                failures += not result.success and not result.cancelled
+        except Exception as e:
+            error = str(e)
+        finally:
+            await loop.run_in_executor(None, bus.close)
+
+        if job.token.cancelled:
+            job.set_status("cancelled")
+        elif error or failures:
+            job.set_status("failed", error or f"{failures} clip(s) failed")
+        else:
+            job.set_status("done")
+
+    def submit(self, body):
+        try:
+            config = json.loads(body or b"{}")
+            if not self.allow_hooks and (config.get('hooks') or any(entry.get('hooks') for entry in config.get('sources', []))):
+                raise HttpError(400, "Hooks run shell commands and are disabled; start the server with --allow-hooks")
+            sources = load_batch_config(config, self.base_dir)
+            draft = config.get('draft')
+            draft = Draft.from_dict(draft) if isinstance(draft, dict) else Draft() if draft else None
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise HttpError(400, f"Invalid batch: {e}")
+        if not sources:
+            raise HttpError(400, "The batch has no sources")
+        job = ApiJob(uuid.uuid4().hex[:12], sources, draft)
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        self.prune()
+        return job
+
+    def cancel(self, job):
+        if job.status in FINISHED_STATES:
+            raise HttpError(409, f"Job {job.id} is already {job.status}")
+        job.token.cancel()
+        if job.status == "queued":
+            job.set_status("cancelled")
+
+    def prune(self):
+        finished = sorted((job for job in self.jobs.values() if job.status in FINISHED_STATES), key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    # HTTP
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, query, headers, body = await asyncio.wait_for(read_request(reader), REQUEST_TIMEOUT)
+            await self.dispatch(writer, method, path, query, headers, body)
+        except HttpError as e:
+            await send_json(writer, e.status, {'error': e.message})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            print(f"Error handling API request: {e}")
+            try:
+                await send_json(writer, 500, {'error': str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    def check_origin(self, headers):
+        """Refuse requests addressed to, or sent from a page on, a host other than this one"""
+        error = origin_error(headers, self.allowed_hosts)
+        if error:
+            raise HttpError(403, error)
+
+    async def dispatch(self, writer, method, path, query, headers, body):
+        self.check_origin(headers)
+        parts = [part for part in path.split('/') if part]
+        if not parts or parts[0] != "jobs" or len(parts) > 3:
+            raise HttpError(404, f"No such endpoint: {path}")
+        if len(parts) == 1:
+            if method == "GET":
+                await send_json(writer, 200, {'jobs': [job.summary() for job in self.jobs.values()]})
+            elif method == "POST":
+                if not is_json(headers):
+                    raise HttpError(415, "Batches must be sent as Content-Type: application/json")
+                await send_json(writer, 202, self.submit(body).summary())
+            else:
+                raise HttpError(405, f"{method} is not supported on /jobs")
+            return
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            raise HttpError(404, f"No such job: {parts[1]}")
+        action = parts[2] if len(parts) == 3 else None
+        if action is None and method == "GET":
+            await send_json(writer, 200, job.summary(clips=True))
+        elif (action is None and method == "DELETE") or (action == "cancel" and method == "POST"):
+            self.cancel(job)
+            await send_json(writer, 200, job.summary())
+        elif action == "events" and method == "GET":
+            sse = query.get('format', [""])[0] == "sse" or "text/event-stream" in headers.get('accept', "")
+            await self.stream_events(writer, job, sse)
+        else:
+            raise HttpError(405 if action in (None, "cancel", "events") else 404, f"{method} {path} is not supported")
+
+    async def stream_events(self, writer, job, sse):
+        queue = asyncio.Queue()
+        backlog = list(job.events)
+        finished = job.status in FINISHED_STATES
+        if not finished:
+            job.subscribers.add(queue)
+        content_type = "text/event-stream" if sse else "application/x-ndjson"
+        writer.write(response_head(200, content_type, chunked=True, extra={'Cache-Control': "no-cache"}))
+        try:
+            for event in backlog:
+                await write_chunk(writer, format_event(event, sse))
+            while not finished:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    if sse:
+                        await write_chunk(writer, ": keepalive\n\n")  # Also notices clients that went away
+                    continue
+                if event is None:
+                    break
+                await write_chunk(writer, format_event(event, sse))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            job.subscribers.discard(queue)
+
+async def read_request(reader):
+    """Return (method, path, query, headers, body) of one HTTP/1.1 request"""
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    if not request_line:
+        raise ConnectionError("Client closed the connection")
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise HttpError(400, "Malformed request line")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body is larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), headers, body
+
+def response_head(status, content_type, length=None, chunked=False, extra=None):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}", f"Content-Type: {content_type}", "Connection: close"]
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    elif length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines.extend(f"{name}: {value}" for name, value in (extra or {}).items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+async def send_json(writer, status, data):
+    body = json.dumps(data, default=str).encode('utf-8')
+    writer.write(response_head(status, "application/json", len(body)) + body)
+    await writer.drain()
+
+async def write_chunk(writer, text):
+    data = text.encode('utf-8')
+    writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+    await writer.drain()
+
+def format_event(event, sse):
+    data = json.dumps(event, default=str)
+    return f"event: {event['type']}\ndata: {data}\n\n" if sse else data + "\n"
+
+def main():
+    from loudness import LoudnessNormalizer
+    from segment_cache import SegmentCache
+    from verification import ClipVerifier
+    from video_processing import configure_watchdog
+
+    parser = argparse.ArgumentParser(description="Serve a local HTTP API for clip batches")
+    parser.add_argument('--host', default="127.0.0.1", help="Address to bind (default: localhost only)")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--root', help="Directory that relative paths in batches resolve against (default: current)")
+    parser.add_argument('--compressed', action='store_true', help="Use compressed instead of lossless quality")
+    parser.add_argument('--hw-encoder', help="Hardware encoder to try first, e.g. h264_nvenc")
+    parser.add_argument('--workers', type=int, help="Clips encoded in parallel")
+    parser.add_argument('--segment-cache', help="Directory of cached encoded parts")
+    parser.add_argument('--loudness', type=float, help="Normalize every clip to this integrated loudness (LUFS)")
+    parser.add_argument('--loudness-cache', help="Directory for the per-source loudness measurements")
+    parser.add_argument('--verify', action='store_true', help="Probe every finished clip and re-encode the ones that came out wrong")
+    parser.add_argument('--verify-decode', action='store_true', help="Also decode every finished clip completely (implies --verify)")
+    parser.add_argument('--stall-timeout', type=float, help="Kill an FFmpeg job after this many seconds without progress (0 disables)")
+    parser.add_argument('--allowed-host', action='append', default=[], metavar='NAME',
+                        help="Extra host name clients may use, when binding to a non-local address (repeatable)")
+    parser.add_argument('--allow-hooks', action='store_true', help="Accept batches with \"hooks\" (shell commands run for every clip)")
+    parser.add_argument('--simulate', metavar='SPEC', help="Use the simulated FFmpeg backend, e.g. speed=500,fail=0.01")
+    args = parser.parse_args()
+    configure_watchdog(stall_timeout=args.stall_timeout)
+    if args.simulate is not None:
+        from simulated_ffmpeg import install
+        install(args.simulate)
+
+    server = ClipApiServer(
+        args.host, args.port, args.root, allow_hooks=args.allow_hooks, allowed_hosts=args.allowed_host,
+        lossless=not args.compressed,
+        hw_encoder=args.hw_encoder,
+        hw_acceleration_enabled=args.hw_encoder is not None,
+        max_workers=args.workers,
+        segment_cache=SegmentCache(args.segment_cache) if args.segment_cache else None,
+        loudness=LoudnessNormalizer(args.loudness_cache, target=args.loudness) if args.loudness is not None else None,
+        verifier=ClipVerifier(decode=args.verify_decode) if args.verify or args.verify_decode else None
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
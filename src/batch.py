@@ -0,0 +1,134 @@
+# batch.py
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from overlays import Overlay, overlay_from_dict
+from video_processing import get_audio_info, get_video_duration, get_video_resolution, AudioOutput, Rendition, Thumbnails
+
+TIME_RANGE_PATTERN = r"(\d{1,2}:?\d{2}:?\d{2}|\d{1,2}:?\d{2})-(\d{1,2}:?\d{2}:?\d{2}|\d{1,2}:?\d{2})"
+
+def parse_time_ranges(time_ranges_text):
+    """Parse '00:10-00:20, 01:00-01:30' into a list of (start, end) strings"""
+    parsed_ranges = []
+    for range_str in time_ranges_text.split(','):
+        if not range_str.strip():
+            continue
+        match = re.match(TIME_RANGE_PATTERN, range_str.strip())
+        if not match:
+            raise ValueError(f"Invalid time range format: {range_str.strip()}")
+        parsed_ranges.append(match.groups())
+    return parsed_ranges
+
+def default_worker_count():
+    # Each FFmpeg encode is already multi-threaded, so a few parallel clips are
+    # enough to fill the gaps left by probing, muxing and temp file cleanup
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+class BatchSource:
+    """A source recording with its own ranges, intro, outro and output folder"""
+    def __init__(self, source_video, ranges, intro=None, outro=None, output_location=None, renditions=None, thumbnails=None, audio=None, overlays=None, hooks=None):
+        self.source_video = source_video
+        self.ranges = ranges
+        self.intro = intro
+        self.outro = outro
+        self.renditions = renditions
+        self.thumbnails = thumbnails
+        self.audio = audio
+        self.overlays = overlays
+        self.hooks = hooks
+        self.output_location = output_location or os.path.dirname(source_video)
+        self.original_filename = os.path.splitext(os.path.basename(source_video))[0]
+        self.duration = None
+        self.resolution = None
+        self.audio_info = None
+        self.intro_duration = 0
+        self.outro_duration = 0
+        self.error = None
+
+def load_batch_file(batch_file):
+    """Load sources from a JSON batch file.
+
+    Expected layout:
+        {"sources": [{"source": "a.mp4", "ranges": "00:10-00:20, 01:00-01:30",
+                      "intro": "intro.mp4", "outro": "outro.mp4", "output": "out/"}],
+         "renditions": [{"label": "720p", "height": 720, "crf": 23}],
+         "thumbnails": {"poster_offset": 2, "preview_duration": 3}}
+    "ranges" may also be a list of "start-end" strings. "renditions" may be given at the
+    top level or per source; each one is written as Clip_N_<name>_<label>.mp4 by default.
+    "thumbnails" (top level or per source) adds Clip_N_<name>_poster.jpg and _preview.gif.
+    "audio": {"format": "mp3"} (top level or per source) writes audio-only clips instead.
+    "overlays" (top level or per source) lists logos ({"image": "logo.png", "position":
+    "top-right", "opacity": 0.8}) and lower-thirds ({"text": "Name", "start": 2, "end": 8}).
+    "hooks" (top level or per source) lists shell commands run for every finished clip,
+    e.g. "upload.sh {output}" (see hooks.py).
+    """
+    with open(batch_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return load_batch_config(config, os.path.dirname(os.path.abspath(batch_file)))
+
+def load_batch_config(config, base_dir):
+    """Build sources from an already parsed batch file; relative paths are resolved against base_dir"""
+    def resolve(path):
+        return os.path.join(base_dir, path) if path and not os.path.isabs(path) else path
+
+    default_renditions = config.get('renditions')
+    default_thumbnails = config.get('thumbnails')
+    default_audio = config.get('audio')
+    default_overlays = config.get('overlays')
+    default_hooks = config.get('hooks')
+    sources = []
+    for entry in config.get('sources', []):
+        renditions = entry.get('renditions', default_renditions)
+        thumbnails = entry.get('thumbnails', default_thumbnails)
+        audio = entry.get('audio', default_audio)
+        overlays = [overlay_from_dict(o) for o in entry.get('overlays', default_overlays) or []]
+        for overlay in overlays:
+            if isinstance(overlay, Overlay):
+                overlay.image = resolve(overlay.image)
+            else:
+                overlay.font_file = resolve(overlay.font_file)
+        ranges = entry.get('ranges', '')
+        if isinstance(ranges, list):
+            ranges = ', '.join(ranges)
+        sources.append(BatchSource(
+            resolve(entry['source']),
+            parse_time_ranges(ranges),
+            intro=resolve(entry.get('intro')),
+            outro=resolve(entry.get('outro')),
+            output_location=resolve(entry.get('output')),
+            renditions=[Rendition.from_dict(r) for r in renditions] if renditions else None,
+            thumbnails=Thumbnails.from_dict(thumbnails) if thumbnails is not None else None,
+            audio=AudioOutput.from_dict(audio) if audio is not None else None,
+            overlays=overlays or None,
+            hooks=entry.get('hooks', default_hooks)
+        ))
+    return sources
+
+def probe_sources(sources, max_workers=None):
+    """Probe every source (and each distinct intro/outro) in parallel. Failed probes are stored on source.error"""
+    def probe(source):
+        try:
+            source.duration = get_video_duration(source.source_video)
+            if source.audio:
+                source.audio_info = get_audio_info(source.source_video)
+            else:
+                source.resolution = get_video_resolution(source.source_video)
+        except Exception as e:
+            source.error = str(e)
+        return source
+
+    def probe_extra(path):
+        try:
+            return get_video_duration(path)
+        except Exception:
+            return 0  # Only used for time estimates; the clip itself will report the error
+
+    extras = sorted({path for source in sources for path in (source.intro, source.outro) if path})
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, len(sources) + len(extras) or 1)) as executor:
+        extra_futures = {path: executor.submit(probe_extra, path) for path in extras}
+        list(executor.map(probe, sources))
+        for source in sources:
+            source.intro_duration = extra_futures[source.intro].result() if source.intro else 0
+            source.outro_duration = extra_futures[source.outro].result() if source.outro else 0
+    return sources
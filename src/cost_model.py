@@ -0,0 +1,95 @@
+# cost_model.py
+import json
+import os
+import threading
+from segment_cache import user_cache_dir
+
+REFERENCE_PIXELS = 1920 * 1080
+# Audio-only clips cost a small fraction of a 1080p video encode
+AUDIO_WORK_FACTOR = 0.02
+
+# Seconds of 1080p media encoded per wall-clock second before any history exists
+DEFAULT_THROUGHPUT = {
+    "libx264": 1.5,
+    "h264_nvenc": 6.0,
+    "h264_amf": 4.0,
+    "h264_qsv": 4.0,
+    # Draft work is counted at the draft's size; decoding the full-size source dominates
+    "draft": 2.0,
+}
+
+class CostModel:
+    """Predicts how long a clip takes to encode on this machine.
+
+    Work is measured in "1080p-equivalent seconds" (media duration scaled by pixel count,
+    counted once per encode pass). Throughput per encoder/quality is learned from finished
+    clips with an exponential moving average and kept in a small JSON history file, by
+    default in the per-user cache folder.
+    """
+    def __init__(self, history_file=None, smoothing=0.3):
+        self.history_file = history_file or user_cache_dir("encode_history.json")
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.throughput = {}
+        try:
+            with open(self.history_file, 'r') as f:
+                self.throughput = json.load(f).get('throughput', {})
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def encoder_key(hw_encoder, lossless):
+        return f"{hw_encoder or 'libx264'}:{'lossless' if lossless else 'compressed'}"
+
+    @staticmethod
+    def work_units(duration, resolution=None, intro_duration=0, outro_duration=0, audio_only=False):
+        """Estimate encode work for a clip: the main cut, each intro/outro pass and the final assembly"""
+        if audio_only:
+            pixel_factor = AUDIO_WORK_FACTOR
+        else:
+            pixel_factor = (resolution[0] * resolution[1]) / REFERENCE_PIXELS if resolution else 1.0
+        extras = (intro_duration or 0) + (outro_duration or 0)
+        if not extras:
+            return pixel_factor * duration  # The cut writes the clip directly
+        # Main cut + intro/outro normalization + final assembly of the whole clip
+        return pixel_factor * (duration + extras + duration + extras)
+
+    def get_throughput(self, key):
+        with self.lock:
+            if key in self.throughput:
+                return self.throughput[key]
+        return DEFAULT_THROUGHPUT.get(key.split(':')[0], DEFAULT_THROUGHPUT["libx264"])
+
+    def estimate(self, work, key):
+        """Predicted wall-clock seconds for the given amount of work"""
+        return work / max(self.get_throughput(key), 1e-6)
+
+    def record(self, work, key, elapsed):
+        """Fold a measured run into the throughput history"""
+        if work <= 0 or elapsed <= 0:
+            return
+        measured = work / elapsed
+        with self.lock:
+            previous = self.throughput.get(key)
+            if previous is None:
+                self.throughput[key] = measured
+            else:
+                self.throughput[key] = previous + self.smoothing * (measured - previous)
+
+    def save(self):
+        with self.lock:
+            data = {'throughput': dict(self.throughput)}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.history_file)), exist_ok=True)
+            with open(self.history_file, 'w') as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"Error saving encode history: {e}")
+
+def remaining_batch_time(job_remaining, workers):
+    """Estimate the time left for a batch by simulating LPT dispatch of the remaining jobs"""
+    loads = [0.0] * max(1, workers)
+    for remaining in sorted(job_remaining, reverse=True):
+        index = loads.index(min(loads))
+        loads[index] += remaining
+    return max(loads)
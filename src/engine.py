@@ -0,0 +1,484 @@
+# engine.py
+"""Tk-independent clip engine shared by the GUI, the command line tools and the daemons.
+
+Usage:
+    python engine.py batch.json [--compressed] [--hw-encoder h264_nvenc] [--workers 4] [--loudness -16] [--verify]
+                     [--hook "upload.sh {output}"] [--draft] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from batch import default_worker_count, load_batch_file, probe_sources
+from cost_model import CostModel, remaining_batch_time
+from hooks import HookRunner
+from overlays import OverlayCache
+from readahead import ReadAheadPrefetcher, order_for_locality
+from stage_graph import CANCELLED_MESSAGE, StageExecutor, cut_video_segment, plan_clip
+from verification import media_outputs
+from video_processing import Draft, terminate_current_process, validate_time_range, parse_time_string
+
+class ClipJob:
+    """A single clip to cut from one of the batch sources; with a Draft it is a preview in the draft folder"""
+    __slots__ = ('source', 'index', 'start', 'end', 'output_path', 'duration', 'work', 'draft')
+
+    def __init__(self, source, index, start, end, draft=None):
+        self.source = source
+        self.index = index
+        self.start = start
+        self.end = end
+        self.draft = draft
+        audio = source.audio if not draft else None
+        extension = audio.format if audio else "mp4"
+        self.output_path = os.path.join(source.output_location, f"Clip_{index}_{source.original_filename}.{extension}")
+        if draft:
+            self.output_path = draft.output_path(self.output_path)
+        self.duration = parse_time_string(end) - parse_time_string(start)
+        self.work = CostModel.work_units(self.duration, (draft.width, draft.height) if draft else source.resolution,
+                                         source.intro_duration, source.outro_duration, audio_only=audio is not None)
+
+    def media_outputs(self):
+        """The audio/video files this clip writes"""
+        if self.draft:
+            return [self.output_path]
+        return media_outputs(self.output_path, self.source.renditions, self.source.audio)
+
+    def stream_type(self):
+        return "audio" if self.source.audio and not self.draft else "video"
+
+    def describe(self):
+        return f"clip {self.index} of {os.path.basename(self.source.source_video)}"
+
+    def output_duration(self):
+        """Length of the finished clip, intro and outro included"""
+        return self.duration + (self.source.intro_duration or 0) + (self.source.outro_duration or 0)
+
+class ClipResult:
+    """Outcome of one ClipJob; fallbacks lists the hardware encodes that ran in software instead,
+    retries counts the re-encodes after the output failed verification"""
+    __slots__ = ('job', 'success', 'error', 'elapsed', 'cancelled', 'fallbacks', 'retries')
+
+    def __init__(self, job, success, error=None, elapsed=0.0, cancelled=False, fallbacks=None, retries=0):
+        self.job = job
+        self.success = success
+        self.error = error
+        self.elapsed = elapsed
+        self.cancelled = cancelled
+        self.fallbacks = fallbacks or []
+        self.retries = retries
+
+    def fallback_cost(self):
+        """Seconds spent on hardware attempts that failed"""
+        return sum(fallback['wasted'] for fallback in self.fallbacks)
+
+class CancellationToken:
+    """Shared flag for stopping a run; callbacks fire once, on the first cancel()"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def add_callback(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in cancellation callback: {e}")
+
+def build_clip_jobs(sources, draft=None):
+    """Validate every range and interleave the clip jobs of all sources round-robin"""
+    per_source = []
+    for source in sources:
+        if source.error:
+            raise ValueError(f"Could not read {source.source_video}: {source.error}")
+        jobs = []
+        for i, (start, end) in enumerate(source.ranges, 1):
+            if not validate_time_range(start, end, source.duration):
+                raise ValueError(f"Invalid time range for {os.path.basename(source.source_video)}: {start}-{end}")
+            jobs.append(ClipJob(source, i, start, end, draft))
+        per_source.append(jobs)
+
+    interleaved = []
+    for position in range(max((len(jobs) for jobs in per_source), default=0)):
+        for jobs in per_source:
+            if position < len(jobs):
+                interleaved.append(jobs[position])
+    return interleaved
+
+def plan_batch(sources, draft=None):
+    """Probe any sources that haven't been probed yet and return their clip jobs"""
+    unprobed = [source for source in sources if source.duration is None and not source.error]
+    if unprobed:
+        probe_sources(unprobed)
+    return build_clip_jobs(sources, draft)
+
+class ClipEngine:
+    """Runs clip jobs from every source in a single shared worker pool.
+
+    Jobs are dispatched longest-predicted-first (LPT) so short clips fill in around the
+    long ones at the end of the batch, and the cost model is updated as clips finish.
+    For sources on slow or network storage, order="locality" reads each source front to
+    back instead, and readahead=True prefetches the byte ranges of upcoming jobs.
+    The stages inside each clip share a pool of max_workers FFmpeg processes, so a clip's
+    cut and intro/outro normalization run side by side without oversubscribing the machine.
+    Logos and lower-thirds are prepared once in overlay_cache and reused by every clip.
+    With a verifier (a ClipVerifier), finished clips are checked on a separate pool while
+    the next clips encode, and a clip that fails is re-encoded up to verify_retries times.
+    Each clip that passes is handed to hooks (a HookRunner) while later clips encode; a
+    runner is created for the run if only the sources define hooks. The run ends once
+    every hook has finished. With a draft (a Draft), every clip is rendered as a quick
+    low-resolution preview into the draft folder instead, and hooks are not run.
+    With batch_snapshot=False the engine doesn't publish batch_progress on the bus, for
+    callers that run several engines on one bus and combine their progress_snapshot().
+    """
+    def __init__(self, lossless, hw_encoder=None, hw_acceleration_enabled=False, max_workers=None, stop_on_error=False, segment_cache=None, cost_model=None, bus=None, order="lpt", readahead=False, loudness=None, verifier=None, verify_retries=1, overlay_cache=None, hooks=None, draft=None, batch_snapshot=True):
+        self.lossless = lossless
+        self.hw_encoder = hw_encoder if hw_acceleration_enabled else None
+        self.hw_acceleration_enabled = hw_acceleration_enabled
+        self.max_workers = max_workers or default_worker_count()
+        self.stop_on_error = stop_on_error
+        self.segment_cache = segment_cache
+        self.cost_model = cost_model or CostModel()
+        # Drafts get their own throughput history so they don't skew full-quality estimates
+        self.cost_key = "draft" if draft else CostModel.encoder_key(self.hw_encoder, lossless)
+        self.bus = bus
+        self.order = order
+        self.readahead = readahead
+        self.loudness = loudness
+        self.verifier = verifier
+        self.verify_retries = verify_retries
+        self.overlay_cache = overlay_cache or OverlayCache()
+        self.hooks = hooks
+        self.draft = draft
+        self.batch_snapshot = batch_snapshot
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.clip_progress = {}
+        self.started = {}
+        self.finished = set()
+        self.stage_executor = None
+        self.active_hooks = None
+
+    def clip_eta(self, job, now=None):
+        """Predicted seconds until a job finishes, blending the cost model with its observed progress"""
+        estimate = self.cost_model.estimate(job.work, self.cost_key)
+        with self.lock:
+            if job in self.finished:
+                return 0.0
+            progress = self.clip_progress.get(job, 0) / 100
+            started = self.started.get(job)
+        if started is None:
+            return estimate
+        elapsed = (now or time.time()) - started
+        if progress <= 0:
+            return max(0.0, estimate - elapsed)
+        observed = elapsed * (1 - progress) / progress
+        return max(0.0, (estimate * (1 - progress) + observed) / 2)
+
+    def batch_eta(self):
+        """Predicted seconds until the whole batch finishes"""
+        now = time.time()
+        return remaining_batch_time([self.clip_eta(job, now) for job in self.jobs], self.max_workers)
+
+    def progress_snapshot(self):
+        """Overall progress weighted by predicted work, plus the batch ETA"""
+        with self.lock:
+            total_work = sum(job.work for job in self.jobs) or 1
+            overall = sum(job.work * self.clip_progress.get(job, 0) for job in self.jobs) / total_work
+            completed = len(self.finished)
+        return {'progress': overall, 'completed': completed, 'total': len(self.jobs), 'eta': self.batch_eta()}
+
+    def order_jobs(self, jobs):
+        if self.order == "locality":
+            return order_for_locality(jobs)
+        # Longest processing time first; the sort is stable so equal jobs stay interleaved
+        return sorted(jobs, key=lambda job: job.work, reverse=True)
+
+    def plan_job(self, job):
+        """The stage graph a job would run, without running it"""
+        return plan_clip(
+            job.source.source_video, job.output_path, job.start, job.end, self.lossless,
+            job.source.intro, job.source.outro, self.hw_encoder, self.hw_acceleration_enabled,
+            job.source.renditions, job.source.thumbnails, self.loudness,
+            audio=job.source.audio, source_audio=job.source.audio_info,
+            overlays=job.source.overlays, overlay_cache=self.overlay_cache, draft=job.draft
+        )
+
+    def run(self, sources, token=None):
+        """Plan the batch and yield a ClipResult for every job as soon as it finishes.
+
+        Raises ValueError before the first result if a source can't be read or a range
+        is invalid. Closing the generator early cancels the remaining jobs.
+        """
+        return self.run_jobs(plan_batch(sources, self.draft), token)
+
+    def run_jobs(self, jobs, token=None):
+        token = token or CancellationToken()
+        token.add_callback(terminate_current_process)
+        jobs = self.order_jobs(jobs)
+        with self.lock:
+            self.jobs = jobs
+            self.clip_progress = {}
+            self.started = {}
+            self.finished = set()
+        if self.bus and self.batch_snapshot:
+            self.bus.add_snapshot('batch_progress', self.progress_snapshot)
+        return self._run(jobs, token)
+
+    def _run(self, jobs, token):
+        prefetcher = ReadAheadPrefetcher(jobs, lookahead=self.max_workers).start() if self.readahead else None
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # Checks run beside the encodes rather than in their slots
+        verify_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="verify") if self.verifier else None
+        self.stage_executor = StageExecutor(self.max_workers)
+        own_hooks = None
+        if self.hooks is None and not self.draft and any(job.source.hooks for job in jobs):
+            own_hooks = HookRunner(bus=self.bus)
+        self.active_hooks = None if self.draft else self.hooks or own_hooks
+        running = {}
+        retries = {}
+        try:
+            for job in jobs:
+                running[executor.submit(self.run_job, job, token, prefetcher)] = "encode"
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if running.pop(future) == "encode":
+                        result = future.result()
+                        if result.success and verify_executor:
+                            running[verify_executor.submit(self.verify_job, result)] = "verify"
+                            continue
+                    else:
+                        result, error = future.result()
+                        job = result.job
+                        if error and token.cancelled:
+                            result = ClipResult(job, False, CANCELLED_MESSAGE, result.elapsed, True, result.fallbacks)
+                        elif error and retries.get(job, 0) < self.verify_retries:
+                            retries[job] = retries.get(job, 0) + 1
+                            self.requeue_job(job, error)
+                            running[executor.submit(self.run_job, job, token, prefetcher, True)] = "encode"
+                            continue
+                        elif error:
+                            result = ClipResult(job, False, f"Verification failed: {error}", result.elapsed, fallbacks=result.fallbacks)
+                    result.retries = retries.get(result.job, 0)
+                    if self.active_hooks and result.success:
+                        self.active_hooks.submit(result, token)
+                    self.publish_result(result)
+                    if not result.success and not result.cancelled and self.stop_on_error:
+                        token.cancel()
+                    yield result
+        finally:
+            # Also reached when the consumer stops iterating early
+            if any(not future.done() for future in running):
+                token.cancel()
+            executor.shutdown(wait=True)
+            if verify_executor:
+                verify_executor.shutdown(wait=True)
+            self.stage_executor.shutdown()
+            if own_hooks:
+                own_hooks.close()
+            elif self.active_hooks:
+                self.hooks.wait()
+            if prefetcher:
+                prefetcher.close()
+            self.cost_model.save()
+
+    def run_job(self, job, token, prefetcher=None, retry=False):
+        if token.cancelled:
+            return ClipResult(job, False, CANCELLED_MESSAGE, cancelled=True)
+        # Backpressure: don't start encoding while too many finished clips wait for their hooks
+        if self.active_hooks and not self.active_hooks.wait_for_room(token):
+            return ClipResult(job, False, CANCELLED_MESSAGE, cancelled=True)
+
+        def progress_handler(progress):
+            with self.lock:
+                self.clip_progress[job] = progress
+            if self.bus:
+                # clip_eta takes the lock itself
+                self.bus.publish('clip_progress', clip=job.output_path, progress=progress, eta=self.clip_eta(job))
+
+        with self.lock:
+            self.started[job] = time.time()
+        if prefetcher:
+            prefetcher.job_started(job)
+        if job.draft:
+            os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+        fallbacks = []
+        success, error_message = cut_video_segment(
+            job.source.source_video,
+            job.output_path,
+            job.start,
+            job.end,
+            self.lossless,
+            job.source.intro,
+            job.source.outro,
+            progress_callback=progress_handler,
+            hw_encoder=self.hw_encoder,
+            hw_acceleration_enabled=self.hw_acceleration_enabled,
+            renditions=job.source.renditions,
+            # A re-encode after a failed verification must not reuse a bad cached part
+            segment_cache=self.segment_cache.refreshing() if retry and self.segment_cache else self.segment_cache,
+            thumbnails=job.source.thumbnails,
+            loudness=self.loudness,
+            fallbacks=fallbacks,
+            executor=self.stage_executor,
+            audio=job.source.audio,
+            source_audio=job.source.audio_info,
+            overlays=job.source.overlays,
+            overlay_cache=self.overlay_cache,
+            draft=job.draft
+        )
+        elapsed = time.time() - self.started[job]
+        if success:
+            with self.lock:
+                self.clip_progress[job] = 100
+                self.finished.add(job)
+            self.cost_model.record(job.work, self.cost_key, elapsed)
+        cancelled = not success and token.cancelled
+        return ClipResult(job, success, error_message, elapsed, cancelled, fallbacks)
+
+    def verify_job(self, result):
+        """Check a finished clip's files. Returns (result, error_message or None)"""
+        job = result.job
+        try:
+            return result, self.verifier.verify(job.media_outputs(), job.output_duration(), job.stream_type())
+        except Exception as e:
+            return result, str(e)
+
+    def requeue_job(self, job, error):
+        """Put a clip that failed verification back into the batch"""
+        with self.lock:
+            self.clip_progress[job] = 0
+            self.finished.discard(job)
+        for path in job.media_outputs():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if self.bus:
+            self.bus.publish('clip_requeued', clip=job.output_path, error=error)
+
+    def publish_result(self, result):
+        with self.lock:
+            started = result.job in self.started
+        if self.bus and started:  # Jobs cancelled before they started are not reported
+            self.bus.publish('clip_done', clip=result.job.output_path, success=result.success, error=result.error,
+                             elapsed=result.elapsed, fallbacks=result.fallbacks, media_seconds=result.job.duration,
+                             retries=result.retries)
+
+    async def run_async(self, sources, token=None):
+        """Async iterator over the same results; the engine itself runs on worker threads"""
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        done = object()
+        token = token or CancellationToken()
+
+        def produce():
+            try:
+                for result in self.run(sources, token):
+                    loop.call_soon_threadsafe(results.put_nowait, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(results.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(results.put_nowait, done)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if producer.is_alive():
+                token.cancel()
+
+def main():
+    from progress_bus import ProgressBus, JsonLinesSink
+    from loudness import LoudnessNormalizer
+    from metrics import MetricsService
+    from segment_cache import SegmentCache
+    from verification import ClipVerifier
+
+    parser = argparse.ArgumentParser(description="Run a clip batch without the GUI")
+    parser.add_argument('batch_file')
+    parser.add_argument('--compressed', action='store_true', help="Use compressed instead of lossless quality")
+    parser.add_argument('--hw-encoder', help="Hardware encoder to try first, e.g. h264_nvenc")
+    parser.add_argument('--workers', type=int, help="Clips encoded in parallel")
+    parser.add_argument('--loudness', type=float, help="Normalize every clip to this integrated loudness (LUFS)")
+    parser.add_argument('--loudness-cache', help="Directory for the per-source loudness measurements")
+    parser.add_argument('--segment-cache', help="Directory of cached main segments, reused across runs")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on this local port")
+    parser.add_argument('--metrics-file', help="Rewrite Prometheus metrics to this textfile periodically")
+    parser.add_argument('--simulate', metavar='SPEC', help="Use the simulated FFmpeg backend, e.g. speed=500,fail=0.01")
+    parser.add_argument('--verify', action='store_true', help="Probe every finished clip and re-encode the ones that came out wrong")
+    parser.add_argument('--verify-decode', action='store_true', help="Also decode every finished clip completely (implies --verify)")
+    parser.add_argument('--hook', action='append', default=[], metavar='COMMAND',
+                        help="Shell command to run for every finished clip, e.g. \"upload.sh {output}\" (repeatable)")
+    parser.add_argument('--hook-workers', type=int, default=2, help="Hooks run at the same time")
+    parser.add_argument('--draft', action='store_true', help="Render quick low-resolution previews into a drafts folder")
+    parser.add_argument('--cost-history', metavar='FILE', help="Encode throughput history (default: in the per-user cache folder)")
+    parser.add_argument('--dry-run', action='store_true', help="Print the stage graph of every clip instead of encoding")
+    args = parser.parse_args()
+    if args.simulate is not None:
+        from simulated_ffmpeg import install
+        install(args.simulate)
+    loudness = LoudnessNormalizer(args.loudness_cache, target=args.loudness) if args.loudness is not None else None
+    draft = Draft() if args.draft else None
+
+    if args.dry_run:
+        engine = ClipEngine(not args.compressed, args.hw_encoder, args.hw_encoder is not None, loudness=loudness, draft=draft)
+        for job in engine.order_jobs(plan_batch(load_batch_file(args.batch_file), draft)):
+            print(json.dumps(dict(engine.plan_job(job).to_dict(), clip=job.describe())))
+        return
+
+    bus = ProgressBus(refresh_interval=1.0)
+    bus.attach(JsonLinesSink(sys.stdout))
+    segment_cache = SegmentCache(args.segment_cache) if args.segment_cache else None
+    metrics = None
+    if args.metrics_port is not None or args.metrics_file:
+        metrics = MetricsService(bus, args.metrics_port, args.metrics_file, segment_cache)
+    verifier = ClipVerifier(decode=args.verify_decode) if args.verify or args.verify_decode else None
+    hooks = HookRunner(args.hook, max_workers=args.hook_workers, bus=bus) if args.hook else None
+    engine = ClipEngine(not args.compressed, args.hw_encoder, args.hw_encoder is not None, max_workers=args.workers, bus=bus,
+                        segment_cache=segment_cache, cost_model=CostModel(args.cost_history), loudness=loudness, verifier=verifier, hooks=hooks, draft=draft)
+    token = CancellationToken()
+    failures = 0
+    try:
+        for result in engine.run(load_batch_file(args.batch_file), token):
+            failures += not result.success
+    except KeyboardInterrupt:
+        token.cancel()
+    finally:
+        if hooks:
+            hooks.close()
+        bus.close()
+        if metrics:
+            metrics.close()
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,18 @@ import platform
 from gpu_cache import GPUCache
 
 class GPUDetector:
-    def __init__(self):
+    def __init__(self, detect_now=True):
         self.gpu_cache = GPUCache()
         self.nvidia_available = False
         self.amd_available = False
         self.intel_quicksync_available = False
-        
+        self.detection_complete = False
+
+        if detect_now:
+            self.load()
+
+    def load(self):
+        """Load GPU info from the cache, or run detection and cache the result"""
         # Try to load from cache first
         cached_info = self.gpu_cache.get_cached_gpu_info()
         if cached_info:
@@ -20,11 +26,15 @@ class GPUDetector:
         else:
             self.detect_gpus()
             # Save to cache
-            self.gpu_cache.save_gpu_info({
-                'nvidia': self.nvidia_available,
-                'amd': self.amd_available,
-                'intel': self.intel_quicksync_available
-            })
+            try:
+                self.gpu_cache.save_gpu_info({
+                    'nvidia': self.nvidia_available,
+                    'amd': self.amd_available,
+                    'intel': self.intel_quicksync_available
+                })
+            except OSError as e:
+                print(f"Error saving GPU cache: {e}")
+        self.detection_complete = True
 
     def detect_gpus(self):
         system = platform.system()
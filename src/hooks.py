@@ -0,0 +1,119 @@
+# hooks.py
+"""Per-clip hooks (uploads, transcripts, tagging) that run while later clips encode.
+
+A hook is a shell command or a Python callable. Commands may use {output}, {outputs},
+{source}, {index}, {start}, {end} and {name}, which are replaced by shell-quoted values,
+and also get them as CLIP_* environment variables. Callables are called with the
+ClipResult and fail by raising or by returning an error message. Hooks run on their
+own small pool as soon as a clip has passed verification. At most max_pending clips
+may be finished but not yet hooked; beyond that, new encodes wait, so a slow upload
+throttles the batch instead of piling up.
+"""
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_HOOK_TIMEOUT = 3600.0
+
+def _quote(value):
+    value = str(value)
+    return subprocess.list2cmdline([value]) if sys.platform == "win32" else shlex.quote(value)
+
+def clip_fields(job):
+    """Placeholder values for a finished ClipJob"""
+    outputs = job.media_outputs()
+    return {
+        'output': outputs[0],
+        'outputs': os.pathsep.join(outputs),
+        'source': job.source.source_video,
+        'index': job.index,
+        'start': job.start,
+        'end': job.end,
+        'name': job.source.original_filename,
+    }
+
+def run_command_hook(command, fields, timeout=DEFAULT_HOOK_TIMEOUT):
+    """Run a shell command hook. Returns an error message or None"""
+    for key, value in fields.items():
+        command = command.replace("{" + key + "}", _quote(value))
+    env = dict(os.environ, **{f"CLIP_{key.upper()}": str(value) for key, value in fields.items()})
+    try:
+        completed = subprocess.run(command, shell=True, env=env, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return f"timed out after {timeout:.0f}s"
+    if completed.returncode != 0:
+        lines = (completed.stderr or completed.stdout or b"").decode(errors='replace').strip().splitlines()
+        return f"exit code {completed.returncode}" + (f": {lines[-1]}" if lines else "")
+    return None
+
+class HookRunner:
+    """Runs hooks for finished clips on a bounded pool, holding back encodes when it falls behind.
+
+    hooks apply to every clip; a source's own command hooks (BatchSource.hooks) run after them.
+    """
+    def __init__(self, hooks=(), max_workers=2, max_pending=4, bus=None, timeout=DEFAULT_HOOK_TIMEOUT):
+        self.hooks = list(hooks)
+        self.max_pending = max(max_pending, max_workers)
+        self.bus = bus
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hook")
+        self.condition = threading.Condition()
+        self.backlog = 0  # Clips whose hooks are queued or running
+        self.failures = 0
+
+    def wait_for_room(self, token=None):
+        """Block while max_pending clips are waiting on their hooks. Returns False if token was cancelled"""
+        with self.condition:
+            while self.backlog >= self.max_pending:
+                if token is not None and token.cancelled:
+                    return False
+                self.condition.wait(0.5)
+        return True
+
+    def submit(self, result, token=None):
+        """Queue the hooks for a successful ClipResult"""
+        hooks = self.hooks + list(result.job.source.hooks or [])
+        if not hooks:
+            return
+        with self.condition:
+            self.backlog += 1
+        self.pool.submit(self.run_hooks, result, hooks, token)
+
+    def run_hooks(self, result, hooks, token=None):
+        job = result.job
+        try:
+            fields = clip_fields(job)
+            for hook in hooks:
+                if token is not None and token.cancelled:
+                    return
+                started = time.time()
+                try:
+                    error = run_command_hook(hook, fields, self.timeout) if isinstance(hook, str) else hook(result)
+                except Exception as e:
+                    error = str(e)
+                if error:
+                    with self.condition:
+                        self.failures += 1
+                    print(f"Hook for {job.describe()} failed: {error}")
+                if self.bus:
+                    name = hook if isinstance(hook, str) else getattr(hook, '__name__', repr(hook))
+                    self.bus.publish('hook_done', clip=job.output_path, hook=name, success=not error,
+                                     error=error or None, elapsed=time.time() - started)
+        finally:
+            with self.condition:
+                self.backlog -= 1
+                self.condition.notify_all()
+
+    def wait(self):
+        """Block until every queued hook has run"""
+        with self.condition:
+            while self.backlog:
+                self.condition.wait()
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown(wait=True)
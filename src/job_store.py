@@ -0,0 +1,228 @@
+# job_store.py
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request
+from local_http import allowed_host_names, is_json, origin_error
+
+DEFAULT_LEASE_SECONDS = 60
+
+class SQLiteJobStore:
+    """Clip job queue in a SQLite file that several worker processes can share.
+
+    Workers claim a job with a lease and keep it alive with heartbeats. A job whose
+    lease expires (the worker died or hung) becomes claimable again.
+    The default rollback journal (DELETE) only needs file locks, so the file can sit on a
+    shared filesystem. WAL is faster but needs shared memory, so use it only when every
+    process runs on the same host (as behind serve_job_store).
+    """
+    def __init__(self, db_path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=3, journal_mode="DELETE"):
+        self.db_path = db_path
+        self.journal_mode = journal_mode
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)")
+
+    def connect(self):
+        # One connection per thread; a busy timeout lets concurrent workers wait for the write lock
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            self.local.conn = conn
+        return _Transaction(conn)
+
+    def submit(self, payload, job_id=None):
+        """Add a job (a JSON-serialisable dict) and return its id"""
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, payload, created, updated) VALUES (?, ?, ?, ?)",
+                (job_id, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def claim(self, worker_id):
+        """Lease the oldest pending (or expired) job to worker_id. Returns (job_id, payload) or None"""
+        now = time.time()
+        with self.connect() as conn:
+            # Jobs whose worker stopped heartbeating go back to the queue, or fail after max_attempts
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired too many times', updated = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'pending' "
+                "OR (status = 'running' AND lease_expires < ?) ORDER BY created LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row[0])
+            )
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id, worker_id):
+        """Extend the lease. Returns False if the job no longer belongs to this worker"""
+        now = time.time()
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + self.lease_seconds, now, job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, error=None):
+        """Mark a leased job as done or failed. Failed jobs are retried until max_attempts"""
+        now = time.time()
+        with self.connect() as conn:
+            if error is None:
+                status_sql = "'done'"
+            else:
+                status_sql = "CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END"
+            params = ([] if error is None else [self.max_attempts]) + [error, now, job_id, worker_id]
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = {status_sql}, worker = NULL, lease_expires = NULL, "
+                "error = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                params
+            )
+        return cursor.rowcount == 1
+
+    def counts(self):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def get(self, job_id):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT status, worker, attempts, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'id': job_id, 'status': row[0], 'worker': row[1], 'attempts': row[2], 'error': row[3]}
+
+class _Transaction:
+    """Runs a block in an IMMEDIATE transaction so claims from different processes never race"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+class HTTPJobStore:
+    """Client for a job store served by serve_job_store(); same interface as SQLiteJobStore"""
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def call(self, method, **params):
+        data = json.dumps(params).encode('utf-8')
+        req = urllib_request.Request(f"{self.url}/{method}", data=data, headers={'Content-Type': 'application/json'})
+        with urllib_request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))['result']
+
+    def submit(self, payload, job_id=None):
+        return self.call('submit', payload=payload, job_id=job_id)
+
+    def claim(self, worker_id):
+        result = self.call('claim', worker_id=worker_id)
+        return tuple(result) if result else None
+
+    def heartbeat(self, job_id, worker_id):
+        return self.call('heartbeat', job_id=job_id, worker_id=worker_id)
+
+    def complete(self, job_id, worker_id, error=None):
+        return self.call('complete', job_id=job_id, worker_id=worker_id, error=error)
+
+    def counts(self):
+        return self.call('counts')
+
+    def get(self, job_id):
+        return self.call('get', job_id=job_id)
+
+def serve_job_store(store, host="127.0.0.1", port=8765, allowed_hosts=()):
+    """Expose a job store over HTTP as POST /<method> with JSON arguments. Returns the server.
+
+    Like the HTTP API, it only answers application/json requests addressed to this
+    machine (or one of allowed_hosts), so web pages can't queue or complete jobs.
+    """
+    methods = {'submit', 'claim', 'heartbeat', 'complete', 'counts', 'get'}
+    allowed_hosts = allowed_host_names(host, allowed_hosts)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.strip('/')
+            if method not in methods:
+                self.send_error(404)
+                return
+            error = origin_error(self.headers, allowed_hosts)
+            if error:
+                self.send_error(403, error)
+                return
+            if not is_json(self.headers):
+                self.send_error(415, "Requests must be sent as Content-Type: application/json")
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                params = json.loads(self.rfile.read(length) or b'{}')
+                inspect.signature(getattr(store, method)).bind(**params)
+            except (ValueError, TypeError) as e:
+                self.send_error(400, f"Bad arguments for {method}: {e}")
+                return
+            try:
+                body = json.dumps({'result': getattr(store, method)(**params)}).encode('utf-8')
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep worker consoles quiet
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def open_job_store(location, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Open an http:// URL as an HTTPJobStore, anything else as a SQLite file"""
+    if location.startswith(('http://', 'https://')):
+        return HTTPJobStore(location)
+    directory = os.path.dirname(os.path.abspath(location))
+    os.makedirs(directory, exist_ok=True)
+    return SQLiteJobStore(location, lease_seconds=lease_seconds)
@@ -0,0 +1,33 @@
+# local_http.py
+"""Host and Origin checks shared by the HTTP servers meant for this machine only.
+
+Browsers send cross-site requests to local ports on behalf of any web page, and
+DNS rebinding lets a page address them under its own name. Refusing requests whose
+Host or Origin names another machine stops both.
+"""
+from urllib.parse import urlsplit
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+def allowed_host_names(host, extra=()):
+    """The lower-case names a server bound to host accepts in Host and Origin"""
+    return {name.lower() for name in LOCAL_HOSTS + (host,) + tuple(extra)}
+
+def hostname(netloc):
+    """The lower-case host of a "host[:port]" value, or None"""
+    try:
+        return urlsplit("//" + netloc).hostname
+    except ValueError:
+        return None
+
+def origin_error(headers, allowed_hosts):
+    """Why a request with these headers must be refused, or None if it may proceed"""
+    if hostname(headers.get('host') or "") not in allowed_hosts:
+        return "Requests must be addressed to this machine (Host header)"
+    origin = headers.get('origin')
+    if origin is not None and hostname(urlsplit(origin).netloc) not in allowed_hosts:
+        return f"Requests from {origin} are not allowed"
+    return None
+
+def is_json(headers):
+    return (headers.get('content-type') or "").split(';')[0].strip().lower() == "application/json"
@@ -0,0 +1,199 @@
+# loudness.py
+import json
+import math
+import os
+import re
+import threading
+from segment_cache import file_fingerprint
+from video_processing import run_ffmpeg_command
+
+ENVELOPE_VERSION = 1
+SILENCE = -70.0  # EBU R128 absolute gate, also used for seconds without audio
+
+EBUR128_LINE = re.compile(r"t:\s*([\d.]+).*?M:\s*(-?[\d.]+|-inf|nan)\s+S:\s*(-?[\d.]+|-inf|nan)")
+FRAME_PEAK = re.compile(r"FTPK:\s*((?:-?[\d.]+|-inf)(?:\s+(?:-?[\d.]+|-inf))*)\s+dBFS")
+
+def _to_energy(lufs):
+    return 10 ** ((lufs + 0.691) / 10)
+
+def _to_lufs(energy):
+    return -0.691 + 10 * math.log10(energy) if energy > 0 else SILENCE
+
+def _number(text):
+    try:
+        value = float(text)
+    except ValueError:
+        return SILENCE
+    return value if math.isfinite(value) else SILENCE
+
+def parse_ebur128_log(stderr_text):
+    """Reduce the ebur128 filter's 100ms log lines to one [momentary, short_term, true_peak] row per second"""
+    seconds = {}
+    for line in stderr_text.splitlines():
+        match = EBUR128_LINE.search(line)
+        if not match:
+            continue
+        # A line at t covers the 100ms ending at t
+        second = max(0, math.ceil(float(match.group(1))) - 1)
+        row = seconds.setdefault(second, {'energy': [], 'blocks': 0, 'short': SILENCE, 'peak': SILENCE})
+        row['blocks'] += 1
+        momentary = _number(match.group(2))
+        if momentary > SILENCE:
+            row['energy'].append(_to_energy(momentary))
+        row['short'] = _number(match.group(3))
+        peak = FRAME_PEAK.search(line)
+        if peak:
+            row['peak'] = max([row['peak']] + [_number(value) for value in peak.group(1).split()])
+
+    envelope = []
+    for second in range(max(seconds) + 1 if seconds else 0):
+        row = seconds.get(second)
+        if row is None:
+            envelope.append([SILENCE, SILENCE, SILENCE])
+            continue
+        # Average the blocks in this second; silent blocks count as zero energy
+        momentary = _to_lufs(sum(row['energy']) / row['blocks']) if row['energy'] else SILENCE
+        envelope.append([round(momentary, 1), round(row['short'], 1), round(row['peak'], 1)])
+    return envelope
+
+def measure_range(envelope, start=0.0, end=None):
+    """Derive loudnorm's measured_* values for start..end seconds from a per-second envelope"""
+    first = max(0, int(start))
+    last = len(envelope) if end is None else min(len(envelope), max(first + 1, int(math.ceil(end))))
+    rows = envelope[first:last]
+
+    # Integrated loudness with the absolute (-70 LUFS) and relative (-10 LU) gates
+    blocks = [row[0] for row in rows if row[0] > SILENCE]
+    if not blocks:
+        return None
+    threshold = _to_lufs(sum(_to_energy(b) for b in blocks) / len(blocks)) - 10
+    gated = [b for b in blocks if b > threshold] or blocks
+    integrated = _to_lufs(sum(_to_energy(b) for b in gated) / len(gated))
+
+    # Loudness range: 10th to 95th percentile of short-term loudness above a -20 LU gate
+    short_terms = [row[1] for row in rows if row[1] > SILENCE]
+    loudness_range = 0.0
+    if short_terms:
+        short_gate = _to_lufs(sum(_to_energy(s) for s in short_terms) / len(short_terms)) - 20
+        short_terms = sorted(s for s in short_terms if s > short_gate)
+        if short_terms:
+            low = short_terms[int(0.10 * (len(short_terms) - 1))]
+            high = short_terms[int(round(0.95 * (len(short_terms) - 1)))]
+            loudness_range = high - low
+
+    return {
+        'input_i': round(integrated, 2),
+        'input_lra': round(loudness_range, 2),
+        'input_tp': round(max(row[2] for row in rows), 2),
+        'input_thresh': round(threshold, 2)
+    }
+
+class LoudnessNormalizer:
+    """One-pass loudnorm with two-pass accuracy from cached per-source measurements.
+
+    Each source (and intro/outro) is analyzed once with the ebur128 filter into a compact
+    per-second loudness envelope, stored in cache_dir under the file's fingerprint. The
+    measured values for any clip range are then computed from the envelope, so every clip
+    gets a single linear loudnorm pass instead of its own analysis pass.
+    """
+    def __init__(self, cache_dir=None, target=-16.0, loudness_range=11.0, true_peak=-1.5):
+        self.cache_dir = cache_dir
+        self.target = target
+        self.loudness_range = loudness_range
+        self.true_peak = true_peak
+        self.lock = threading.Lock()
+        self.envelopes = {}
+        self.analysis_locks = {}
+        self.fingerprints = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def to_dict(self):
+        return {'target': self.target, 'loudness_range': self.loudness_range, 'true_peak': self.true_peak}
+
+    def source_fingerprint(self, path):
+        """file_fingerprint, memoized per path, size and mtime"""
+        stat = os.stat(path)
+        identity = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if identity in self.fingerprints:
+                return self.fingerprints[identity]
+        fingerprint = file_fingerprint(path)
+        with self.lock:
+            self.fingerprints[identity] = fingerprint
+        return fingerprint
+
+    def envelope(self, path):
+        """Return the per-second envelope for a file, analyzing it on first use"""
+        fingerprint = self.source_fingerprint(path)
+        with self.lock:
+            if fingerprint in self.envelopes:
+                return self.envelopes[fingerprint]
+            analysis_lock = self.analysis_locks.setdefault(fingerprint, threading.Lock())
+
+        # Clips of the same source wait for a single analysis instead of each running one
+        with analysis_lock:
+            with self.lock:
+                if fingerprint in self.envelopes:
+                    return self.envelopes[fingerprint]
+            envelope = self.load(fingerprint)
+            if envelope is None:
+                envelope = self.analyze(path)
+                self.store(fingerprint, envelope)
+            with self.lock:
+                self.envelopes[fingerprint] = envelope
+            return envelope
+
+    def cache_path(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.loudness.json")
+
+    def load(self, fingerprint):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.cache_path(fingerprint), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data.get('envelope') if data.get('version') == ENVELOPE_VERSION else None
+
+    def store(self, fingerprint, envelope):
+        if not self.cache_dir:
+            return
+        path = self.cache_path(fingerprint)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({'version': ENVELOPE_VERSION, 'envelope': envelope}, f, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error saving loudness envelope: {e}")
+
+    def analyze(self, path):
+        command = [
+            "-i", path,
+            "-map", "0:a:0",
+            "-af", "ebur128=peak=true",
+            "-f", "null", "-"
+        ]
+        returncode, stdout, stderr = run_ffmpeg_command(command)
+        if returncode == -1:
+            raise RuntimeError("Loudness analysis was stopped")
+        text = stderr.decode(errors='replace')
+        if returncode != 0:
+            if "matches no streams" in text:
+                return []  # No audio: nothing to normalize
+            raise RuntimeError(f"Loudness analysis failed for {os.path.basename(path)}")
+        return parse_ebur128_log(text)
+
+    def audio_filter(self, path, start=0.0, end=None):
+        """Return the loudnorm filter for path (or a range of it), or None if it has no audio"""
+        measured = measure_range(self.envelope(path), start, end)
+        if measured is None:
+            return None
+        return (
+            f"loudnorm=I={self.target}:LRA={self.loudness_range}:TP={self.true_peak}"
+            f":measured_I={measured['input_i']}:measured_LRA={measured['input_lra']}"
+            f":measured_TP={measured['input_tp']}:measured_thresh={measured['input_thresh']}"
+            f":linear=true"
+        )
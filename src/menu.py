@@ -1,7 +1,6 @@
 # menu.py
 import tkinter as tk
 from tkinter import messagebox, filedialog, Toplevel
-import webbrowser
 
 class HyperlinkManager:
     def __init__(self, text):
@@ -31,9 +30,13 @@ class HyperlinkManager:
     def _click(self, event):
         for tag in self.text.tag_names(tk.CURRENT):
             if tag.startswith("link-"):
-                webbrowser.open(self.links[tag])
+                open_url(self.links[tag])
                 return
 
+def open_url(url):
+    import webbrowser  # Deferred so it does not slow down startup
+    webbrowser.open(url)
+
 def create_menu(root, ui_instance=None):  # Make ui_instance optional
     menubar = tk.Menu(root)
     root.config(menu=menubar)
@@ -41,6 +44,7 @@ def create_menu(root, ui_instance=None):  # Make ui_instance optional
     # File Menu
     file_menu = tk.Menu(menubar, tearoff=0)
     file_menu.add_command(label="Open Source Video", command=ui_instance.browse_source_video if ui_instance else None)
+    file_menu.add_command(label="Run Batch File...", command=ui_instance.run_batch_file if ui_instance else None)
     file_menu.add_command(label="Clear Fields", command=ui_instance.clear_fields if ui_instance else None)
     file_menu.add_separator()
     file_menu.add_command(label="Exit", command=root.quit)
@@ -49,31 +53,43 @@ def create_menu(root, ui_instance=None):  # Make ui_instance optional
     # Settings Menu
     settings_menu = tk.Menu(menubar, tearoff=0)
 
-    # Hardware Acceleration Submenu
+    # Hardware Acceleration Submenu (filled in once background GPU detection finishes)
     hw_accel_menu = tk.Menu(settings_menu, tearoff=0)
     if ui_instance and hasattr(ui_instance, 'gpu_detector'):
-        encoders = ui_instance.gpu_detector.get_available_encoders()
-        if encoders:
-            for name, codec in encoders:
-                hw_accel_menu.add_checkbutton(
-                    label=name,
-                    variable=ui_instance.hw_accel_vars[codec],
-                    command=lambda c=codec: ui_instance.toggle_hw_acceleration(c)
-                )
-        else:
-            hw_accel_menu.add_command(
-                label="No GPU detected",
-                state="disabled"
-            )
+        ui_instance.hw_accel_menu = hw_accel_menu
+        populate_hw_accel_menu(hw_accel_menu, ui_instance)
     settings_menu.add_cascade(label="Hardware Acceleration", menu=hw_accel_menu)
     menubar.add_cascade(label="Settings", menu=settings_menu)
 
     # Help Menu
     help_menu = tk.Menu(menubar, tearoff=0)
-    help_menu.add_command(label="User Guide", command=lambda: webbrowser.open("https://github.com/chandrath/Bulk-Clip-Generator"))  # Dummy URL
+    help_menu.add_command(label="User Guide", command=lambda: open_url("https://github.com/chandrath/Bulk-Clip-Generator"))  # Dummy URL
     help_menu.add_command(label="About", command=lambda: show_about(root))  # Pass root to show_about
     menubar.add_cascade(label="Help", menu=help_menu)
 
+def populate_hw_accel_menu(hw_accel_menu, ui_instance):
+    hw_accel_menu.delete(0, tk.END)
+    if not ui_instance.gpu_detector.detection_complete:
+        hw_accel_menu.add_command(
+            label="Detecting GPUs...",
+            state="disabled"
+        )
+        return
+
+    encoders = ui_instance.gpu_detector.get_available_encoders()
+    if encoders:
+        for name, codec in encoders:
+            hw_accel_menu.add_checkbutton(
+                label=name,
+                variable=ui_instance.hw_accel_vars[codec],
+                command=lambda c=codec: ui_instance.toggle_hw_acceleration(c)
+            )
+    else:
+        hw_accel_menu.add_command(
+            label="No GPU detected",
+            state="disabled"
+        )
+
 def show_about(parent):
     about_window = Toplevel(parent)
     about_window.title("About Bulk Clip Generator")
@@ -0,0 +1,302 @@
+# metrics.py
+"""Prometheus metrics for the clip engine.
+
+Clip results come from the progress bus, FFmpeg runs from the process supervisor in
+video_processing, and CPU/RSS of the running FFmpeg processes is sampled from /proc.
+The registry is served as Prometheus text on http://host:port/metrics and/or rewritten
+periodically to a textfile for node_exporter's textfile collector.
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import video_processing
+import stage_graph
+
+DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+RETURN_CODE_RESULTS = {0: "ok", -1: "cancelled", video_processing.STALLED_RETURN_CODE: "stalled"}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+class Metric:
+    """A counter, gauge or histogram with any number of label combinations"""
+    def __init__(self, name, kind, help_text, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, observed = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [count + (value <= bound) for count, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, observed + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+                continue
+            counts, total, observed = value
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {observed}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {observed}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, name, kind, help_text, buckets=None):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(name, kind, help_text, buckets)
+            return self.metrics[name]
+
+    def counter(self, name, help_text):
+        return self._get(name, "counter", help_text)
+
+    def gauge(self, name, help_text):
+        return self._get(name, "gauge", help_text)
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        return self._get(name, "histogram", help_text, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class PrometheusSink:
+    """Progress bus sink that turns clip and batch events into metrics"""
+    def __init__(self, registry):
+        self.clips = registry.counter("clip_jobs_total", "Clip jobs finished, by result")
+        self.clip_seconds = registry.histogram("clip_job_duration_seconds", "Wall-clock time per clip job")
+        self.media_seconds = registry.counter("clip_media_seconds_total", "Seconds of source media cut into successful clips")
+        self.fallbacks = registry.counter("clip_hw_fallbacks_total", "Encodes that fell back from a hardware encoder to libx264")
+        self.fallback_seconds = registry.counter("clip_hw_fallback_seconds_total", "Time lost on failed hardware encodes")
+        self.requeued = registry.counter("clip_verification_failures_total", "Finished clips that failed verification and were re-encoded")
+        self.queue_depth = registry.gauge("clip_queue_depth", "Clip jobs of the current batch not finished yet")
+        self.batch_eta = registry.gauge("clip_batch_eta_seconds", "Predicted time until the current batch finishes")
+        self.sources = registry.counter("clip_sources_total", "Watch-folder recordings finished, by result")
+
+    def handle(self, events):
+        for event in events:
+            if event['type'] == 'clip_done':
+                self.clips.inc(result="success" if event.get('success') else "failed")
+                self.clip_seconds.observe(event.get('elapsed', 0.0))
+                if event.get('success'):
+                    self.media_seconds.inc(event.get('media_seconds', 0.0))
+                for fallback in event.get('fallbacks') or []:
+                    self.fallbacks.inc(encoder=fallback['encoder'])
+                    self.fallback_seconds.inc(fallback['wasted'], encoder=fallback['encoder'])
+            elif event['type'] == 'clip_requeued':
+                self.requeued.inc()
+            elif event['type'] == 'batch_progress':
+                self.queue_depth.set(event['total'] - event['completed'])
+                self.batch_eta.set(event['eta'])
+            elif event['type'] == 'source_done':
+                self.sources.inc(result="success" if event.get('success') else "failed")
+
+class ProcessSampler:
+    """Samples the running FFmpeg processes from /proc and the scratch and cache usage on disk"""
+    def __init__(self, registry, interval=5.0, segment_cache=None):
+        self.interval = interval
+        self.segment_cache = segment_cache
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.cpu_seen = {}
+        self.runs = registry.counter("ffmpeg_runs_total", "FFmpeg/FFprobe runs, by executable and result")
+        self.run_seconds = registry.counter("ffmpeg_run_seconds_total", "Wall-clock time spent in FFmpeg/FFprobe runs")
+        self.frames = registry.counter("ffmpeg_frames_total", "Frames written by FFmpeg runs (divide by run seconds for fps)")
+        self.processes = registry.gauge("ffmpeg_processes", "FFmpeg processes running now")
+        self.cpu_seconds = registry.counter("ffmpeg_cpu_seconds_total", "CPU time used by FFmpeg processes, sampled from /proc")
+        self.rss = registry.gauge("ffmpeg_rss_bytes", "Resident memory of all running FFmpeg processes")
+        self.scratch = registry.gauge("clip_scratch_bytes", "Bytes in this process's clip scratch directories")
+        if segment_cache:
+            self.cache_bytes = registry.gauge("segment_cache_bytes", "Bytes in the segment cache")
+            self.cache_lookups = registry.gauge("segment_cache_lookups", "Segment cache lookups since start, by result")
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def observe_process(self, executable, returncode, elapsed, frames):
+        """video_processing process observer"""
+        name = os.path.splitext(executable)[0]
+        self.runs.inc(executable=name, result=RETURN_CODE_RESULTS.get(returncode, "failed"))
+        self.run_seconds.inc(elapsed, executable=name)
+        if frames:
+            self.frames.inc(frames)
+
+    def start(self):
+        video_processing.process_observers.append(self.observe_process)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+        try:
+            self.sample()  # So the final textfile reflects the end of the run
+        except Exception as e:
+            print(f"Error sampling metrics: {e}")
+        if self.observe_process in video_processing.process_observers:
+            video_processing.process_observers.remove(self.observe_process)
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error sampling metrics: {e}")
+            if self.stopped.wait(self.interval):
+                return
+
+    def sample(self):
+        with video_processing.process_lock:
+            pids = [p.pid for p in video_processing.active_processes if p.poll() is None]
+        self.processes.set(len(pids))
+
+        total_rss = 0
+        for pid in pids:
+            usage = self.read_proc(pid)
+            if usage is None:
+                continue
+            cpu, rss = usage
+            # Count only the CPU time added since the previous sample of this pid
+            self.cpu_seconds.inc(max(0.0, cpu - self.cpu_seen.get(pid, 0.0)))
+            self.cpu_seen[pid] = cpu
+            total_rss += rss
+        self.cpu_seen = {pid: cpu for pid, cpu in self.cpu_seen.items() if pid in pids}
+        self.rss.set(total_rss)
+
+        with stage_graph.scratch_lock:
+            scratch_dirs = list(stage_graph.scratch_dirs)
+        self.scratch.set(sum(directory_size(path) for path in scratch_dirs))
+        if self.segment_cache:
+            self.cache_bytes.set(directory_size(self.segment_cache.cache_dir))
+            stats = self.segment_cache.stats()
+            self.cache_lookups.set(stats['hits'], result="hit")
+            self.cache_lookups.set(stats['misses'], result="miss")
+
+    def read_proc(self, pid):
+        """Return (cpu_seconds, rss_bytes) for a process, or None without /proc"""
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                # Fields after the parenthesised command name; utime and stime are 14 and 15
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f"/proc/{pid}/statm", 'r') as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        cpu = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        return cpu, resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def serve_metrics(registry, host="127.0.0.1", port=9464):
+    """Serve the registry as Prometheus text on GET /metrics. Returns the server"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class TextfileWriter:
+    """Rewrites the registry to a .prom file every interval seconds (atomically, for node_exporter)"""
+    def __init__(self, registry, path, interval=15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.registry.render())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error writing metrics to {self.path}: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+        self.write()
+
+class MetricsService:
+    """Wires a registry to the bus, the FFmpeg supervisor and the configured exporters"""
+    def __init__(self, bus=None, port=None, textfile=None, segment_cache=None, host="127.0.0.1", interval=5.0):
+        self.registry = MetricsRegistry()
+        self.bus = bus
+        self.sink = PrometheusSink(self.registry)
+        if bus:
+            bus.attach(self.sink)
+        self.sampler = ProcessSampler(self.registry, interval, segment_cache).start()
+        self.server = serve_metrics(self.registry, host, port) if port is not None else None
+        self.writer = TextfileWriter(self.registry, textfile).start() if textfile else None
+
+    def close(self):
+        self.sampler.close()
+        if self.writer:
+            self.writer.close()
+        if self.server:
+            self.server.shutdown()
@@ -0,0 +1,236 @@
+# overlays.py
+"""Logos, watermarks and text lower-thirds burned into the clip's own encode.
+
+Overlays are compiled into the filter graph of the cut, so branding costs filter time
+instead of a second decode/encode generation. Times are seconds from the start of the
+clip's range (the intro, if any, is left clean). Each logo is scaled and given its
+opacity once, by OverlayCache, and the prepared PNG is reused by every clip; the
+per-clip work is a single overlay filter.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from segment_cache import file_fingerprint, user_cache_dir
+from video_processing import UserCancellationError, run_ffmpeg_command
+
+# (x, y) for the overlay filter (main_w/overlay_w) and for drawtext (w/text_w), by position name
+OVERLAY_POSITIONS = {
+    "top-left": ("{m}", "{m}"),
+    "top-right": ("main_w-overlay_w-{m}", "{m}"),
+    "bottom-left": ("{m}", "main_h-overlay_h-{m}"),
+    "bottom-right": ("main_w-overlay_w-{m}", "main_h-overlay_h-{m}"),
+    "center": ("(main_w-overlay_w)/2", "(main_h-overlay_h)/2"),
+}
+TEXT_POSITIONS = {
+    "top-left": ("{m}", "{m}"),
+    "top-right": ("w-text_w-{m}", "{m}"),
+    "bottom-left": ("{m}", "h-text_h-{m}"),
+    "bottom-right": ("w-text_w-{m}", "h-text_h-{m}"),
+    "bottom-center": ("(w-text_w)/2", "h-text_h-{m}"),
+    "center": ("(w-text_w)/2", "(h-text_h)/2"),
+}
+
+# FFmpeg's color syntax: a name or #RRGGBB[AA]/0xRRGGBB[AA], optionally @alpha
+COLOR = re.compile(r"(?:[A-Za-z]+|(?:#|0x)[0-9A-Fa-f]{6}(?:[0-9A-Fa-f]{2})?)(?:@(?:\d*\.?\d+|0x[0-9A-Fa-f]{2}))?")
+
+def _color(value, name):
+    """value if it is a valid FFmpeg color, so it can't add options to the filter graph"""
+    if not isinstance(value, str) or not COLOR.fullmatch(value):
+        raise ValueError(f"Invalid {name}: {value!r} (use a color name or #RRGGBB, optionally with @opacity)")
+    return value
+
+def _number(value, name, kind=float):
+    """value as an int or float; strings that aren't plain numbers are refused"""
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}") from None
+
+def _enable(start, end):
+    if end is None:
+        return f"enable='gte(t,{start})'" if start else None
+    return f"enable='between(t,{start},{end})'"
+
+def _filter_path(path):
+    """Quote a path for use as a filter option value (also on Windows, where it has a drive colon)"""
+    # A quote can't be escaped inside quotes: close them, add an escaped quote and reopen
+    return "'" + path.replace('\\', '/').replace(':', '\\:').replace("'", "'\\''") + "'"
+
+class Overlay:
+    """A logo or watermark image; width scales it (keeping its aspect), opacity is 0-1"""
+    def __init__(self, image, position="top-right", margin=24, width=None, opacity=1.0, start=0.0, end=None):
+        if position not in OVERLAY_POSITIONS:
+            raise ValueError(f"Unknown overlay position: {position} (use {', '.join(OVERLAY_POSITIONS)})")
+        self.image = image
+        self.position = position
+        self.margin = _number(margin, "overlay margin", int)
+        self.width = _number(width, "overlay width", int) if width is not None else None
+        self.opacity = _number(opacity, "overlay opacity")
+        if not 0 <= self.opacity <= 1:
+            raise ValueError(f"Overlay opacity must be between 0 and 1, not {opacity}")
+        self.start = _number(start, "overlay start")
+        self.end = _number(end, "overlay end") if end is not None else None
+
+    @classmethod
+    def from_dict(cls, data):
+        known = vars(cls(None))
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def filter(self):
+        x, y = (value.format(m=self.margin) for value in OVERLAY_POSITIONS[self.position])
+        enable = _enable(self.start, self.end)
+        return f"overlay=x={x}:y={y}" + (f":{enable}" if enable else "")
+
+class LowerThird:
+    """A caption on a translucent box, drawn with drawtext; text may span several lines"""
+    def __init__(self, text, position="bottom-left", margin=48, font_size=36, font_color="white", font_file=None,
+                 box_color="black@0.6", padding=16, start=0.0, end=None):
+        if position not in TEXT_POSITIONS:
+            raise ValueError(f"Unknown lower-third position: {position} (use {', '.join(TEXT_POSITIONS)})")
+        self.text = text
+        self.position = position
+        self.margin = _number(margin, "lower-third margin", int)
+        self.font_size = _number(font_size, "lower-third font_size", int)
+        self.font_color = _color(font_color, "lower-third font_color")
+        self.font_file = font_file
+        self.box_color = _color(box_color, "lower-third box_color")
+        self.padding = _number(padding, "lower-third padding", int)
+        self.start = _number(start, "lower-third start")
+        self.end = _number(end, "lower-third end") if end is not None else None
+
+    @classmethod
+    def from_dict(cls, data):
+        known = vars(cls(""))
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def filter_parts(self, cache):
+        """drawtext as a list of strings and deferred text-file paths (see OverlayGraph)"""
+        x, y = (value.format(m=self.margin) for value in TEXT_POSITIONS[self.position])
+        options = ["expansion=none", f"x={x}", f"y={y}", f"fontsize={self.font_size}", f"fontcolor={self.font_color}",
+                   f"box=1:boxcolor={self.box_color}:boxborderw={self.padding}"]
+        if self.font_file:
+            options.append(f"fontfile={_filter_path(self.font_file)}")
+        enable = _enable(self.start, self.end)
+        if enable:
+            options.append(enable)
+        # The text goes through a file so it needs no filter-graph escaping
+        return ["drawtext=textfile=", OverlayText(cache, self.text), ":" + ":".join(options)]
+
+def overlay_from_dict(data):
+    """An Overlay, or a LowerThird when the entry has "text" """
+    return LowerThird.from_dict(data) if 'text' in data else Overlay.from_dict(data)
+
+class OverlayCache:
+    """Prepared overlay images and caption files, shared by every clip (and process) using cache_dir.
+
+    The default cache_dir is in the per-user cache folder, which other users can't write to.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or user_cache_dir("overlays")
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def _entry(self, key_data, extension):
+        key = hashlib.sha256(json.dumps(key_data).encode('utf-8')).hexdigest()
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        return os.path.join(self.cache_dir, f"{key}.{extension}"), lock
+
+    def image(self, overlay):
+        """Path of the overlay's image scaled and faded as requested, preparing it on first use"""
+        path, lock = self._entry([file_fingerprint(overlay.image), overlay.width, overlay.opacity], "png")
+        with lock:
+            if os.path.exists(path):
+                return path
+            os.makedirs(self.cache_dir, exist_ok=True)
+            filters = ["format=rgba"]
+            if overlay.width:
+                filters.append(f"scale={overlay.width}:-1")
+            if overlay.opacity < 1:
+                filters.append(f"colorchannelmixer=aa={overlay.opacity}")
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.png"
+            command = ["-i", overlay.image, "-vf", ",".join(filters), "-frames:v", "1", "-y", temp_path]
+            returncode, stdout, stderr = run_ffmpeg_command(command)
+            if returncode == -1:
+                raise UserCancellationError("Overlay preparation was stopped")
+            if returncode != 0:
+                error_lines = (stderr or b"").decode(errors='replace').strip().split('\n')
+                raise RuntimeError(f"Could not prepare overlay {os.path.basename(overlay.image)}: {error_lines[-1]}")
+            os.replace(temp_path, path)
+        return path
+
+    def text_file(self, text):
+        path, lock = self._entry(["text", text], "txt")
+        with lock:
+            if not os.path.exists(path):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(temp_path, path)
+        return path
+
+class OverlayImage:
+    """The prepared image of an Overlay, looked up only when its stage runs"""
+    def __init__(self, cache, overlay):
+        self.cache = cache
+        self.overlay = overlay
+
+    def resolve(self):
+        return self.cache.image(self.overlay)
+
+    def __str__(self):
+        return f"overlay[{os.path.basename(self.overlay.image)}]"
+
+class OverlayText:
+    def __init__(self, cache, text):
+        self.cache = cache
+        self.text = text
+
+    def resolve(self):
+        return _filter_path(self.cache.text_file(self.text))
+
+    def __str__(self):
+        return json.dumps(self.text)
+
+class OverlayGraph:
+    """A -filter_complex value containing deferred overlay parts"""
+    def __init__(self, parts):
+        self.parts = parts
+
+    def resolve(self):
+        return "".join(part.resolve() if hasattr(part, 'resolve') else part for part in self.parts)
+
+    def __str__(self):
+        return "".join(str(part) for part in self.parts)
+
+def build_overlay_graph(overlays, cache, video_input="0:v:0", first_input=1, output_label="vbrand"):
+    """Return (input_args, graph_parts) that draw overlays over video_input as [output_label].
+
+    Overlay images become extra inputs numbered from first_input. graph_parts is meant
+    for an OverlayGraph, possibly extended with more filters.
+    """
+    input_args = []
+    parts = []
+    current = video_input
+    next_input = first_input
+    for i, overlay in enumerate(overlays):
+        label = output_label if i == len(overlays) - 1 else f"brand{i}"
+        if parts:
+            parts.append(";")
+        if isinstance(overlay, LowerThird):
+            parts += [f"[{current}]"] + overlay.filter_parts(cache) + [f"[{label}]"]
+        else:
+            input_args += ["-i", OverlayImage(cache, overlay)]
+            parts.append(f"[{current}][{next_input}:v]{overlay.filter()}[{label}]")
+            next_input += 1
+        current = label
+    return input_args, parts
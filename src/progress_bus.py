@@ -0,0 +1,192 @@
+# progress_bus.py
+import json
+import queue
+import sys
+import threading
+import time
+
+class ProgressBus:
+    """Collects progress events from worker threads and fans them out to sinks at a fixed rate.
+
+    publish() never blocks: progress-style events are coalesced so only the latest value per
+    key survives until the next flush, while other events (clip finished, errors) are kept in
+    order. Each sink runs on its own thread with a bounded queue, so a slow sink only ever
+    drops its own stale progress updates and never holds up the workers or other sinks.
+    """
+    COALESCED_TYPES = ('clip_progress', 'batch_progress')
+
+    def __init__(self, refresh_interval=0.2):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.events = []
+        self.snapshots = {}
+        self.sinks = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def publish(self, event_type, **fields):
+        event = dict(fields, type=event_type, time=time.time())
+        with self.lock:
+            if event_type in self.COALESCED_TYPES:
+                self.latest[(event_type, fields.get('clip'))] = event
+            else:
+                self.events.append(event)
+
+    def add_snapshot(self, event_type, provider):
+        """Call provider() at every flush that has new events and publish its dict as event_type"""
+        with self.lock:
+            self.snapshots[event_type] = provider
+
+    def attach(self, sink, max_pending=100):
+        """Start delivering flushed events to sink.handle(events) on a dedicated thread"""
+        channel = _SinkChannel(sink, max_pending)
+        with self.lock:
+            self.sinks.append(channel)
+        channel.start()
+        self.start()
+        return sink
+
+    def detach(self, sink):
+        with self.lock:
+            channels = [c for c in self.sinks if c.sink is sink]
+            self.sinks = [c for c in self.sinks if c.sink is not sink]
+        for channel in channels:
+            channel.close()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.refresh_interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            events = sorted(self.events + list(self.latest.values()), key=lambda e: e['time'])
+            self.events = []
+            self.latest = {}
+            snapshots = list(self.snapshots.items()) if events else []
+            sinks = list(self.sinks)
+
+        for event_type, provider in snapshots:
+            try:
+                events.append(dict(provider(), type=event_type, time=time.time()))
+            except Exception as e:
+                print(f"Error building {event_type} snapshot: {e}")
+
+        if events:
+            for channel in sinks:
+                channel.offer(events)
+
+    def close(self):
+        """Deliver anything still pending, then stop all sink threads"""
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        with self.lock:
+            sinks = list(self.sinks)
+            self.sinks = []
+        for channel in sinks:
+            channel.close()
+
+class _SinkChannel:
+    def __init__(self, sink, max_pending):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def offer(self, events):
+        while True:
+            try:
+                self.queue.put_nowait(events)
+                return
+            except queue.Full:
+                # The sink is behind: drop its oldest batch, keeping non-progress events
+                try:
+                    dropped = self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                kept = [e for e in dropped if e['type'] not in ProgressBus.COALESCED_TYPES]
+                events = kept + events
+
+    def run(self):
+        while True:
+            events = self.queue.get()
+            if events is None:
+                return
+            try:
+                self.sink.handle(events)
+            except Exception as e:
+                print(f"Progress sink {type(self.sink).__name__} failed: {e}")
+
+    def close(self):
+        self.queue.put(None)
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+
+class TkSink:
+    """Hands each flushed batch of events to a callback on the Tk thread"""
+    def __init__(self, root, callback):
+        self.root = root
+        self.callback = callback
+
+    def handle(self, events):
+        self.root.after(0, lambda: self.callback(events))
+
+class LoopSink:
+    """Hands each flushed batch of events to a callback on an asyncio event loop"""
+    def __init__(self, loop, callback):
+        self.loop = loop
+        self.callback = callback
+
+    def handle(self, events):
+        self.loop.call_soon_threadsafe(self.callback, events)
+
+class JsonLinesSink:
+    """Writes every event as one JSON object per line (for the command line tools)"""
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def handle(self, events):
+        for event in events:
+            self.stream.write(json.dumps(event, default=str) + "\n")
+        self.stream.flush()
+
+class MetricsSink:
+    """Keeps running totals of events for monitoring"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event_counts = {}
+        self.clips_succeeded = 0
+        self.clips_failed = 0
+        self.last_batch_progress = None
+
+    def handle(self, events):
+        with self.lock:
+            for event in events:
+                self.event_counts[event['type']] = self.event_counts.get(event['type'], 0) + 1
+                if event['type'] == 'clip_done':
+                    if event.get('success'):
+                        self.clips_succeeded += 1
+                    else:
+                        self.clips_failed += 1
+                elif event['type'] == 'batch_progress':
+                    self.last_batch_progress = event
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'event_counts': dict(self.event_counts),
+                'clips_succeeded': self.clips_succeeded,
+                'clips_failed': self.clips_failed,
+                'last_batch_progress': self.last_batch_progress
+            }
@@ -0,0 +1,142 @@
+# readahead.py
+import os
+import queue
+import threading
+from video_processing import run_ffmpeg_command, parse_time_string
+
+# Containers with a seek index (moov/Cues), so FFprobe can jump straight to a time position
+INDEXED_CONTAINERS = ('.mp4', '.mov', '.m4v', '.mkv', '.webm')
+READ_CHUNK = 4 * 1024 * 1024
+RANGE_MARGIN = 8 * 1024 * 1024
+END_WINDOW = 10.0  # Seconds read past a range's end to find the first packet after it
+
+class SourceIndex:
+    """Maps time positions in a source to byte offsets"""
+    def __init__(self, path, duration):
+        self.path = path
+        self.duration = duration
+        self.size = os.path.getsize(path)
+        self.indexed = path.lower().endswith(INDEXED_CONTAINERS)
+
+    def read_offsets(self, start, end):
+        """Return (first, last) byte offsets of the video around start..end seconds, or None.
+
+        Listing every packet would read the whole file, so FFprobe only reads two short
+        intervals: one packet at start (the seek lands on the keyframe before it) and a
+        few seconds from end, for the first packet past the range.
+        """
+        command = [
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-read_intervals", f"{start}%+#1,{end}%+{END_WINDOW}",
+            "-show_entries", "packet=pts_time,pos",
+            "-of", "compact=p=0",
+            self.path
+        ]
+        try:
+            returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
+        except Exception as e:
+            print(f"Could not index {self.path}: {e}")
+            return None
+        if returncode != 0:
+            return None
+
+        packets = []
+        for line in stdout.decode(errors='replace').splitlines():
+            fields = dict(item.partition('=')[::2] for item in line.split('|'))
+            try:
+                packets.append((float(fields['pts_time']), int(fields['pos'])))
+            except (KeyError, ValueError):
+                continue
+        if not packets:
+            return None
+        first = packets[0][1]
+        last = next((offset for time_position, offset in packets[1:] if time_position >= end),
+                    max(offset for _, offset in packets))
+        return first, max(first, last)
+
+    def byte_range(self, start, end):
+        """Return (offset, length) covering the data needed to decode start..end seconds"""
+        offsets = self.read_offsets(start, end) if self.indexed else None
+        if offsets:
+            first, last = offsets
+        else:
+            # No index: assume a roughly constant bitrate and pad generously
+            bytes_per_second = self.size / self.duration if self.duration else 0
+            first = int(start * bytes_per_second)
+            last = int(end * bytes_per_second)
+        first = max(0, first - RANGE_MARGIN)
+        last = min(self.size, last + RANGE_MARGIN)
+        return first, max(0, last - first)
+
+def prefetch_range(path, offset, length):
+    """Ask the OS to pull a byte range into the page cache"""
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+            return
+        # No fadvise (e.g. Windows): reading the range warms the cache just the same
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+def order_for_locality(jobs):
+    """Order jobs by source and then by start time, so each source is read front to back"""
+    return sorted(jobs, key=lambda job: (job.source.source_video, parse_time_string(job.start)))
+
+class ReadAheadPrefetcher:
+    """Prefetches the source data of the next few clip jobs while the current ones encode"""
+    def __init__(self, jobs, lookahead=2, max_bytes=1024 ** 3):
+        self.jobs = list(jobs)
+        self.positions = {job: i for i, job in enumerate(self.jobs)}
+        self.lookahead = lookahead
+        self.max_bytes = max_bytes
+        self.indexes = {}
+        self.prefetched = set()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        for job in self.jobs[:self.lookahead]:
+            self.queue.put(job)
+        return self
+
+    def job_started(self, job):
+        """Queue the jobs that follow job in dispatch order"""
+        position = self.positions.get(job)
+        if position is None:
+            return
+        for upcoming in self.jobs[position + 1:position + 1 + self.lookahead]:
+            self.queue.put(upcoming)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                if job in self.prefetched:
+                    continue
+                self.prefetched.add(job)
+            try:
+                self.prefetch(job)
+            except Exception as e:
+                print(f"Read-ahead failed for {job.describe()}: {e}")
+
+    def prefetch(self, job):
+        source = job.source
+        index = self.indexes.get(source.source_video)
+        if index is None:
+            index = self.indexes[source.source_video] = SourceIndex(source.source_video, source.duration)
+        offset, length = index.byte_range(parse_time_string(job.start), parse_time_string(job.end))
+        prefetch_range(source.source_video, offset, min(length, self.max_bytes))
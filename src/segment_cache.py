@@ -0,0 +1,158 @@
+# segment_cache.py
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import uuid
+
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+
+def user_cache_dir(name):
+    """name inside the per-user cache folder (LOCALAPPDATA, Library/Caches or XDG_CACHE_HOME)"""
+    if sys.platform == "win32":
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+        return os.path.join(base, "BulkClipGenerator", name)
+    if sys.platform == "darwin":
+        return os.path.expanduser(os.path.join("~", "Library", "Caches", "BulkClipGenerator", name))
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, "bulk_clip_generator", name)
+
+def default_cache_dir():
+    """The per-user cache folder for segments"""
+    return user_cache_dir("segment_cache")
+
+def file_fingerprint(path):
+    """Identify a file by its size and a hash of its first and last megabyte"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(f"{size}".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+        if size > FINGERPRINT_SAMPLE_BYTES:
+            f.seek(max(FINGERPRINT_SAMPLE_BYTES, size - FINGERPRINT_SAMPLE_BYTES))
+            digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+class SegmentCache:
+    """Content-addressed store of encoded main segments.
+
+    Entries are keyed by the source's fingerprint, the exact range and the encoder
+    arguments, so clip variants (different intro/outro) reuse the same main segment.
+    A file's mtime doubles as its last-used time for LRU eviction, which keeps the
+    cache consistent when several processes share the directory.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_fingerprint(self, path):
+        """file_fingerprint, memoized per path, size and mtime"""
+        stat = os.stat(path)
+        identity = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if identity in self.fingerprints:
+                return self.fingerprints[identity]
+        fingerprint = file_fingerprint(path)
+        with self.lock:
+            self.fingerprints[identity] = fingerprint
+        return fingerprint
+
+    def make_key(self, source, start, end, encoder_args):
+        key_data = json.dumps([self.source_fingerprint(source), start, end, list(encoder_args)])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def lookup(self, key):
+        """Return the cached segment's path, or None on a miss"""
+        path = self.entry_path(key)
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, file_path, link=True):
+        """Add an encoded segment to the cache and return the cached path.
+
+        With link=False the entry is always a copy. Pass that for files the user owns:
+        a hard link would share the inode, and a later overwrite of the file would
+        silently change the cached segment too.
+        """
+        path = self.entry_path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if not link:
+                raise OSError("copy requested")
+            os.link(file_path, temp_path)  # Free when cache and temp dir share a filesystem
+        except OSError:
+            shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp4"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+            with self.lock:
+                self.evictions += 1
+
+    def refreshing(self):
+        """A view of this cache that never reuses entries but still stores (and so replaces) them"""
+        return RefreshingSegmentCache(self)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class RefreshingSegmentCache:
+    """Used to re-encode a clip whose output failed verification, in case a cached part was bad"""
+    def __init__(self, cache):
+        self.cache = cache
+
+    def make_key(self, source, start, end, encoder_args):
+        return self.cache.make_key(source, start, end, encoder_args)
+
+    def lookup(self, key):
+        return None
+
+    def store(self, key, file_path, link=True):
+        return self.cache.store(key, file_path, link)
@@ -0,0 +1,262 @@
+# segmentation.py
+"""Split a whole recording into fixed-length segments in a single FFmpeg pass.
+
+"Cut this 3-hour stream into 60-second clips" becomes one run of FFmpeg's segment
+muxer instead of 180 separate cuts:
+
+- when every cut point lies on a keyframe (within KEYFRAME_TOLERANCE), or snap=True
+  moves the cut points to the nearest keyframes, the segments are stream-copied and
+  nothing is encoded;
+- otherwise the source is encoded once, with keyframes forced at the cut points, and
+  the segment muxer splits that one encode exactly there.
+
+With an overlap, each segment still starts interval seconds after the previous one
+but runs overlap seconds longer. The pass then splits at every start and end, and
+each segment is joined from its pieces by stream copy. An intro or outro is
+normalized once (through the segment cache) to the source's resolution, frame rate
+and audio channels, so it can be stream-copied onto every segment too; the pass is
+then always the shared encode. With a hardware encoder the encodes try it first and
+fall back to libx264 (try_hw_accelerated_command).
+
+Usage:
+    python segmentation.py stream.mp4 --every 60 [--overlap 5] [--snap] [--output segments/]
+                           [--intro intro.mp4] [--outro outro.mp4] [--compressed] [--hw-encoder h264_nvenc]
+                           [--dry-run]
+"""
+import argparse
+import bisect
+import json
+import os
+import sys
+import threading
+from stage_graph import (
+    CANCELLED_MESSAGE, TEMP_PLACEHOLDER, ClipPlan, Stage, StageExecutor, make_scratch_dir, remove_scratch_dir
+)
+from video_processing import (
+    AUDIO_ARGS, PIXEL_FORMAT_ARGS, UserCancellationError, get_audio_info, get_keyframe_times, get_video_duration,
+    get_video_frame_rate, get_video_resolution, terminate_current_process, video_encoder_args
+)
+
+KEYFRAME_TOLERANCE = 0.1  # Seconds a cut point may be off a keyframe and still be stream-copied
+MIN_SEGMENT = 1.0  # A shorter remainder is added to the last segment instead
+SPLIT_WEIGHT = 9  # The split pass counts nine times as much progress as all joins together
+
+def segment_ranges(duration, interval, overlap=0.0):
+    """(start, end) in seconds of every segment of a duration-long source"""
+    if interval <= 0:
+        raise ValueError("The segment interval must be positive")
+    if overlap < 0:
+        raise ValueError("The overlap can't be negative")
+    ranges = []
+    index = 0
+    while True:
+        start = index * interval
+        end = start + interval + overlap
+        if end >= duration - MIN_SEGMENT:
+            ranges.append((start, duration))
+            return ranges
+        ranges.append((start, end))
+        index += 1
+
+def nearest_keyframe(time, keyframes):
+    position = bisect.bisect_left(keyframes, time)
+    candidates = keyframes[max(0, position - 1):position + 1]
+    return min(candidates, key=lambda keyframe: abs(keyframe - time))
+
+def _time_list(times):
+    return ",".join(f"{time:.6f}" for time in times)
+
+def probe_source_format(source):
+    """{'resolution', 'frame_rate', 'channels'} an intro/outro is conformed to, or None if unknown.
+    channels is None for a source without audio"""
+    resolution = get_video_resolution(source)
+    frame_rate = get_video_frame_rate(source)
+    if not resolution or not frame_rate:
+        return None
+    audio = get_audio_info(source)
+    return {'resolution': resolution, 'frame_rate': frame_rate, 'channels': audio['channels'] if audio else None}
+
+def _conform_args(source_format):
+    """Filter and audio arguments that give an intro/outro the source's format"""
+    width, height = source_format['resolution']
+    video_filter = (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                    f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={source_format['frame_rate']}")
+    if source_format['channels'] is None:
+        return ["-map", "0:v:0", "-vf", video_filter, "-an"]
+    return ["-map", "0:v:0", "-map", "0:a:0?", "-vf", video_filter, "-ac", str(source_format['channels'])]
+
+def plan_segmentation(source, output_dir, duration, interval, overlap=0.0, snap=False, keyframes=None, lossless=True,
+                      intro=None, outro=None, temp_dir=TEMP_PLACEHOLDER, hw_encoder=None, hw_acceleration_enabled=False,
+                      source_format=None):
+    """Plan the split of a whole source as a ClipPlan.
+
+    keyframes are the source's keyframe times (get_keyframe_times); without them the
+    pass is always an encode and snap is ignored. source_format (probe_source_format)
+    lets the intro/outro be conformed and stream-copied; without it every segment with
+    an intro/outro is re-encoded. The plan has one "split" stage, the intro/outro
+    normalization and a "concat" stage for every segment that is joined from pieces or
+    gets an intro/outro. Its outputs are Segment_N_<name>.mp4 in output_dir.
+    """
+    hw = hw_encoder if hw_encoder and hw_acceleration_enabled else None
+    encoder_args = video_encoder_args(lossless, hw_encoder, hw_acceleration_enabled)
+    ranges = segment_ranges(duration, interval, overlap)
+    cut_points = sorted({time for segment in ranges for time in segment} - {0.0, duration})
+    copy = False
+    if keyframes and not intro and not outro:
+        moved = {time: nearest_keyframe(time, keyframes) for time in cut_points}
+        copy = snap or all(abs(moved[time] - time) <= KEYFRAME_TOLERANCE for time in cut_points)
+        if copy:
+            ranges = [(moved.get(start, start), moved.get(end, end)) for start, end in ranges]
+            ranges = [segment for i, segment in enumerate(ranges) if segment[1] > segment[0] and segment not in ranges[:i]]
+            cut_points = sorted(set(moved.values()) - {0.0, duration})
+
+    name = os.path.splitext(os.path.basename(source))[0]
+    outputs = [os.path.join(output_dir, f"Segment_{i}_{name}.mp4") for i in range(1, len(ranges) + 1)]
+    # Without an overlap or stingers the muxer's pieces are the segments themselves
+    direct = not overlap and not intro and not outro
+    if direct:
+        pattern = os.path.join(output_dir, f"Segment_%d_{name.replace('%', '%%')}.mp4")
+        first_piece = 1
+    else:
+        pattern = os.path.join(temp_dir, "piece_%05d.mp4")
+        first_piece = 0
+
+    command = ["-i", source, "-map", "0:v:0", "-map", "0:a:0?"]
+    if copy:
+        command += ["-c", "copy"]
+        # The muxer splits at the first keyframe at or after each time; stay clear of rounding
+        split_times = [time - 0.001 for time in cut_points]
+    else:
+        command += encoder_args + AUDIO_ARGS + PIXEL_FORMAT_ARGS
+        split_times = cut_points
+        if cut_points:
+            command += ["-force_key_frames", _time_list(cut_points)]
+            if hw == "h264_nvenc":
+                command += ["-forced-idr", "1"]  # Forced keyframes are otherwise plain I-frames
+    if cut_points:
+        command += ["-f", "segment", "-segment_times", _time_list(split_times), "-reset_timestamps", "1",
+                    "-segment_start_number", str(first_piece), "-y", pattern]
+    else:
+        command += ["-y", pattern % first_piece]  # A single segment needs no muxer
+    split = Stage("split", "split", command, pattern, hw_encoder=None if copy else hw, duration=duration)
+    if direct:
+        return ClipPlan([split], outputs, temp_dir)
+
+    stages = [split]
+    parts = []
+    for part, path in (("intro", intro), ("outro", outro)):
+        if path:
+            temp_part = os.path.join(temp_dir, f"temp_{part}.mp4")
+            command = ["-i", path] + (_conform_args(source_format) if source_format else ["-map", "0:v:0", "-map", "0:a:0?"])
+            command += encoder_args + AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", temp_part]
+            stages.append(Stage(part, "normalize", command, temp_part, hw_encoder=hw,
+                                cache_range=(path, None, None)))
+            parts.append(part)
+
+    boundaries = [0.0] + cut_points + [duration]
+    for i, (start, end) in enumerate(ranges, 1):
+        pieces = [pattern % (first_piece + n) for n in range(boundaries.index(start), boundaries.index(end))]
+        files = ([os.path.join(temp_dir, "temp_intro.mp4")] if intro else []) + pieces
+        files += [os.path.join(temp_dir, "temp_outro.mp4")] if outro else []
+        command = ["-f", "concat", "-safe", "0", "-i", os.path.join(temp_dir, f"segment_{i}.txt")]
+        reencode = (intro or outro) and not source_format
+        if reencode:
+            command += encoder_args + AUDIO_ARGS + PIXEL_FORMAT_ARGS
+        else:
+            command += ["-map", "0", "-c", "copy"]
+        stages.append(Stage(f"segment_{i}", "concat", command + ["-y", outputs[i - 1]], outputs[i - 1],
+                            inputs=["split"] + parts, hw_encoder=hw if reencode else None, duration=end - start,
+                            concat_files=files))
+    split.weight = SPLIT_WEIGHT * (len(stages) - 1)
+    return ClipPlan(stages, outputs, temp_dir)
+
+def split_video(source, output_dir, interval, overlap=0.0, snap=False, lossless=True, intro=None, outro=None,
+                progress_callback=None, segment_cache=None, executor=None, hw_encoder=None, hw_acceleration_enabled=False):
+    """Split source into interval-second segments in output_dir (see plan_segmentation).
+
+    Returns (success, error_message, outputs).
+    """
+    temp_dir = make_scratch_dir()
+    own_executor = None
+    outputs = []
+    try:
+        duration = get_video_duration(source)
+        keyframes = get_keyframe_times(source)
+        if snap and not keyframes:
+            print(f"No keyframes found in {os.path.basename(source)}, encoding instead of snapping")
+        source_format = probe_source_format(source) if intro or outro else None
+        if (intro or outro) and not source_format:
+            print(f"Couldn't read the format of {os.path.basename(source)}, re-encoding the intro/outro into every segment")
+        plan = plan_segmentation(source, output_dir, duration, interval, overlap, snap, keyframes, lossless,
+                                 intro, outro, temp_dir, hw_encoder, hw_acceleration_enabled, source_format)
+        outputs = plan.outputs
+        if executor is None:
+            executor = own_executor = StageExecutor(max(1, min(4, len(plan.stages))))
+        executor.run_plan(plan, progress_callback, segment_cache)
+        return True, None, outputs
+    except UserCancellationError as e:
+        return False, str(e), outputs
+    except Exception as e:
+        return False, f"Error: {e}", outputs
+    finally:
+        if own_executor:
+            own_executor.shutdown()
+        remove_scratch_dir(temp_dir)
+
+def main():
+    from progress_bus import ProgressBus, JsonLinesSink
+    from segment_cache import SegmentCache
+
+    parser = argparse.ArgumentParser(description="Split a recording into fixed-length segments")
+    parser.add_argument('source')
+    parser.add_argument('--every', type=float, required=True, metavar='SECONDS', help="Segment length")
+    parser.add_argument('--overlap', type=float, default=0.0, metavar='SECONDS', help="Extra seconds each segment shares with the next")
+    parser.add_argument('--snap', action='store_true', help="Move the cut points to the nearest keyframes so nothing is re-encoded")
+    parser.add_argument('--output', help="Output folder (default: the source's folder)")
+    parser.add_argument('--intro')
+    parser.add_argument('--outro')
+    parser.add_argument('--compressed', action='store_true', help="Use compressed instead of lossless quality")
+    parser.add_argument('--hw-encoder', help="Hardware encoder to try first, e.g. h264_nvenc")
+    parser.add_argument('--segment-cache', help="Directory of cached normalized intros/outros")
+    parser.add_argument('--simulate', metavar='SPEC', help="Use the simulated FFmpeg backend, e.g. speed=500")
+    parser.add_argument('--dry-run', action='store_true', help="Print the planned FFmpeg stages instead of running them")
+    args = parser.parse_args()
+    if args.simulate is not None:
+        from simulated_ffmpeg import install
+        install(args.simulate)
+    output_dir = args.output or os.path.dirname(os.path.abspath(args.source))
+
+    if args.dry_run:
+        source_format = probe_source_format(args.source) if args.intro or args.outro else None
+        plan = plan_segmentation(args.source, output_dir, get_video_duration(args.source), args.every, args.overlap,
+                                 args.snap, get_keyframe_times(args.source), not args.compressed, args.intro, args.outro,
+                                 hw_encoder=args.hw_encoder, hw_acceleration_enabled=args.hw_encoder is not None,
+                                 source_format=source_format)
+        print(json.dumps(plan.to_dict()))
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    bus = ProgressBus(refresh_interval=1.0)
+    bus.attach(JsonLinesSink(sys.stdout))
+    result = []
+    # The split runs on a thread so Ctrl+C can stop FFmpeg instead of waiting for it
+    thread = threading.Thread(target=lambda: result.extend(split_video(
+        args.source, output_dir, args.every, args.overlap, args.snap, not args.compressed, args.intro, args.outro,
+        progress_callback=lambda progress: bus.publish('clip_progress', clip=args.source, progress=progress),
+        segment_cache=SegmentCache(args.segment_cache) if args.segment_cache else None,
+        hw_encoder=args.hw_encoder, hw_acceleration_enabled=args.hw_encoder is not None
+    )))
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        terminate_current_process()
+        thread.join()
+    success, error, outputs = result or (False, CANCELLED_MESSAGE, [])
+    bus.publish('segmentation_done', source=args.source, success=success, error=error, outputs=outputs if success else [])
+    bus.close()
+    sys.exit(0 if success else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+# simulated_ffmpeg.py
+"""Fake FFmpeg/FFprobe for scale-testing the scheduler, workers and cancellation.
+
+The simulated processes parse the same argv the pipeline builds, stream -progress
+output at a configurable speed, write small placeholder files instead of video,
+and fail, crash, hang or silently truncate their output on demand. Install it with --simulate SPEC on engine.py or
+worker.py, where SPEC is comma separated key=value pairs, e.g.
+"speed=500,fail=0.01,hang=0.001,truncate=0.01,seed=1,fail_on=h264_nvenc".
+
+Usage:
+    python simulated_ffmpeg.py make-batch DIR [--sources 100] [--clips 100] [--duration 3600]
+    python engine.py DIR/batch.json --simulate speed=1000 --workers 16
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from video_processing import parse_time_string, set_ffmpeg_backend
+
+PLACEHOLDER_MAGIC = b"SIMULATED"
+DEFAULT_MEDIA = {'duration': 3600.0, 'width': 1920, 'height': 1080}
+AUDIO_ONLY_EXTENSIONS = ('.m4a', '.mp3', '.opus')
+
+def write_placeholder(path, duration, width=1920, height=1080):
+    with open(path, 'wb') as f:
+        f.write(PLACEHOLDER_MAGIC + f" duration={duration:.3f} width={width} height={height}\n".encode())
+
+def read_placeholder(path):
+    """Media info of a placeholder file; real files get DEFAULT_MEDIA"""
+    with open(path, 'rb') as f:
+        header = f.read(128)
+    if not header.startswith(PLACEHOLDER_MAGIC):
+        return dict(DEFAULT_MEDIA)
+    info = dict(item.split('=') for item in header.decode().split()[1:])
+    return {'duration': float(info['duration']), 'width': int(info['width']), 'height': int(info['height'])}
+
+class SimulatedBackend:
+    """Settings shared by all simulated processes"""
+    def __init__(self, speed=200.0, fail=0.0, crash=0.0, hang=0.0, fail_on=None, hang_on=None, seed=None,
+                 fps=30.0, progress_interval=0.05, truncate=0.0, keyframe_interval=2.0):
+        self.speed = speed  # Media seconds per wall-clock second; 0 finishes instantly
+        self.fail = fail
+        self.crash = crash
+        self.hang = hang
+        self.truncate = truncate  # Exit 0 but write only half of the output
+        self.fail_on = fail_on  # Fail every command containing this argument text
+        self.hang_on = hang_on
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval  # Seconds between the keyframes of every placeholder
+        self.progress_interval = progress_interval
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pids = itertools.count(4000000)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build from "speed=500,fail=0.01,fail_on=h264_nvenc" style text"""
+        options = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            key, _, value = item.partition('=')
+            options[key] = value if key in ('fail_on', 'hang_on') else float(value)
+        if 'seed' in options:
+            options['seed'] = int(options['seed'])
+        return cls(**options)
+
+    def popen(self, command):
+        with self.lock:
+            roll = self.random.random()
+            pid = next(self.pids)
+        return SimulatedProcess(self, command, roll, pid)
+
+class SimulatedProcess:
+    """Popen stand-in that runs a fake encode or probe on a thread"""
+    def __init__(self, backend, command, roll, pid):
+        self.backend = backend
+        self.args = command
+        self.pid = pid
+        self.returncode = None
+        self.pending_returncode = None
+        self.stopped = threading.Event()
+        self.exited = threading.Event()
+        stdout_read, self.stdout_write = os.pipe()
+        stderr_read, self.stderr_write = os.pipe()
+        self.stdout = os.fdopen(stdout_read, 'rb')
+        self.stderr = os.fdopen(stderr_read, 'rb')
+        self.outcome = self.pick_outcome(roll)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def pick_outcome(self, roll):
+        backend = self.backend
+        text = " ".join(self.args)
+        if backend.fail_on and backend.fail_on in text:
+            return "fail"
+        if backend.hang_on and backend.hang_on in text:
+            return "hang"
+        for outcome, rate in (("fail", backend.fail), ("crash", backend.crash), ("hang", backend.hang),
+                              ("truncate", backend.truncate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return "ok"
+
+    # Popen interface
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self.exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def communicate(self, timeout=None):
+        self.wait(timeout)
+        return self.stdout.read(), self.stderr.read()
+
+    def terminate(self):
+        self.stop(-15)
+
+    def kill(self):
+        self.stop(-9)
+
+    def stop(self, returncode):
+        if not self.exited.is_set():
+            self.pending_returncode = returncode
+            self.stopped.set()
+
+    # Simulation
+
+    def run(self):
+        try:
+            if "ffprobe" in os.path.basename(self.args[0]):
+                returncode = self.probe()
+            else:
+                returncode = self.encode()
+        except Exception as e:
+            self.write(self.stderr_write, f"Error: simulated ffmpeg failed: {e}\n")
+            returncode = 1
+        if self.pending_returncode is not None:
+            returncode = self.pending_returncode
+        os.close(self.stdout_write)
+        os.close(self.stderr_write)
+        self.returncode = returncode
+        self.exited.set()
+
+    def write(self, fd, text):
+        data = text.encode()
+        while data:
+            data = data[os.write(fd, data):]
+
+    def probe(self):
+        path = self.args[-1]
+        if not os.path.exists(path):
+            self.write(self.stderr_write, f"{path}: No such file or directory\n")
+            return 1
+        media = read_placeholder(path)
+        entries = self.args[self.args.index("-show_entries") + 1] if "-show_entries" in self.args else ""
+        if entries.endswith("duration"):
+            self.write(self.stdout_write, f"{media['duration']}\n")
+        elif entries == "stream=width,height":
+            self.write(self.stdout_write, f"{media['width']}x{media['height']}\n")
+        elif entries == "format=duration:stream=codec_type":
+            audio_only = path.lower().endswith(AUDIO_ONLY_EXTENSIONS)
+            streams = [{'codec_type': "audio"}] if audio_only else [{'codec_type': "video"}, {'codec_type': "audio"}]
+            self.write(self.stdout_write, json.dumps({'format': {'duration': str(media['duration'])}, 'streams': streams}))
+        elif entries == "stream=r_frame_rate":
+            self.write(self.stdout_write, "30/1\n")
+        elif entries == "stream=codec_name,sample_rate,channels":
+            self.write(self.stdout_write, "codec_name=aac\nsample_rate=48000\nchannels=2\n")
+        elif entries == "packet=pts_time,flags":
+            interval = self.backend.keyframe_interval
+            count = int(media['duration'] / interval) + 1
+            # One keyframe and one other packet per interval
+            self.write(self.stdout_write, "".join(f"{n * interval:.6f},K__\n{n * interval + interval / 2:.6f},___\n"
+                                                  for n in range(count)))
+        return 0
+
+    def parse_encode(self):
+        """Return (duration, media, output_paths, analyze_loudness) from the ffmpeg argv"""
+        args = self.args[1:]
+        duration = None
+        media = dict(DEFAULT_MEDIA)
+        seek = {}
+        outputs = []
+        input_format = None
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ("-ss", "-to", "-t"):
+                seek[arg] = parse_time_string(args[i + 1])
+                i += 2
+                continue
+            if arg == "-f":
+                input_format = args[i + 1]
+                i += 2
+                continue
+            if arg == "-i":
+                path = args[i + 1]
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"{path}: No such file or directory")
+                # Only the first input sets the clip's length; later ones are overlay images and the like
+                if duration is None and input_format == "concat":
+                    with open(path, 'r', encoding='utf-8') as f:
+                        parts = [line.strip()[len("file '"):-1] for line in f if line.startswith("file '")]
+                    infos = [read_placeholder(part) for part in parts]
+                    media = dict(infos[0], duration=sum(info['duration'] for info in infos))
+                    duration = media['duration']
+                elif duration is None:
+                    media = read_placeholder(path)
+                    if "-to" in seek:
+                        media['duration'] = seek["-to"] - seek.get("-ss", 0.0)
+                    elif "-t" in seek:
+                        media['duration'] = seek["-t"]
+                    duration = media['duration']
+                seek = {}
+                input_format = None
+                i += 2
+                continue
+            if arg == "-y" and i + 1 < len(args):
+                outputs.append(args[i + 1])
+                i += 2
+                continue
+            i += 1
+        analyze = any("ebur128" in arg for arg in args)
+        return duration or 0.0, media, outputs, analyze
+
+    def encode(self):
+        duration, media, outputs, analyze = self.parse_encode()
+        backend = self.backend
+        outcome = self.outcome
+        # Failures and crashes happen part way through, hangs stop reporting progress
+        stop_at = {"fail": 0.3, "crash": 0.6, "hang": 0.5}.get(outcome, 1.0) * duration
+
+        started = time.monotonic()
+        position = 0.0
+        while True:
+            elapsed = time.monotonic() - started
+            position = min(stop_at, duration if not backend.speed else elapsed * backend.speed)
+            self.write(self.stdout_write, (
+                f"frame={int(position * backend.fps)}\nfps={backend.fps * (backend.speed or 1):.1f}\n"
+                f"out_time_us={int(position * 1000000)}\nspeed={backend.speed or 999:.1f}x\nprogress=continue\n"
+            ))
+            if position >= stop_at or self.stopped.wait(backend.progress_interval):
+                break
+        if self.stopped.is_set():
+            return -15
+
+        if outcome == "hang":
+            self.stopped.wait()  # Until the stall watchdog (or the user) stops it
+            return -9
+        if outcome == "fail":
+            self.write(self.stderr_write, "Error while encoding: simulated failure\n")
+            return 1
+        if outcome == "crash":
+            return -11
+
+        if analyze:
+            lines = (f"[Parsed_ebur128_0 @ 0x0] t: {t / 10:.1f} TARGET:-23 LUFS M: -20.0 S: -20.5 I: -20.0 LUFS LRA: 3.0 LU"
+                     f" FTPK: -3.0 -3.0 dBFS TPK: -3.0 -3.0 dBFS\n" for t in range(1, int(duration * 10) + 1))
+            self.write(self.stderr_write, "".join(lines))
+        written = duration / 2 if outcome == "truncate" else duration
+        for path in outputs:
+            if path == "-":
+                continue
+            if "segment" in self.args:
+                for piece, piece_duration in self.segment_pieces(path, written):
+                    write_placeholder(piece, piece_duration, media['width'], media['height'])
+            else:
+                write_placeholder(path, written, media['width'], media['height'])
+        self.write(self.stdout_write, "progress=end\n")
+        return 0
+
+    def segment_pieces(self, pattern, duration):
+        """(path, duration) of every file the segment muxer writes for an output pattern"""
+        args = self.args
+        times = [float(t) for t in args[args.index("-segment_times") + 1].split(',')] if "-segment_times" in args else []
+        first = int(args[args.index("-segment_start_number") + 1]) if "-segment_start_number" in args else 0
+        bounds = [0.0] + [t for t in times if t < duration] + [duration]
+        return [(pattern % (first + i), end - start) for i, (start, end) in enumerate(zip(bounds, bounds[1:]))]
+
+def install(spec):
+    """Route all FFmpeg/FFprobe runs in this process through a SimulatedBackend built from spec"""
+    backend = SimulatedBackend.from_spec(spec)
+    set_ffmpeg_backend(backend)
+    return backend
+
+def make_batch(directory, sources=100, clips=100, duration=3600.0):
+    """Write placeholder sources and a batch.json that cuts clips from each. Returns the batch path"""
+    os.makedirs(directory, exist_ok=True)
+    clip_length = max(1, int(duration / clips))
+    entries = []
+    for n in range(sources):
+        name = f"source_{n:04d}.mp4"
+        write_placeholder(os.path.join(directory, name), duration)
+        ranges = [f"{format_clock(i * clip_length)}-{format_clock(i * clip_length + clip_length)}" for i in range(clips)]
+        entries.append({'source': name, 'ranges': ranges, 'output': "clips"})
+    os.makedirs(os.path.join(directory, "clips"), exist_ok=True)
+    batch_path = os.path.join(directory, "batch.json")
+    with open(batch_path, 'w', encoding='utf-8') as f:
+        json.dump({'sources': entries}, f)
+    return batch_path
+
+def format_clock(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic batches for the simulated FFmpeg backend")
+    parser.add_argument('command', choices=['make-batch'])
+    parser.add_argument('directory')
+    parser.add_argument('--sources', type=int, default=100)
+    parser.add_argument('--clips', type=int, default=100, help="Clips per source")
+    parser.add_argument('--duration', type=float, default=3600.0, help="Length of each source in seconds")
+    args = parser.parse_args()
+    print(make_batch(args.directory, args.sources, args.clips, args.duration))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# simulation_check.py
+"""Push a synthetic batch through engine.py on the simulated FFmpeg backend and check the run.
+
+Catches scheduler regressions without real encodes: the run must exit cleanly, every
+clip must exist with the length of its range, every source must get clips finished in
+the first half of the run (round-robin fairness), and the batch must keep up a minimum
+rate of clips per second. With --overlay every clip also draws a logo, and --verify
+makes the engine probe each finished clip.
+
+Usage:
+    python simulation_check.py [--sources 20] [--clips 20] [--workers 4] [--overlay] [--verify]
+                               [--min-rate 20]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from tempfile import mkdtemp
+from simulated_ffmpeg import make_batch, read_placeholder
+
+DURATION_TOLERANCE = 0.5  # Seconds a simulated clip may differ from its range
+
+def run_check(sources=20, clips=20, workers=4, overlay=False, verify=False, min_rate=20.0, speed=0):
+    """Run the check and return a list of problems (empty when everything passed)"""
+    directory = mkdtemp(prefix="simulation_check_")
+    try:
+        batch_path = make_batch(directory, sources, clips, duration=clips * 10.0)
+        if overlay:
+            with open(os.path.join(directory, "logo.png"), 'wb') as f:
+                f.write(b"\x89PNG\r\n\x1a\n")  # Never decoded by the simulated backend
+            with open(batch_path, 'r', encoding='utf-8') as f:
+                batch = json.load(f)
+            batch['overlays'] = [{'image': "logo.png", 'position': "top-right"}]
+            with open(batch_path, 'w', encoding='utf-8') as f:
+                json.dump(batch, f)
+
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine.py"), batch_path,
+                   "--simulate", f"speed={speed}", "--workers", str(workers),
+                   # Simulated throughput must not leak into the history real runs plan with
+                   "--cost-history", os.path.join(directory, "encode_history.json")]
+        if verify:
+            command.append("--verify")
+        started = time.monotonic()
+        completed = subprocess.run(command, capture_output=True, text=True, cwd=directory)
+        elapsed = time.monotonic() - started
+
+        problems = []
+        if completed.returncode != 0:
+            problems.append(f"engine.py exited with {completed.returncode}: {completed.stderr.strip()[-500:]}")
+        done = []
+        for line in completed.stdout.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('type') == 'clip_done':
+                done.append(event)
+
+        expected = sources * clips
+        if len(done) != expected:
+            problems.append(f"{len(done)} of {expected} clips reported as done")
+        for event in done:
+            name = os.path.basename(event['clip'])
+            if not event['success']:
+                problems.append(f"{name} failed: {event['error']}")
+            elif not os.path.exists(event['clip']):
+                problems.append(f"{name} was reported as done but doesn't exist")
+            elif abs(read_placeholder(event['clip'])['duration'] - 10.0) > DURATION_TOLERANCE:
+                problems.append(f"{name} is {read_placeholder(event['clip'])['duration']}s long, expected 10s")
+
+        # Clip_<n>_source_<k>.mp4: every source should have a clip among the first half
+        early = {os.path.splitext(os.path.basename(event['clip']))[0].split("_", 2)[2] for event in done[:len(done) // 2]}
+        if done and len(early) < sources:
+            problems.append(f"Only {len(early)} of {sources} sources had a clip in the first half of the run")
+
+        rate = len(done) / elapsed if elapsed else float('inf')
+        if rate < min_rate:
+            problems.append(f"Throughput of {rate:.1f} clips/s is below {min_rate} clips/s")
+        print(f"{len(done)} clips in {elapsed:.2f}s ({rate:.1f} clips/s), {len(problems)} problem(s)")
+        return problems
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the scheduler against the simulated FFmpeg backend")
+    parser.add_argument('--sources', type=int, default=20)
+    parser.add_argument('--clips', type=int, default=20, help="10-second clips per source")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--overlay', action='store_true', help="Draw a logo on every clip")
+    parser.add_argument('--verify', action='store_true', help="Probe every finished clip")
+    parser.add_argument('--min-rate', type=float, default=20.0, help="Minimum clips per second")
+    args = parser.parse_args()
+    problems = run_check(args.sources, args.clips, args.workers, args.overlay, args.verify, args.min_rate)
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+# stage_graph.py
+"""Plans every clip as the smallest graph of FFmpeg stages and runs it.
+
+A clip needs at most three kinds of stage: cutting the range from the source,
+normalizing the intro/outro, and concatenating the parts into the output(s). The
+planner leaves out what a clip doesn't need:
+
+- without an intro or outro the cut writes the final output itself, and any
+  renditions, poster and preview fan out from that same encode;
+- with an intro or outro, renditions and thumbnails are folded into the concat;
+- normalized intros/outros go through the segment cache, so a batch that reuses
+  the same intro normalizes it once instead of once per clip;
+- logos and lower-thirds (see overlays.py) are filters in the cut's own encode;
+- drafts encode every part to one small format, so their concat is a stream copy.
+
+Stages run on a StageExecutor as soon as their inputs exist, so a clip's cut and
+intro/outro normalization encode side by side and the concat starts the moment the
+last of them finishes.
+"""
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tempfile import mkdtemp
+from overlays import OverlayCache, OverlayGraph, build_overlay_graph
+from video_processing import (
+    AUDIO_ARGS, PIXEL_FORMAT_ARGS, Rendition, UserCancellationError, build_rendition_outputs,
+    parse_time_string, run_ffmpeg_command, try_hw_accelerated_command, video_encoder_args
+)
+
+CANCELLED_MESSAGE = "Processing was stopped by user"
+TEMP_PLACEHOLDER = "<temp>"
+TEMP_PREFIX = "clip_"  # Scratch directories are <tempdir>/clip_*
+
+# Scratch directories this process is using right now, measured by metrics.py
+scratch_dirs = set()
+scratch_lock = threading.Lock()
+
+def make_scratch_dir():
+    """A new scratch directory, tracked until remove_scratch_dir"""
+    path = mkdtemp(prefix=TEMP_PREFIX)
+    with scratch_lock:
+        scratch_dirs.add(path)
+    return path
+
+def remove_scratch_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    with scratch_lock:
+        scratch_dirs.discard(path)
+
+# Prefix for the error message of a failed stage, by stage kind
+STAGE_ERRORS = {
+    "cut": "",
+    "normalize": "Error normalizing video: ",
+    "concat": "Concatenation failed: ",
+    "split": "Segmenting failed: ",
+}
+
+class DeferredAudioFilter:
+    """A loudnorm filter whose measurements are only looked up when its stage runs"""
+    def __init__(self, loudness, path, start=0.0, end=None):
+        self.loudness = loudness
+        self.path = path
+        self.start = start
+        self.end = end
+
+    def resolve(self):
+        return self.loudness.audio_filter(self.path, self.start, self.end)
+
+    def __str__(self):
+        return f"loudnorm[measured from {os.path.basename(self.path)}]"
+
+class Stage:
+    """One FFmpeg run in a clip plan"""
+    __slots__ = ('name', 'kind', 'command', 'output', 'inputs', 'hw_encoder', 'duration', 'cache_range', 'concat_files', 'weight')
+
+    def __init__(self, name, kind, command, output, inputs=(), hw_encoder=None, duration=None, cache_range=None,
+                 concat_files=None, weight=1):
+        self.name = name
+        self.kind = kind
+        self.command = command
+        self.output = output
+        self.inputs = list(inputs)
+        self.hw_encoder = hw_encoder
+        self.duration = duration
+        # (path, start, end) identifying the stage's input for the segment cache, or None
+        self.cache_range = cache_range
+        # Files a concat stage joins, when they aren't simply the outputs of its inputs
+        self.concat_files = concat_files
+        self.weight = weight  # Share of the plan's progress, relative to the other stages
+
+    def resolved_command(self):
+        """The command with deferred arguments (audio filters, overlay images) resolved;
+        an audio filter that resolves to None drops its -af"""
+        command = []
+        for arg in self.command:
+            if hasattr(arg, 'resolve'):
+                value = arg.resolve()
+                if value is None:
+                    command.pop()
+                    continue
+                arg = value
+            command.append(arg)
+        return command
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'inputs': self.inputs,
+            'output': self.output,
+            'hw_encoder': self.hw_encoder,
+            'command': [str(arg) for arg in self.command]
+        }
+
+class ClipPlan:
+    """The stages for one clip, in dependency order, and the files it produces"""
+    def __init__(self, stages, outputs, temp_dir=TEMP_PLACEHOLDER):
+        self.stages = stages
+        self.outputs = outputs
+        self.temp_dir = temp_dir
+
+    def stage(self, name):
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def to_dict(self):
+        return {'stages': [stage.to_dict() for stage in self.stages], 'outputs': self.outputs}
+
+def plan_clip(source, output, start, end, lossless, intro=None, outro=None, hw_encoder=None, hw_acceleration_enabled=False,
+              renditions=None, thumbnails=None, loudness=None, temp_dir=TEMP_PLACEHOLDER, audio=None, source_audio=None,
+              overlays=None, overlay_cache=None, draft=None):
+    """Turn a clip's options into a ClipPlan without running anything"""
+    if draft:
+        return plan_draft_clip(source, output, start, end, draft, intro, outro, temp_dir)
+    if audio:
+        return plan_audio_clip(source, output, start, end, audio, intro, outro, loudness, source_audio, temp_dir)
+    hw = hw_encoder if hw_encoder and hw_acceleration_enabled else None
+    encoder_args = video_encoder_args(lossless, hw_encoder, hw_acceleration_enabled)
+    start_seconds = parse_time_string(start)
+    end_seconds = parse_time_string(end)
+    segment_duration = max(end_seconds - start_seconds, 1)
+    main_filter = DeferredAudioFilter(loudness, source, start_seconds, end_seconds) if loudness else None
+    fan_out = bool(renditions or thumbnails)
+    main_outputs = renditions or [Rendition("main", name_pattern="{name}{ext}")]
+
+    # Input seeking: FFmpeg jumps to the range instead of decoding everything before it,
+    # so out_time starts advancing right away (the stall watchdog relies on that)
+    cut_input = ["-ss", start, "-to", end, "-i", source]
+    video_map = ["-map", "0:v:0"]
+    overlay_parts = None
+    if overlays:
+        overlay_inputs, overlay_parts = build_overlay_graph(overlays, overlay_cache or OverlayCache())
+        cut_input += overlay_inputs
+        video_map = ["-filter_complex", OverlayGraph(overlay_parts), "-map", "[vbrand]"]
+
+    if not intro and not outro:
+        if fan_out:
+            # Nothing to assemble: every output comes straight from the cut's decode
+            filter_complex, output_args, paths = build_rendition_outputs(
+                main_outputs, output, lossless, video_input="vbrand" if overlays else "0:v",
+                thumbnails=thumbnails, audio_filter=main_filter)
+            if overlay_parts:
+                filter_complex = OverlayGraph(overlay_parts + [";", filter_complex])
+            cut = Stage("cut", "cut", cut_input + ["-filter_complex", filter_complex] + output_args, paths[0],
+                        duration=segment_duration)
+            return ClipPlan([cut], paths, temp_dir)
+        command = cut_input + video_map + ["-map", "0:a:0?"] + encoder_args + _audio_filter_args(main_filter)
+        command += AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", output]
+        cut = Stage("cut", "cut", command, output, hw_encoder=hw, duration=segment_duration, cache_range=(source, start, end))
+        return ClipPlan([cut], [output], temp_dir)
+
+    stages = []
+    parts = []
+    for name, path in (("intro", intro), ("cut", source), ("outro", outro)):
+        if not path:
+            continue
+        if name == "cut":
+            temp_main = os.path.join(temp_dir, "temp_main.mp4")
+            command = cut_input + video_map + ["-map", "0:a:0?"] + encoder_args + _audio_filter_args(main_filter)
+            command += AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", temp_main]
+            stages.append(Stage("cut", "cut", command, temp_main, hw_encoder=hw, duration=segment_duration,
+                                cache_range=(source, start, end)))
+        else:
+            temp_part = os.path.join(temp_dir, f"temp_{name}.mp4")
+            part_filter = DeferredAudioFilter(loudness, path) if loudness else None
+            command = ["-i", path, "-map", "0:v:0", "-map", "0:a:0?"] + encoder_args + _audio_filter_args(part_filter)
+            command += AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", temp_part]
+            stages.append(Stage(name, "normalize", command, temp_part, hw_encoder=hw, cache_range=(path, None, None)))
+        parts.append(name)
+
+    concat_command = ["-f", "concat", "-safe", "0", "-i", os.path.join(temp_dir, "concat.txt")]
+    if fan_out:
+        filter_complex, output_args, outputs = build_rendition_outputs(main_outputs, output, lossless, thumbnails=thumbnails)
+        concat_command += ["-filter_complex", filter_complex] + output_args
+    else:
+        outputs = [output]
+        concat_command += ["-c:v", "libx264", "-preset", "fast", "-crf", "18" if lossless else "23"]
+        concat_command += AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", output]
+    stages.append(Stage("concat", "concat", concat_command, outputs[0], inputs=parts, duration=segment_duration))
+    return ClipPlan(stages, outputs, temp_dir)
+
+def plan_audio_clip(source, output, start, end, audio, intro=None, outro=None, loudness=None, source_audio=None, temp_dir=TEMP_PLACEHOLDER):
+    """Plan an audio-only clip (see AudioOutput); source_audio is the source's get_audio_info()"""
+    start_seconds = parse_time_string(start)
+    end_seconds = parse_time_string(end)
+    segment_duration = max(end_seconds - start_seconds, 1)
+    main_filter = DeferredAudioFilter(loudness, source, start_seconds, end_seconds) if loudness else None
+    copy = audio.can_copy(source_audio) and not loudness
+    # Stingers are encoded to the main part's format so the parts concatenate without re-encoding
+    sample_rate = source_audio['sample_rate'] if source_audio else 48000
+    channels = source_audio['channels'] if source_audio else 2
+    main_codec = ["-c:a", "copy"] if copy else audio.encoder_args(sample_rate, channels)
+    main_args = ["-map", "0:a:0", "-vn"] + _audio_filter_args(main_filter) + main_codec + ["-avoid_negative_ts", "make_zero"]
+    cut_input = ["-ss", start, "-to", end, "-i", source]
+    # A stream copy is cheaper to redo than to cache
+    cache_range = None if copy else (source, start, end)
+
+    if not intro and not outro:
+        cut = Stage("cut", "cut", cut_input + main_args + ["-y", output], output, duration=segment_duration, cache_range=cache_range)
+        return ClipPlan([cut], [output], temp_dir)
+
+    stages = []
+    parts = []
+    for name, path in (("intro", intro), ("cut", source), ("outro", outro)):
+        if not path:
+            continue
+        if name == "cut":
+            temp_main = os.path.join(temp_dir, f"temp_main.{audio.format}")
+            stages.append(Stage("cut", "cut", cut_input + main_args + ["-y", temp_main], temp_main,
+                                duration=segment_duration, cache_range=cache_range))
+        else:
+            temp_part = os.path.join(temp_dir, f"temp_{name}.{audio.format}")
+            part_filter = DeferredAudioFilter(loudness, path) if loudness else None
+            command = ["-i", path, "-map", "0:a:0", "-vn"] + _audio_filter_args(part_filter)
+            command += audio.encoder_args(sample_rate, channels) + ["-y", temp_part]
+            stages.append(Stage(name, "normalize", command, temp_part, cache_range=(path, None, None)))
+        parts.append(name)
+
+    concat_command = ["-f", "concat", "-safe", "0", "-i", os.path.join(temp_dir, "concat.txt"), "-c", "copy", "-y", output]
+    stages.append(Stage("concat", "concat", concat_command, output, inputs=parts, duration=segment_duration))
+    return ClipPlan(stages, [output], temp_dir)
+
+def plan_draft_clip(source, output, start, end, draft, intro=None, outro=None, temp_dir=TEMP_PLACEHOLDER):
+    """Plan a low-resolution draft (see Draft). Renditions, thumbnails, loudness and overlays
+    are left out; every part is encoded to the same small format and concatenated by stream copy"""
+    segment_duration = max(parse_time_string(end) - parse_time_string(start), 1)
+    cut_input = ["-ss", start, "-to", end, "-i", source]
+    streams = ["-map", "0:v:0", "-map", "0:a:0?"]
+    encoder_args = draft.encoder_args()
+
+    if not intro and not outro:
+        cut = Stage("cut", "cut", cut_input + streams + encoder_args + ["-y", output], output,
+                    duration=segment_duration, cache_range=(source, start, end))
+        return ClipPlan([cut], [output], temp_dir)
+
+    stages = []
+    parts = []
+    for name, path in (("intro", intro), ("cut", source), ("outro", outro)):
+        if not path:
+            continue
+        if name == "cut":
+            temp_main = os.path.join(temp_dir, "temp_main.mp4")
+            stages.append(Stage("cut", "cut", cut_input + streams + encoder_args + ["-y", temp_main], temp_main,
+                                duration=segment_duration, cache_range=(source, start, end)))
+        else:
+            temp_part = os.path.join(temp_dir, f"temp_{name}.mp4")
+            stages.append(Stage(name, "normalize", ["-i", path] + streams + encoder_args + ["-y", temp_part], temp_part,
+                                cache_range=(path, None, None)))
+        parts.append(name)
+
+    concat_command = ["-f", "concat", "-safe", "0", "-i", os.path.join(temp_dir, "concat.txt"), "-c", "copy", "-y", output]
+    stages.append(Stage("concat", "concat", concat_command, output, inputs=parts, duration=segment_duration))
+    return ClipPlan(stages, [output], temp_dir)
+
+def _audio_filter_args(audio_filter):
+    return ["-af", audio_filter] if audio_filter else []
+
+def _link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)  # Pin the entry in case it is evicted mid-clip
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def _copy_replace(source, destination):
+    """Copy to a temp file next to destination and swap it in, so destination never shares the source's inode"""
+    temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _in_temp_dir(plan, path):
+    return os.path.dirname(os.path.abspath(path)) == os.path.abspath(plan.temp_dir)
+
+def run_stage(plan, stage, progress_callback=None, segment_cache=None, fallbacks=None):
+    """Run one stage (or reuse its cached output). Raises on failure or cancellation"""
+    command = stage.resolved_command()
+
+    if stage.kind == "concat":
+        with open(command[command.index("-i") + 1], "w", encoding='utf-8') as f:
+            for path in stage.concat_files or [plan.stage(name).output for name in stage.inputs]:
+                f.write(f"file '{path}'\n")
+
+    cache_key = None
+    # Scratch files may share an inode with their cache entry; a clip the user keeps must not,
+    # or the next -y write to that path would rewrite the cached segment as well
+    scratch = _in_temp_dir(plan, stage.output)
+    if segment_cache and stage.cache_range:
+        path, start, end = stage.cache_range
+        # Everything after the input and before the output path describes the encode
+        cache_key = segment_cache.make_key(path, start, end, command[command.index("-i") + 2:-2])
+        cached = segment_cache.lookup(cache_key)
+        if cached:
+            try:
+                if scratch:
+                    _link_or_copy(cached, stage.output)
+                else:
+                    _copy_replace(cached, stage.output)
+                return
+            except OSError:
+                pass  # Evicted in the meantime; encode it after all
+
+    def on_position(position):
+        if progress_callback and stage.duration:
+            progress_callback(min(1.0, position / stage.duration))
+
+    # No fixed timeout: the stall watchdog in run_ffmpeg_command kills a hung stage
+    if stage.hw_encoder:
+        returncode, stdout, stderr = try_hw_accelerated_command(command, stage.hw_encoder, True, progress_callback=on_position, fallbacks=fallbacks)
+    else:
+        returncode, stdout, stderr = run_ffmpeg_command(command, progress_callback=on_position)
+
+    if returncode == -1:
+        raise UserCancellationError(CANCELLED_MESSAGE)
+    if returncode != 0:
+        # Only show actual error messages, not progress output
+        error_lines = (stderr or b"").decode(errors='replace').strip().split('\n')
+        error_message = next((line for line in reversed(error_lines) if 'error' in line.lower()), 'Unknown error occurred')
+        raise RuntimeError(STAGE_ERRORS[stage.kind] + error_message)
+    if cache_key:
+        segment_cache.store(cache_key, stage.output, link=scratch)
+
+class StageExecutor:
+    """Runs the ready stages of every clip on one shared pool.
+
+    max_workers is the budget of FFmpeg processes running at once across all clips;
+    the threads waiting on a plan don't count against it.
+    """
+    def __init__(self, max_workers):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage")
+
+    def run_plan(self, plan, progress_callback=None, segment_cache=None, fallbacks=None):
+        """Run a plan's stages as their inputs become ready, reporting 0-100 with stages weighted by Stage.weight.
+
+        If a stage fails, no new stages are started; the ones already running are allowed to
+        finish (they share the plan's temp files) and the first error is raised.
+        """
+        lock = threading.Lock()
+        fractions = {stage.name: 0.0 for stage in plan.stages}
+        weights = {stage.name: stage.weight for stage in plan.stages}
+        total_weight = sum(weights.values()) or 1
+
+        def report(name, fraction):
+            with lock:
+                fractions[name] = max(fractions[name], fraction)
+                overall = 100 * sum(fractions[n] * weights[n] for n in fractions) / total_weight
+            if progress_callback:
+                progress_callback(overall)
+
+        pending = list(plan.stages)
+        finished = set()
+        running = {}
+        error = None
+        while pending or running:
+            if error is None:
+                for stage in [stage for stage in pending if all(name in finished for name in stage.inputs)]:
+                    pending.remove(stage)
+                    stage_progress = lambda fraction, name=stage.name: report(name, fraction)
+                    running[self.pool.submit(run_stage, plan, stage, stage_progress, segment_cache, fallbacks)] = stage
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    # A cancellation explains any other failure, so report it first
+                    if error is None or isinstance(e, UserCancellationError):
+                        error = e
+                    continue
+                finished.add(stage.name)
+                report(stage.name, 1.0)
+        if error is not None:
+            raise error
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+def cut_video_segment(source, output, start, end, lossless, intro=None, outro=None, progress_callback=None, hw_encoder=None, hw_acceleration_enabled=False, renditions=None, segment_cache=None, thumbnails=None, loudness=None, fallbacks=None, executor=None, audio=None, source_audio=None, overlays=None, overlay_cache=None, draft=None):
+    """Cut start-end from source, add the intro/outro and write the clip.
+
+    When renditions is a list of Rendition objects, the assembled clip is decoded once and
+    split to one encoder per rendition instead of being written to output.
+    When thumbnails is a Thumbnails object, its poster and preview come from that same decode.
+    When segment_cache is a SegmentCache, encoded main segments and normalized intros/outros
+    are reused across calls. When loudness is a LoudnessNormalizer, every part is
+    loudness-normalized in its encode pass. Hardware-to-software fallbacks are appended to
+    the fallbacks list, if given. Stages run on executor (a shared StageExecutor), or on a
+    private pool for this clip alone. When audio is an AudioOutput, only the audio is
+    extracted (source_audio, from get_audio_info, decides whether it can be stream-copied).
+    overlays (Overlay and LowerThird objects) are drawn in the cut's encode, with their
+    prepared images kept in overlay_cache. When draft is a Draft, a fast low-resolution
+    preview is written instead (see plan_draft_clip). Returns (success, error_message).
+    """
+    temp_dir = make_scratch_dir()
+    own_executor = None
+    try:
+        plan = plan_clip(source, output, start, end, lossless, intro, outro, hw_encoder, hw_acceleration_enabled,
+                         renditions, thumbnails, loudness, temp_dir, audio, source_audio, overlays, overlay_cache, draft)
+        if executor is None:
+            executor = own_executor = StageExecutor(len(plan.stages))
+        executor.run_plan(plan, progress_callback, segment_cache, fallbacks)
+        return True, None
+    except UserCancellationError as e:
+        return False, str(e)
+    except Exception as e:
+        return False, f"Error: {e}"
+    finally:
+        if own_executor:
+            own_executor.shutdown()
+        remove_scratch_dir(temp_dir)
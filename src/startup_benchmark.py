@@ -0,0 +1,63 @@
+# startup_benchmark.py
+"""Check that the main window appears within a fixed time budget.
+
+GPU detection is replaced with a stub that takes DETECTION_DELAY seconds, so the
+budget only holds while detection stays off the Tk thread. Importing ui must not
+pull in the engine and its stage graph; that part of the check also runs where no
+display is available.
+
+Usage:
+    python startup_benchmark.py [--budget 1.0]
+"""
+import argparse
+import sys
+import time
+import tkinter as tk
+
+DETECTION_DELAY = 5.0  # Seconds the stub detector takes, like dxdiag on a cold cache
+DEFERRED_MODULES = ("engine", "stage_graph", "asyncio", "batch", "hooks", "segment_cache", "verification")
+
+class SlowGPUDetector:
+    """Stands in for gpu_utils.GPUDetector with a slow detection and no encoders"""
+    def __init__(self, detect_now=True):
+        self.detection_complete = False
+
+    def load(self):
+        time.sleep(DETECTION_DELAY)
+        self.detection_complete = True
+
+    def get_available_encoders(self):
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the main window's startup")
+    parser.add_argument('--budget', type=float, default=1.0, help="Seconds the window may take to appear")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    import ui
+    import_time = time.perf_counter() - started
+    problems = [f"Importing ui loaded {name}" for name in DEFERRED_MODULES if name in sys.modules]
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"No display ({e}); only checked the imports ({import_time:.3f}s)")
+        root = None
+    if root is not None:
+        ui.GPUDetector = SlowGPUDetector
+        started = time.perf_counter()
+        ui.MainUI(root)
+        root.update()  # Draw the window
+        startup_time = import_time + time.perf_counter() - started
+        root.destroy()
+        print(f"Window shown after {startup_time:.3f}s (import {import_time:.3f}s, budget {args.budget}s)")
+        if startup_time > args.budget:
+            problems.append(f"Startup took {startup_time:.3f}s, over the {args.budget}s budget")
+
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
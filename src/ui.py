@@ -4,12 +4,11 @@ import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, simpledialog
 import os
 import re
-from video_processing import cut_video_segment, get_video_duration, validate_time_range, terminate_current_process
+from video_processing import terminate_current_process, Draft
 import threading
 import json
 import time
 from datetime import datetime, timedelta
-import webbrowser
 from gpu_utils import GPUDetector
 
 class TimeRangeSelector(tk.Toplevel):
@@ -151,28 +150,50 @@ class MainUI:
         self.processed_clips = 0
         self.total_duration = 0
         self.current_clip_start = 0
-
-        # Load settings
+        self.cancel_token = None
+        self.segment_cache = None
+        # Opt-in via user_config.json; the folder defaults to the per-user cache directory
+        self.segment_cache_enabled = False
+        self.segment_cache_dir = None
+        self.segment_cache_max_gb = 1.0
+        self.post_clip_hooks = []  # Shell commands from the settings file, see hooks.py
+
+        # Settings and GPU detection are loaded in the background so the window appears immediately
         self.config_file = "user_config.json"
         self.source_video_history = []
         self.intro_clip_history = []
         self.outro_clip_history = []
         self.output_location_history = []
-        self.load_settings()
-
-        # Initialize GPU detection
-        self.gpu_detector = GPUDetector()
+        self.settings_loaded = False
+        self.gpu_detector = GPUDetector(detect_now=False)
         self.hw_accel_vars = {}
+        threading.Thread(target=self.load_startup_state, daemon=True).start()
+
+        # Bind window close event
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+    def load_startup_state(self):
+        """Read settings and detect GPUs off the Tk thread, then apply the results on it"""
+        config = self.read_settings()
+        self.root.after(0, lambda: self.apply_settings(config))
+        try:
+            self.gpu_detector.load()
+        except Exception as e:
+            print(f"Error detecting GPUs: {e}")
+            self.gpu_detector.detection_complete = True
+        self.root.after(0, self.on_gpu_detection_complete)
+
+    def on_gpu_detection_complete(self):
         for _, codec in self.gpu_detector.get_available_encoders():
             self.hw_accel_vars[codec] = tk.BooleanVar(value=False)
 
         self.load_hw_accel_settings()
+        if hasattr(self, 'hw_accel_menu'):
+            from menu import populate_hw_accel_menu
+            populate_hw_accel_menu(self.hw_accel_menu, self)
         if not os.path.exists('hw_accel_settings.json'):
             self.root.after(1000, self.show_hw_accel_dialog)  # Show dialog after window loads
 
-        # Bind window close event
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-
     def create_video_section(self):
         # Source Video Frame
         video_frame = ttk.LabelFrame(self.main_frame, text="Video Settings", padding="10")
@@ -230,10 +251,11 @@ class MainUI:
         self.quality_var = tk.StringVar(value="Lossless")
         ttk.Radiobutton(output_frame, text="Lossless", variable=self.quality_var, value="Lossless").grid(row=1, column=1, sticky="w")
         ttk.Radiobutton(output_frame, text="Compressed", variable=self.quality_var, value="Compressed").grid(row=1, column=2, sticky="w")
+        ttk.Radiobutton(output_frame, text="Draft", variable=self.quality_var, value="Draft").grid(row=1, column=3, sticky="w")
 
         # Quality explanation
-        self.quality_explanation = ttk.Label(output_frame, text="Lossless: Preserves the original video quality, resulting in larger file sizes. \nCompressed: Reduces file size by sacrificing some video quality.", style='Small.TLabel', wraplength=250)
-        self.quality_explanation.grid(row=2, column=0, columnspan=3, sticky="w", pady=5)
+        self.quality_explanation = ttk.Label(output_frame, text="Lossless: Preserves the original video quality, resulting in larger file sizes. \nCompressed: Reduces file size by sacrificing some video quality. \nDraft: Quick low-resolution preview in a \"drafts\" folder for checking ranges.", style='Small.TLabel', wraplength=250)
+        self.quality_explanation.grid(row=2, column=0, columnspan=4, sticky="w", pady=5)
 
     def create_time_section(self):
         # Time Range Frame
@@ -313,78 +335,108 @@ class MainUI:
         """Thread-safe info message display"""
         self.root.after(0, lambda: messagebox.showinfo("Information", message))
 
-    def process_clips(self, parsed_ranges, source_video, intro_clip, outro_clip, output_location, lossless, original_filename, hw_encoder=None, hw_acceleration_enabled=False):
-        self.total_clips = len(parsed_ranges)
+    def process_clips(self, sources, lossless, hw_encoder=None, hw_acceleration_enabled=False, draft=None):
+        # The engine and its stage graph are imported on first use so they don't slow down startup
+        from engine import ClipEngine, CancellationToken
+        from hooks import HookRunner
+        from progress_bus import ProgressBus, TkSink
+        from segment_cache import SegmentCache, default_cache_dir
+        from verification import ClipVerifier
+
+        self.total_clips = sum(len(source.ranges) for source in sources)
         self.start_time = time.time()
         self.processed_clips = 0  # Reset processed clips counter
+        if not self.segment_cache_enabled:
+            self.segment_cache = None
+        elif self.segment_cache is None:
+            try:
+                self.segment_cache = SegmentCache(self.segment_cache_dir or default_cache_dir(),
+                                                  int(self.segment_cache_max_gb * 1024 ** 3))
+            except OSError as e:
+                print(f"Segment cache disabled: {e}")
+        cache_hits = self.segment_cache.hits if self.segment_cache else 0
+
+        # Worker progress is coalesced by the bus and reaches the Tk thread at most 5 times a second
+        bus = ProgressBus(refresh_interval=0.2)
+        bus.attach(TkSink(self.root, self.handle_progress_events))
+        # Hooks from the settings file run for each clip while the next ones encode
+        hooks = HookRunner(self.post_clip_hooks, bus=bus) if self.post_clip_hooks and not draft else None
+        engine = ClipEngine(lossless, hw_encoder, hw_acceleration_enabled, stop_on_error=True, segment_cache=self.segment_cache, bus=bus,
+                            verifier=ClipVerifier(), hooks=hooks, draft=draft)
+        self.cancel_token = token = CancellationToken()
 
         try:
-            for i, (start_time_str, end_time_str) in enumerate(parsed_ranges, 1):
-                if not self.processing_active:
-                    return  # Exit if processing is stopped
-
-                if not validate_time_range(start_time_str, end_time_str, get_video_duration(source_video)):
-                    error_msg = f"Invalid time range: {start_time_str}-{end_time_str}"
-                    self.show_error(error_msg)
-                    self.root.after(0, self.stop_processing)
-                    return
-
-                output_filename = f"Clip_{i}_{original_filename}.mp4"
-                output_path = os.path.join(output_location, output_filename)
-
-                def progress_handler(progress):
-                    if self.processing_active:
-                        clip_progress = ((i - 1) * 100 + progress) / self.total_clips
-                        self.root.after(0, lambda p=clip_progress: self.update_progress(p))
-
-                success, error_message = cut_video_segment(
-                    source_video,
-                    output_path,
-                    start_time_str,
-                    end_time_str,
-                    lossless,
-                    intro_clip if self.use_intro.get() else None,
-                    outro_clip if self.use_outro.get() else None,
-                    progress_callback=progress_handler,
-                    hw_encoder=hw_encoder if hw_acceleration_enabled else None,  # Ensure encoder is passed correctly
-                    hw_acceleration_enabled=hw_acceleration_enabled
-                )
-
-                if not success:
-                    if error_message:
-                        self.show_error(f"Error processing clip {i}: {error_message}")
-                    else:
-                      self.show_error(f"Clip {i} failed without a specific error. Please check your settings.")
-                    self.root.after(0, self.stop_processing)
-                    return
-
-                self.processed_clips += 1
-                if not self.processing_active:
-                    return  # Check again after each clip
+            first_failure = None
+            fallbacks = []
+            retried = 0
+            for result in engine.run(sources, token):
+                if not result.success and not result.cancelled and first_failure is None:
+                    first_failure = result
+                fallbacks.extend(result.fallbacks)
+                retried += result.retries > 0
+            if not self.processing_active:
+                return  # Processing was stopped by the user
+
+            if first_failure:
+                job = first_failure.job
+                if first_failure.error:
+                    self.show_error(f"Error processing {job.describe()}: {first_failure.error}")
+                else:
+                    self.show_error(f"{job.describe().capitalize()} failed without a specific error. Please check your settings.")
+                return
 
-            if self.processing_active:  # Only show completion message if not stopped
-                self.root.after(0, lambda: self.show_info("Video clipping completed!"))
+            notes = []
+            reused = self.segment_cache.hits - cache_hits if self.segment_cache else 0
+            if reused:
+                notes.append(f"{reused} encoded part(s) reused from cache")
+            if fallbacks:
+                notes.append(f"{len(fallbacks)} encode(s) fell back to software after {fallbacks[0]['encoder']} failed")
+            if retried:
+                notes.append(f"{retried} clip(s) re-encoded after failing verification")
+            if hooks and hooks.failures:
+                notes.append(f"{hooks.failures} post-clip hook(s) failed")
+            if draft:
+                notes.append(f"drafts are in the \"{draft.folder}\" folder")
+            if notes:
+                self.show_info(f"Video clipping completed! ({'; '.join(notes)})")
+            else:
+                self.show_info("Video clipping completed!")
 
+        except ValueError as e:
+            self.show_error(str(e))
         except Exception as e:
             self.show_error(f"An unexpected error occurred: {str(e)}")
         finally:
+            if hooks:
+                hooks.close()
+            bus.close()
             self.root.after(0, self.stop_processing)
 
-    def update_progress(self, progress):
+    def handle_progress_events(self, events):
+        """Apply the latest batch_progress event from a flushed batch"""
+        if not self.processing_active:
+            return
+        for event in reversed(events):
+            if event['type'] == 'batch_progress':
+                self.processed_clips = event['completed']
+                self.update_progress(event['progress'], event['eta'])
+                return
+
+    def update_progress(self, progress, remaining_time=None):
         """Update progress bar and time estimates"""
         self.progress_bar["value"] = progress
 
-        # Calculate time remaining
+        # Calculate time remaining (the engine's cost-model estimate when available)
         elapsed_time = time.time() - self.start_time
-        if progress > 0:
+        if remaining_time is None and progress > 0:
             total_time = (elapsed_time * 100) / progress
             remaining_time = total_time - elapsed_time
+        if remaining_time is not None:
             elapsed_str = str(timedelta(seconds=int(elapsed_time)))
             remaining_str = str(timedelta(seconds=int(remaining_time)))
             self.time_text.set(f"Elapsed: {elapsed_str} | Remaining: {remaining_str}")
 
         self.progress_text.set(f"Processing clip {self.processed_clips + 1}/{self.total_clips} ({progress:.1f}%)")
-        self.root.update_idletasks()
 
     def browse_source_video(self):
         file = filedialog.askopenfile(title="Select Source Video", mode="r")
@@ -429,6 +481,7 @@ class MainUI:
     def show_output_folder(self):
         output_location = self.output_location.get()
         if output_location and os.path.exists(output_location):
+            import webbrowser  # Deferred so it does not slow down startup
             webbrowser.open("file:///" + output_location)
         else:
             messagebox.showerror("Error", "Output location is not set or does not exist.")
@@ -477,47 +530,63 @@ class MainUI:
            history_list.pop()
 
     def load_settings(self):
+        self.apply_settings(self.read_settings())
+
+    def read_settings(self):
         try:
             with open(self.config_file, 'r') as f:
-                config = json.load(f)
-                self.source_video_history = config.get('source_video_history', [])
-                self.intro_clip_history = config.get('intro_clip_history', [])
-                self.outro_clip_history = config.get('outro_clip_history', [])
-                self.output_location_history = config.get('output_location_history', [])
-
-                self.source_video_combo['values'] = [os.path.basename(p) for p in self.source_video_history]
-                self.intro_combo['values'] = [os.path.basename(p) for p in self.intro_clip_history]
-                self.outro_combo['values'] = [os.path.basename(p) for p in self.outro_clip_history]
-                self.output_combo['values'] = self.output_location_history
-
-                self.source_video_path.set(config.get('source_video_path', ''))
-                if self.source_video_path.get():
-                    self.source_video_filename.set(os.path.basename(self.source_video_path.get()))
-                    self.source_video_dir.set(os.path.dirname(self.source_video_path.get()))
-
-                self.intro_clip_path.set(config.get('intro_clip_path', ''))
-                if self.intro_clip_path.get():
-                    self.intro_clip_filename.set(os.path.basename(self.intro_clip_path.get()))
-                    self.intro_clip_dir.set(os.path.dirname(self.intro_clip_path.get()))
-
-                self.outro_clip_path.set(config.get('outro_clip_path', ''))
-                if self.outro_clip_path.get():
-                    self.outro_clip_filename.set(os.path.basename(self.outro_clip_path.get()))
-                    self.outro_clip_dir.set(os.path.dirname(self.outro_clip_path.get()))
-
-                self.use_intro.set(config.get('use_intro', False))
-                self.use_outro.set(config.get('use_outro', False))
-                self.toggle_intro_outro()
-                self.time_ranges_text.delete("1.0", tk.END)
-                self.time_ranges_text.insert(tk.END, config.get('time_ranges_text', ''))
-                self.output_location.set(config.get('output_location', ''))
-                self.quality_var.set(config.get('quality_var', 'Lossless'))
+                return json.load(f)
         except FileNotFoundError:
-            pass
+            return None
         except json.JSONDecodeError:
             print(f"Error decoding JSON from {self.config_file}")
+            return None
+
+    def apply_settings(self, config):
+        self.settings_loaded = True
+        if not config:
+            return
+
+        self.source_video_history = config.get('source_video_history', [])
+        self.intro_clip_history = config.get('intro_clip_history', [])
+        self.outro_clip_history = config.get('outro_clip_history', [])
+        self.output_location_history = config.get('output_location_history', [])
+
+        self.source_video_combo['values'] = [os.path.basename(p) for p in self.source_video_history]
+        self.intro_combo['values'] = [os.path.basename(p) for p in self.intro_clip_history]
+        self.outro_combo['values'] = [os.path.basename(p) for p in self.outro_clip_history]
+        self.output_combo['values'] = self.output_location_history
+
+        self.source_video_path.set(config.get('source_video_path', ''))
+        if self.source_video_path.get():
+            self.source_video_filename.set(os.path.basename(self.source_video_path.get()))
+            self.source_video_dir.set(os.path.dirname(self.source_video_path.get()))
+
+        self.intro_clip_path.set(config.get('intro_clip_path', ''))
+        if self.intro_clip_path.get():
+            self.intro_clip_filename.set(os.path.basename(self.intro_clip_path.get()))
+            self.intro_clip_dir.set(os.path.dirname(self.intro_clip_path.get()))
+
+        self.outro_clip_path.set(config.get('outro_clip_path', ''))
+        if self.outro_clip_path.get():
+            self.outro_clip_filename.set(os.path.basename(self.outro_clip_path.get()))
+            self.outro_clip_dir.set(os.path.dirname(self.outro_clip_path.get()))
+
+        self.use_intro.set(config.get('use_intro', False))
+        self.use_outro.set(config.get('use_outro', False))
+        self.toggle_intro_outro()
+        self.time_ranges_text.delete("1.0", tk.END)
+        self.time_ranges_text.insert(tk.END, config.get('time_ranges_text', ''))
+        self.output_location.set(config.get('output_location', ''))
+        self.quality_var.set(config.get('quality_var', 'Lossless'))
+        self.post_clip_hooks = config.get('post_clip_hooks', [])
+        self.segment_cache_enabled = config.get('segment_cache_enabled', False)
+        self.segment_cache_dir = config.get('segment_cache_dir')
+        self.segment_cache_max_gb = config.get('segment_cache_max_gb', 1.0)
 
     def save_settings(self):
+        if not self.settings_loaded:
+            return  # Don't overwrite the saved settings with an empty form
         config = {
             'source_video_history': self.source_video_history,
             'intro_clip_history': self.intro_clip_history,
@@ -530,7 +599,11 @@ class MainUI:
             'use_outro': self.use_outro.get(),
             'time_ranges_text': self.time_ranges_text.get("1.0", tk.END).strip(),
             'output_location': self.output_location.get(),
-            'quality_var': self.quality_var.get()
+            'quality_var': self.quality_var.get(),
+            'post_clip_hooks': self.post_clip_hooks,
+            'segment_cache_enabled': self.segment_cache_enabled,
+            'segment_cache_dir': self.segment_cache_dir,
+            'segment_cache_max_gb': self.segment_cache_max_gb
         }
         with open(self.config_file, 'w') as f:
             json.dump(config, f, indent=4)
@@ -554,6 +627,8 @@ class MainUI:
     def stop_processing(self):
         if self.processing_active:
             self.processing_active = False
+            if self.cancel_token:
+                self.cancel_token.cancel()
             terminate_current_process()
             self.start_stop_button.config(text="Start Processing", style='Success.Modern.TButton')
             self.progress_text.set("Processing stopped")
@@ -595,25 +670,58 @@ class MainUI:
             return
 
         # Parse time ranges
-        time_ranges = time_ranges_text.split(',')
-        parsed_ranges = []
-        for range_str in time_ranges:
-            match = re.match(r"(\d{1,2}:?\d{2}:?\d{2}|\d{1,2}:?\d{2})-(\d{1,2}:?\d{2}:?\d{2}|\d{1,2}:?\d{2})", range_str.strip())
-            if match:
-                start_time_str, end_time_str = match.groups()
-                parsed_ranges.append((start_time_str, end_time_str))
-            else:
-                self.show_error(f"Invalid time range format: {range_str.strip()}")
+        from batch import BatchSource, parse_time_ranges
+        try:
+            parsed_ranges = parse_time_ranges(time_ranges_text)
+        except ValueError as e:
+            self.show_error(str(e))
+            return
+
+        sources = [BatchSource(source_video, parsed_ranges, intro_clip, outro_clip, output_location)]
+        self.launch_processing(sources, lossless)
+
+    def run_batch_file(self):
+        """Process several source videos described in a JSON batch file"""
+        if self.processing_active:
+            messagebox.showinfo("Processing", "A processing task is already active.")
+            return
+
+        batch_file = filedialog.askopenfilename(title="Select Batch File", filetypes=[("Batch files", "*.json"), ("All files", "*.*")])
+        if not batch_file:
+            return
+
+        from batch import load_batch_file
+        try:
+            sources = load_batch_file(batch_file)
+        except (OSError, ValueError, KeyError) as e:
+            self.show_error(f"Could not load batch file: {e}")
+            return
+
+        if not sources:
+            self.show_error("The batch file does not contain any sources.")
+            return
+        for source in sources:
+            for path in (source.source_video, source.intro, source.outro):
+                if path and not os.path.exists(path):
+                    self.show_error(f"File not found: {path}")
+                    return
+            if not os.path.exists(source.output_location):
+                self.show_error(f"Output location does not exist: {source.output_location}")
                 return
 
-        # Get selected hardware encoder and check if it's enabled
-        hw_encoder = None
-        hw_acceleration_enabled = False
+        self.launch_processing(sources, self.quality_var.get() == "Lossless")
+
+    def get_selected_hw_encoder(self):
+        """Return the enabled hardware encoder, or None"""
         for codec, var in self.hw_accel_vars.items():
             if var.get():
-                hw_encoder = codec
-                hw_acceleration_enabled = True
-                break
+                return codec
+        return None
+
+    def launch_processing(self, sources, lossless):
+        # Get selected hardware encoder and check if it's enabled
+        hw_encoder = self.get_selected_hw_encoder()
+        hw_acceleration_enabled = hw_encoder is not None
 
         # Start processing
         self.start_stop_button.config(text="Stop Processing", style='Danger.Modern.TButton')
@@ -623,19 +731,13 @@ class MainUI:
         self.time_text.set("Calculating time remaining...")
         self.start_stop_button.config(state=tk.NORMAL)  # Ensure button is enabled
 
-        original_filename = os.path.splitext(os.path.basename(source_video))[0]
-
         # Start processing in a separate thread
         threading.Thread(target=self.process_clips, args=(
-            parsed_ranges,
-            source_video,
-            intro_clip,
-            outro_clip,
-            output_location,
+            sources,
             lossless,
-            original_filename,
             hw_encoder,
-            hw_acceleration_enabled
+            hw_acceleration_enabled,
+            Draft() if self.quality_var.get() == "Draft" else None
         )).start()
 
     def save_hw_accel_settings(self):
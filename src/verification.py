@@ -0,0 +1,87 @@
+# verification.py
+"""Checks finished clips before anyone has to watch them.
+
+FFmpeg can exit 0 and still leave a short or broken file (a truncated source, a
+full disk, a driver hiccup in a hardware encoder). A clip passes verification when
+every output it should have produced exists, probes to the expected length (the
+range plus intro and outro) and has the expected stream. With decode=True every
+file is also decoded to -f null, which finds corrupt packets that the container
+headers don't show.
+"""
+import json
+import os
+from video_processing import run_ffmpeg_command
+
+def media_outputs(output, renditions=None, audio=None):
+    """The audio/video files a clip writes (thumbnails are left out)"""
+    if renditions and not audio:
+        return [rendition.output_path(output) for rendition in renditions]
+    return [output]
+
+def probe_media(path):
+    """Return (duration, stream_types) of a file, or raise ValueError if FFprobe can't read it"""
+    command = [
+        "-v", "error",
+        "-show_entries", "format=duration:stream=codec_type",
+        "-of", "json",
+        path
+    ]
+    returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
+    if returncode != 0:
+        message = (stderr or b"").decode(errors='replace').strip().split('\n')[-1]
+        raise ValueError(message or f"FFprobe exited with code {returncode}")
+    info = json.loads(stdout.decode() or "{}")
+    duration = info.get('format', {}).get('duration')
+    return (float(duration) if duration not in (None, "N/A") else None,
+            {stream.get('codec_type') for stream in info.get('streams', [])})
+
+class ClipVerifier:
+    """Probes (and optionally decodes) finished clips.
+
+    A duration passes when it is within tolerance seconds or relative_tolerance of the
+    expected one, whichever is larger; cuts land on frame boundaries and stream-copied
+    audio on codec frames, so an exact match is not expected.
+    """
+    def __init__(self, decode=False, tolerance=1.0, relative_tolerance=0.02):
+        self.decode = decode
+        self.tolerance = tolerance
+        self.relative_tolerance = relative_tolerance
+
+    def verify(self, paths, expected_duration, stream_type="video"):
+        """Return an error message for the first bad file, or None if they all pass"""
+        for path in paths:
+            error = self.verify_file(path, expected_duration, stream_type)
+            if error:
+                return f"{os.path.basename(path)}: {error}"
+        return None
+
+    def verify_file(self, path, expected_duration, stream_type="video"):
+        try:
+            if os.path.getsize(path) == 0:
+                return "file is empty"
+        except OSError:
+            return "file is missing"
+        try:
+            duration, stream_types = probe_media(path)
+        except ValueError as e:
+            return f"cannot be read ({e})"
+        if stream_type not in stream_types:
+            return f"no {stream_type} stream"
+        allowed = max(self.tolerance, expected_duration * self.relative_tolerance)
+        if duration is None or abs(duration - expected_duration) > allowed:
+            found = "unknown" if duration is None else f"{duration:.1f}s"
+            return f"duration is {found}, expected {expected_duration:.1f}s"
+        if self.decode:
+            return self.decode_errors(path)
+        return None
+
+    def decode_errors(self, path):
+        """Decode every stream (on all cores) and return the first decoder error, or None"""
+        command = ["-v", "error", "-threads", "0", "-i", path, "-map", "0", "-f", "null", "-"]
+        returncode, stdout, stderr = run_ffmpeg_command(command)
+        if returncode == -1:
+            return "verification was stopped"
+        errors = (stderr or b"").decode(errors='replace').strip()
+        if returncode != 0 or errors:
+            return f"decode failed ({errors.splitlines()[0] if errors else f'exit code {returncode}'})"
+        return None
@@ -2,20 +2,134 @@
 import subprocess
 import os
 import sys
-from tempfile import mkdtemp
-import shutil
 import signal
+import threading
+import time
 
-# Global variable to store current FFmpeg process
-current_process = None
+# FFmpeg processes currently running (several clips may encode in parallel)
+active_processes = set()
+cancelled_processes = set()
+process_lock = threading.Lock()
+
+# Stall watchdog: an FFmpeg job whose out_time stops advancing for this many
+# seconds is killed and retried up to STALL_RETRIES times
+STALL_TIMEOUT = 30.0
+STALL_RETRIES = 1
+STALLED_RETURN_CODE = -2
+
+# Circuit breaker: after HW_FAILURE_THRESHOLD failures in a row a hardware encoder is
+# skipped for HW_COOLDOWN seconds, then a single job probes it again
+HW_FAILURE_THRESHOLD = 2
+HW_COOLDOWN = 300.0
+
+# Callbacks observer(executable, returncode, elapsed, frames) run after every FFmpeg/FFprobe
+# attempt, e.g. to feed metrics.py; frames is the last frame count FFmpeg reported (or 0)
+process_observers = []
+
+# Optional stand-in that starts processes instead of subprocess.Popen (see simulated_ffmpeg.py)
+ffmpeg_backend = None
 
 class UserCancellationError(Exception):
     """Custom exception for user-initiated cancellation."""
     pass
 
-def run_ffmpeg_command(command_args, is_ffprobe=False, timeout=None):
-    global current_process
+def configure_watchdog(stall_timeout=None, retries=None):
+    """Change the stall window (seconds, or 0 to disable) and the number of retries"""
+    global STALL_TIMEOUT, STALL_RETRIES
+    if stall_timeout is not None:
+        STALL_TIMEOUT = stall_timeout
+    if retries is not None:
+        STALL_RETRIES = retries
+
+class EncoderHealth:
+    """Per-session failure tracking for hardware encoders, shared by every FFmpeg call"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+
+    def allow(self, encoder):
+        """True if the encoder should be tried (closed breaker, or the one probe after cooldown)"""
+        with self.lock:
+            state = self.states.get(encoder)
+            if state is None or state['failures'] < HW_FAILURE_THRESHOLD:
+                return True
+            if state['probing'] or time.monotonic() < state['open_until']:
+                return False
+            state['probing'] = True
+            return True
+
+    def record_success(self, encoder):
+        with self.lock:
+            self.states.pop(encoder, None)
+
+    def record_failure(self, encoder):
+        with self.lock:
+            state = self.states.setdefault(encoder, {'failures': 0, 'open_until': 0.0, 'probing': False})
+            state['failures'] += 1
+            state['probing'] = False
+            if state['failures'] >= HW_FAILURE_THRESHOLD:
+                state['open_until'] = time.monotonic() + HW_COOLDOWN
+
+    def release(self, encoder):
+        """Give up a probe without a verdict (the job was cancelled)"""
+        with self.lock:
+            state = self.states.get(encoder)
+            if state:
+                state['probing'] = False
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                encoder: {'failures': state['failures'], 'retry_in': max(0.0, state['open_until'] - now)}
+                for encoder, state in self.states.items()
+            }
+
+encoder_health = EncoderHealth()
+
+def configure_encoder_health(failure_threshold=None, cooldown=None):
+    """Change how many failures open the breaker and how long it stays open"""
+    global HW_FAILURE_THRESHOLD, HW_COOLDOWN
+    if failure_threshold is not None:
+        HW_FAILURE_THRESHOLD = failure_threshold
+    if cooldown is not None:
+        HW_COOLDOWN = cooldown
+
+def set_ffmpeg_backend(backend):
+    """Route every FFmpeg/FFprobe run through backend.popen(command); None restores the real executables"""
+    global ffmpeg_backend
+    ffmpeg_backend = backend
+
+def parse_progress_time(key, value):
+    """Return the output position in seconds from an FFmpeg -progress line, or None"""
+    if value == "N/A":
+        return None
+    try:
+        if key in ("out_time_us", "out_time_ms"):  # Both are in microseconds
+            return int(value) / 1000000
+        if key == "out_time":
+            hours, minutes, seconds = value.split(':')
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+    return None
 
+def stop_process(process):
+    if process.poll() is None:
+        try:
+            process.terminate()
+            process.wait(timeout=5)  # Wait up to 5 seconds for graceful termination
+        except subprocess.TimeoutExpired:
+            process.kill()  # Force kill if process doesn't terminate gracefully
+
+def run_ffmpeg_command(command_args, is_ffprobe=False, timeout=None, progress_callback=None):
+    """Run ffmpeg/ffprobe and return (returncode, stdout, stderr).
+
+    FFmpeg jobs are supervised through their -progress output: a job whose out_time stops
+    advancing for STALL_TIMEOUT seconds is killed and retried. progress_callback(seconds)
+    receives the output position as it advances. A return code of -1 means the process was
+    cancelled or hit the absolute timeout.
+    """
     if getattr(sys, 'frozen', False):
         base_path = sys._MEIPASS
     else:
@@ -24,54 +138,153 @@ def run_ffmpeg_command(command_args, is_ffprobe=False, timeout=None):
     executable = "ffprobe.exe" if is_ffprobe else "ffmpeg.exe"
     ffmpeg_path = os.path.join(base_path, "ffmpeg", executable)
 
-    if not os.path.exists(ffmpeg_path):
+    if ffmpeg_backend is None and not os.path.exists(ffmpeg_path):
         raise FileNotFoundError(f"{executable} not found at {ffmpeg_path}")
 
-    full_command = [ffmpeg_path] + command_args
+    if is_ffprobe:
+        started = time.monotonic()
+        result = run_process([ffmpeg_path] + command_args, executable, timeout)
+        notify_process_observers(executable, result[0], time.monotonic() - started, None)
+        return result
+
+    full_command = [ffmpeg_path, "-progress", "pipe:1", "-nostats"] + command_args
+    for attempt in range(STALL_RETRIES + 1):
+        started = time.monotonic()
+        returncode, stdout, stderr = run_supervised_process(full_command, executable, timeout, progress_callback)
+        notify_process_observers(executable, returncode, time.monotonic() - started, stdout)
+        if returncode != STALLED_RETURN_CODE:
+            break
+        print(f"{executable} made no progress for {STALL_TIMEOUT:.0f}s (attempt {attempt + 1}/{STALL_RETRIES + 1})")
+    return returncode, stdout, stderr
+
+def notify_process_observers(executable, returncode, elapsed, progress_output):
+    if not process_observers:
+        return
+    frames = 0
+    for line in reversed((progress_output or b"").decode(errors='replace').splitlines()):
+        if line.startswith("frame="):
+            try:
+                frames = int(line[len("frame="):])
+            except ValueError:
+                pass
+            break
+    for observer in list(process_observers):
+        try:
+            observer(executable, returncode, elapsed, frames)
+        except Exception as e:
+            print(f"Error in process observer: {e}")
+
+def start_process(full_command):
     startupinfo = None
     if sys.platform == "win32":
          startupinfo = subprocess.STARTUPINFO()
          startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
          startupinfo.wShowWindow = subprocess.SW_HIDE
 
-    try:
-        current_process = subprocess.Popen(
+    if ffmpeg_backend is not None:
+        process = ffmpeg_backend.popen(full_command)
+    else:
+        process = subprocess.Popen(
             full_command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             startupinfo = startupinfo
         )
-        stdout, stderr = current_process.communicate(timeout=timeout)  # Added timeout
-        return_code = current_process.returncode
-        return return_code, stdout, stderr
+    with process_lock:
+        active_processes.add(process)
+    return process
+
+def finish_process(process):
+    """Unregister a process; returns True if it was stopped by terminate_current_process"""
+    with process_lock:
+        active_processes.discard(process)  # Ensure process is cleared
+        cancelled = process in cancelled_processes
+        cancelled_processes.discard(process)
+    return cancelled
+
+def run_process(full_command, executable, timeout=None):
+    process = None
+    try:
+        process = start_process(full_command)
+        stdout, stderr = process.communicate(timeout=timeout)  # Added timeout
+        return process.returncode, stdout, stderr
     except subprocess.TimeoutExpired:
         # Process timed out, attempt to terminate gracefully
-        if current_process.poll() is None:
+        stop_process(process)
+        return -1, None, b"TimeoutExpired"
+    except Exception as e:
+        raise RuntimeError(f"Failed to execute {executable}: {str(e)}")
+    finally:
+        if process is not None and finish_process(process):
+            return -1, None, b"Cancelled"
+
+def run_supervised_process(full_command, executable, timeout=None, progress_callback=None):
+    """Run FFmpeg while a watchdog checks that its out_time keeps advancing"""
+    process = None
+    try:
+        process = start_process(full_command)
+        state = {'position': -1.0, 'advanced': time.monotonic()}
+        stdout_lines = []
+        stderr_chunks = []
+
+        def read_progress():
+            for raw_line in process.stdout:
+                stdout_lines.append(raw_line)
+                key, _, value = raw_line.decode(errors='replace').strip().partition('=')
+                position = parse_progress_time(key, value)
+                if position is not None and position > state['position']:
+                    state['position'] = position
+                    state['advanced'] = time.monotonic()
+                    if progress_callback:
+                        progress_callback(position)
+
+        readers = [
+            threading.Thread(target=read_progress, daemon=True),
+            threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+
+        started = time.monotonic()
+        result = None
+        while process.poll() is None:
             try:
-                current_process.terminate()
-                current_process.wait(timeout=5)
+                process.wait(timeout=0.5)
+                break
             except subprocess.TimeoutExpired:
-                current_process.kill()
-        return -1, None, "TimeoutExpired"
+                pass
+            now = time.monotonic()
+            if STALL_TIMEOUT and now - state['advanced'] > STALL_TIMEOUT:
+                stop_process(process)
+                message = f"FFmpeg error: no progress for {STALL_TIMEOUT:.0f}s at {state['position']:.1f}s, process killed"
+                result = (STALLED_RETURN_CODE, message.encode())
+            elif timeout and now - started > timeout:
+                stop_process(process)
+                result = (-1, b"TimeoutExpired")
+
+        for reader in readers:
+            reader.join(timeout=5)
+        stdout = b"".join(stdout_lines)
+        if result:
+            return result[0], stdout, result[1]
+        return process.returncode, stdout, b"".join(stderr_chunks)
     except Exception as e:
         raise RuntimeError(f"Failed to execute {executable}: {str(e)}")
     finally:
-        current_process = None  # Ensure process is cleared
+        if process is not None and finish_process(process):
+            return -1, None, b"Cancelled"
 
 def terminate_current_process():
-    global current_process
-    if current_process and current_process.poll() is None:
+    """Terminate every running FFmpeg process. Returns True if any were stopped."""
+    with process_lock:
+        processes = [p for p in active_processes if p.poll() is None]
+        cancelled_processes.update(processes)
+    for process in processes:
         try:
-            current_process.terminate()
-            current_process.wait(timeout=5)  # Wait up to 5 seconds for graceful termination
-        except subprocess.TimeoutExpired:
-             current_process.kill()  # Force kill if process doesn't terminate gracefully
+            stop_process(process)
         except Exception as e:
             print(f"Error terminating process: {e}")
-        finally:
-            current_process = None
-        return True
-    return False
+    return bool(processes)
 
 def get_video_duration(video_path):
     if not os.path.exists(video_path):
@@ -88,8 +301,8 @@ def get_video_duration(video_path):
     try:
         returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
 
-        if returncode != 0:
-            # Try alternative method if first method fails
+        if returncode != 0 or not stdout.strip():
+            # Try alternative method if first method fails (or the file has no video stream)
             command = [
                 "-v", "error",
                 "-show_entries", "format=duration",
@@ -113,295 +326,406 @@ def get_video_duration(video_path):
     except Exception as e:
         raise RuntimeError(f"Failed to get video duration: {str(e)}")
 
-def try_hw_accelerated_command(command, hw_encoder, hw_acceleration_enabled=False):
-    """Try hardware acceleration first, fall back to software if it fails"""
+def get_audio_info(video_path):
+    """Return {'codec', 'sample_rate', 'channels'} of the first audio stream, or None"""
+    command = [
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name,sample_rate,channels",
+        "-of", "default=noprint_wrappers=1",
+        video_path
+    ]
+    try:
+        returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
+        if returncode != 0:
+            return None
+        fields = dict(line.partition('=')[::2] for line in stdout.decode().strip().splitlines())
+        return {'codec': fields['codec_name'], 'sample_rate': int(fields['sample_rate']), 'channels': int(fields['channels'])}
+    except Exception:
+        return None
+
+def get_video_resolution(video_path):
+    """Return (width, height) of the first video stream, or None if it can't be read"""
+    command = [
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "csv=p=0:s=x",
+        video_path
+    ]
+    try:
+        returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
+        if returncode != 0:
+            return None
+        width, height = stdout.decode().strip().split('x')[:2]
+        return int(width), int(height)
+    except Exception:
+        return None
+
+def get_video_frame_rate(video_path):
+    """Return the first video stream's frame rate as FFmpeg writes it (e.g. "30000/1001"), or None"""
+    command = [
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=r_frame_rate",
+        "-of", "csv=p=0",
+        video_path
+    ]
+    try:
+        returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
+        if returncode != 0:
+            return None
+        numerator, denominator = stdout.decode().strip().split('/')
+        if int(numerator) <= 0 or int(denominator) <= 0:
+            return None
+        return f"{int(numerator)}/{int(denominator)}"
+    except Exception:
+        return None
+
+def get_keyframe_times(video_path):
+    """Return the sorted times (seconds) of the first video stream's keyframes, or None if they can't be read.
+    Only packet headers are read, nothing is decoded"""
+    command = [
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        video_path
+    ]
+    try:
+        returncode, stdout, stderr = run_ffmpeg_command(command, is_ffprobe=True)
+        if returncode != 0:
+            return None
+        times = []
+        for line in stdout.decode().splitlines():
+            pts_time, _, flags = line.strip().partition(',')
+            if 'K' in flags and pts_time not in ("", "N/A"):
+                times.append(float(pts_time))
+        return sorted(times) or None
+    except Exception:
+        return None
+
+def software_command(command, hw_encoder):
+    """Swap a hardware encoder and its options in an FFmpeg command for libx264"""
+    sw_command = command.copy()
+    if hw_encoder not in sw_command:
+        return sw_command
+    encoder_index = sw_command.index(hw_encoder)
+    sw_command[encoder_index-1:encoder_index+1] = ["-c:v", "libx264"]
+
+    # Replace hardware-specific parameters
+    for option, software_value in (("-preset", "fast"), ("-quality", None), ("-forced-idr", None)):
+        if option in sw_command:
+            option_index = sw_command.index(option)
+            if software_value:
+                sw_command[option_index+1] = software_value
+            else:
+                del sw_command[option_index:option_index+2]
+    if "-qp" in sw_command:
+        sw_command[sw_command.index("-qp")] = "-crf"
+    return sw_command
+
+def try_hw_accelerated_command(command, hw_encoder, hw_acceleration_enabled=False, progress_callback=None, fallbacks=None):
+    """Try hardware acceleration first, fall back to software if it fails.
+
+    Encoders that keep failing are skipped for a cooldown (see EncoderHealth). Every
+    fallback is appended to the fallbacks list, if given, with the time it cost.
+    """
     if hw_encoder and hw_acceleration_enabled:  # Check if acceleration is enabled
+        if not encoder_health.allow(hw_encoder):
+            if fallbacks is not None:
+                fallbacks.append({'encoder': hw_encoder, 'reason': "circuit open", 'wasted': 0.0})
+            return run_ffmpeg_command(software_command(command, hw_encoder), progress_callback=progress_callback)
+
+        started = time.monotonic()
         try:
             # Try hardware-accelerated encoding
-            returncode, stdout, stderr = run_ffmpeg_command(command)
-            if returncode == 0:
-                return returncode, stdout, stderr
+            returncode, stdout, stderr = run_ffmpeg_command(command, progress_callback=progress_callback)
+        except Exception as e:
+            returncode, stdout, stderr = None, None, str(e).encode()
+        if returncode == 0:
+            encoder_health.record_success(hw_encoder)
+            return returncode, stdout, stderr
+        if returncode == -1:  # Cancelled by the user: no verdict on the encoder
+            encoder_health.release(hw_encoder)
+            return returncode, stdout, stderr
+
+        # If hardware encoding failed, fall back to software encoding
+        encoder_health.record_failure(hw_encoder)
+        if fallbacks is not None:
+            error_lines = (stderr or b"").decode(errors='replace').strip().split('\n')
+            fallbacks.append({
+                'encoder': hw_encoder,
+                'reason': error_lines[-1][:200] if error_lines[-1] else "failed",
+                'wasted': round(time.monotonic() - started, 2)
+            })
+        return run_ffmpeg_command(software_command(command, hw_encoder), progress_callback=progress_callback)
 
-            # If hardware encoding failed, fall back to software encoding
-            sw_command = command.copy()
-            encoder_index = sw_command.index(hw_encoder)
-            sw_command[encoder_index-1:encoder_index+1] = ["-c:v", "libx264"]
+    # If no hardware acceleration is enabled, use software encoding
+    return run_ffmpeg_command(software_command(command, hw_encoder), progress_callback=progress_callback)
 
-            # Replace hardware-specific parameters
-            try:
-                preset_index = sw_command.index("-preset")
-                if "nvenc" in hw_encoder:
-                    sw_command[preset_index+1] = "fast"
-            except ValueError:
-                pass
-            try:
-                qp_index = sw_command.index("-qp")
-                sw_command[qp_index] = "-crf"
-            except ValueError:
-                pass
-            return run_ffmpeg_command(sw_command)
-        except Exception:
-            # Fall back to software encoding
-            sw_command = command.copy()
-            encoder_index = sw_command.index(hw_encoder)
-            sw_command[encoder_index-1:encoder_index+1] = ["-c:v", "libx264"]
-            return run_ffmpeg_command(sw_command)
+# Audio and pixel format shared by every intermediate so the parts concatenate cleanly
+AUDIO_ARGS = ["-c:a", "aac", "-b:a", "192k", "-ar", "44100"]
+PIXEL_FORMAT_ARGS = ["-pix_fmt", "yuv420p"]
 
-    # If no hardware acceleration is enabled, use software encoding
-    sw_command = command.copy()
-    if hw_encoder in sw_command:
-        encoder_index = sw_command.index(hw_encoder)
-        sw_command[encoder_index-1:encoder_index+1] = ["-c:v", "libx264"]
-    return run_ffmpeg_command(sw_command)
+def video_encoder_args(lossless, hw_encoder=None, hw_acceleration_enabled=False):
+    """Encoder and quality arguments for an intermediate encode"""
+    if hw_encoder and hw_acceleration_enabled:
+        args = ["-c:v", hw_encoder]
+        if hw_encoder == "h264_nvenc":
+            args.extend(["-preset", "p4"])  # NVIDIA preset
+        elif hw_encoder == "h264_amf":
+            args.extend(["-quality", "speed"])  # AMD preset
+        elif hw_encoder == "h264_qsv":
+            args.extend(["-preset", "faster"])  # Intel QuickSync preset
+        # Hardware equivalent of CRF
+        args.extend(["-qp", "18" if lossless else "23"])
+        return args
+    return ["-c:v", "libx264", "-preset", "fast", "-crf", "18" if lossless else "23"]
 
-def normalize_video(input_file, output_file, lossless=False, hw_encoder=None, hw_acceleration_enabled=False):
+def normalize_video(input_file, output_file, lossless=False, hw_encoder=None, hw_acceleration_enabled=False, audio_filter=None, fallbacks=None):
     """Normalize video to a consistent format for concatenation"""
     command = [
         "-i", input_file,
         "-map", "0:v:0",  # Select first video stream
         "-map", "0:a:0?",  # Select first audio stream if it exists
     ]
+    command.extend(video_encoder_args(lossless, hw_encoder, hw_acceleration_enabled))
+    if audio_filter:
+        command.extend(["-af", audio_filter])
+    command.extend(AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", output_file])
 
-    # Handle hardware acceleration
-    if hw_encoder and hw_acceleration_enabled:
-        command.extend(["-c:v", hw_encoder])
-        if hw_encoder == "h264_nvenc":
-            command.extend(["-preset", "p4"])  # NVIDIA preset
-        elif hw_encoder == "h264_amf":
-            command.extend(["-quality", "speed"])  # AMD preset
-        elif hw_encoder == "h264_qsv":
-            command.extend(["-preset", "faster"])  # Intel QuickSync preset
-    else:
-        command.extend([
-            "-c:v", "libx264",
-            "-preset", "fast"
-        ])
-
-    if lossless:
-        if hw_encoder and hw_acceleration_enabled:
-            command.extend(["-qp", "18"])  # Hardware equivalent of CRF
-        else:
-            command.extend(["-crf", "18"])
-    else:
-        if hw_encoder and hw_acceleration_enabled:
-            command.extend(["-qp", "23"])
-        else:
-            command.extend(["-crf", "23"])
-
-    command.extend([
-        "-c:a", "aac",
-        "-b:a", "192k",
-        "-ar", "44100",  # Consistent audio sample rate
-        "-pix_fmt", "yuv420p",  # Consistent pixel format
-        "-y",
-        output_file
-    ])
-
-    returncode, stdout, stderr = try_hw_accelerated_command(command, hw_encoder, hw_acceleration_enabled)
+    returncode, stdout, stderr = try_hw_accelerated_command(command, hw_encoder, hw_acceleration_enabled, fallbacks=fallbacks)
     if returncode != 0 and returncode != -1:  # -1 indicates process was terminated
         raise RuntimeError(f"Error normalizing video: {stderr.decode().strip()}")
     return returncode == 0
 
-def cut_video_segment(source, output, start, end, lossless, intro=None, outro=None, progress_callback=None, hw_encoder=None, hw_acceleration_enabled=False):
-    # Create temporary directory for intermediate files
-    temp_dir = mkdtemp()
-    temp_files = []
-
-    try:
-        # Step 1: Cut the main segment
-        temp_main = os.path.join(temp_dir, "temp_main.mp4")
-        cut_command = [
-            "-i", source,
-            "-ss", start,
-            "-to", end,
-            "-map", "0:v:0",
-            "-map", "0:a:0?"
-        ]
+class Rendition:
+    """One output variant of a clip (resolution, quality and codec) written from the shared decode"""
+    def __init__(self, label, height=None, width=None, crf=None, bitrate=None, codec="libx264", preset="fast", name_pattern="{name}_{label}{ext}"):
+        self.label = label
+        self.height = height
+        self.width = width
+        self.crf = crf
+        self.bitrate = bitrate
+        self.codec = codec
+        self.preset = preset
+        self.name_pattern = name_pattern
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['label'],
+            height=data.get('height'),
+            width=data.get('width'),
+            crf=data.get('crf'),
+            bitrate=data.get('bitrate'),
+            codec=data.get('codec', "libx264"),
+            preset=data.get('preset', "fast"),
+            name_pattern=data.get('name_pattern', "{name}_{label}{ext}")
+        )
 
-        # Add hardware acceleration parameters
-        if hw_encoder and hw_acceleration_enabled:
-            cut_command.extend(["-c:v", hw_encoder])
-            if hw_encoder == "h264_nvenc":
-                cut_command.extend(["-preset", "p4"])
-            elif hw_encoder == "h264_amf":
-                cut_command.extend(["-quality", "speed"])
-            elif hw_encoder == "h264_qsv":
-                cut_command.extend(["-preset", "faster"])
-        else:
-            cut_command.extend([
-                "-c:v", "libx264",
-                "-preset", "fast"
-            ])
-
-        # Add quality settings
-        if lossless:
-            if hw_encoder and hw_acceleration_enabled:
-                cut_command.extend(["-qp", "18"])
-            else:
-                cut_command.extend(["-crf", "18"])
+    def to_dict(self):
+        return dict(vars(self))
+
+    def output_path(self, output):
+        """Derive this rendition's file name from the clip's output path"""
+        directory = os.path.dirname(output)
+        name, ext = os.path.splitext(os.path.basename(output))
+        return os.path.join(directory, self.name_pattern.format(name=name, label=self.label, ext=ext or ".mp4"))
+
+    def scale_filter(self):
+        if self.width and self.height:
+            return f"scale={self.width}:{self.height}"
+        if self.height:
+            return f"scale=-2:{self.height}"
+        if self.width:
+            return f"scale={self.width}:-2"
+        return "null"
+
+    def encoder_args(self, lossless):
+        args = ["-c:v", self.codec]
+        if self.preset:
+            args.extend(["-preset", self.preset])
+        if self.bitrate:
+            args.extend(["-b:v", str(self.bitrate)])
         else:
-            if hw_encoder and hw_acceleration_enabled:
-                cut_command.extend(["-qp", "23"])
-            else:
-                cut_command.extend(["-crf", "23"])
-
-        cut_command.extend([
-            "-c:a", "aac",
-            "-b:a", "192k",
-            "-ar", "44100",
-            "-pix_fmt", "yuv420p",
-            "-y",
-            temp_main
-        ])
-        returncode, stdout, stderr = try_hw_accelerated_command(cut_command, hw_encoder, hw_acceleration_enabled)
-
-        if returncode != 0 and returncode != -1:
-            # Only show actual error messages, not progress output
-            error_lines = stderr.decode().strip().split('\n')
-            error_message = next((line for line in reversed(error_lines) if 'error' in line.lower()), 'Unknown error occurred')
-            raise RuntimeError(error_message)
-        if returncode == -1:  # Process was terminated
-            raise UserCancellationError("Processing was stopped by user")
-        temp_files.append(temp_main)
-
-        # After cutting main segment:
-        if progress_callback:
-            progress_callback(33)  # 33% complete after main cut
-
-        # Step 2: Normalize intro and outro if present
-        concat_list = []
-
-        if intro:
-            temp_intro = os.path.join(temp_dir, "temp_intro.mp4")
-            if normalize_video(intro, temp_intro, lossless, hw_encoder, hw_acceleration_enabled):
-                concat_list.append(temp_intro)
-                temp_files.append(temp_intro)
+            quality = str(self.crf if self.crf is not None else (18 if lossless else 23))
+            # Hardware encoders take a constant QP instead of CRF
+            args.extend(["-crf" if self.codec in ("libx264", "libx265") else "-qp", quality])
+        return args
+
+class AudioOutput:
+    """Audio-only clips: each range is written as an .m4a, .mp3 or .opus file.
+
+    With copy=True the audio is stream-copied (no re-encode) whenever the source already
+    uses the target codec and nothing has to be filtered; the cut then lands on the
+    nearest audio frame (about 20-26ms), which is as accurate as the codec allows.
+    """
+    CODECS = {"m4a": ("aac", "aac"), "mp3": ("mp3", "libmp3lame"), "opus": ("opus", "libopus")}
+
+    def __init__(self, format="m4a", bitrate="192k", copy=True):
+        if format not in self.CODECS:
+            raise ValueError(f"Unsupported audio format: {format} (use m4a, mp3 or opus)")
+        self.format = format
+        self.bitrate = bitrate
+        self.copy = copy
+
+    @classmethod
+    def from_dict(cls, data):
+        known = vars(cls())
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def can_copy(self, source_audio):
+        return bool(self.copy and source_audio and source_audio['codec'] == self.CODECS[self.format][0])
+
+    def encoder_args(self, sample_rate=None, channels=None):
+        """Encode to the target codec; sample_rate/channels match another part for concatenation"""
+        args = ["-c:a", self.CODECS[self.format][1], "-b:a", self.bitrate]
+        if self.format == "opus":
+            sample_rate = 48000  # The only rate libopus encodes at natively
+        if sample_rate:
+            args.extend(["-ar", str(sample_rate)])
+        if channels:
+            args.extend(["-ac", str(channels)])
+        return args
+
+class Draft:
+    """Quick low-resolution preview of a batch, for checking ranges and intro/outro assembly.
+
+    Every part is letterboxed into width x height at fps and encoded with x264's fastest
+    preset, so the parts come out in one format and are joined without another encode.
+    Drafts are written to a folder (default "drafts") inside the clip's output location.
+    """
+    def __init__(self, width=640, height=360, fps=15, crf=30, audio_bitrate="96k", folder="drafts"):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.crf = crf
+        self.audio_bitrate = audio_bitrate
+        self.folder = folder
+
+    @classmethod
+    def from_dict(cls, data):
+        known = vars(cls())
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def output_path(self, output):
+        return os.path.join(os.path.dirname(output), self.folder, os.path.basename(output))
+
+    def video_filter(self):
+        w, h = self.width, self.height
+        return (f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+                f"setsar=1,fps={self.fps}")
+
+    def encoder_args(self):
+        # Fixed audio layout too, so an intro with other audio settings still joins by stream copy
+        return ["-vf", self.video_filter(), "-c:v", "libx264", "-preset", "ultrafast", "-crf", str(self.crf),
+                "-c:a", "aac", "-b:a", self.audio_bitrate, "-ar", "44100", "-ac", "2"] + PIXEL_FORMAT_ARGS
+
+class Thumbnails:
+    """Poster frame and animated preview written alongside a clip from the same decode.
+
+    Offsets are in seconds into the finished clip (intro included). The poster goes to
+    <clip>_poster.<poster_format> and the preview to <clip>_preview.<preview_format>.
+    """
+    def __init__(self, poster=True, poster_offset=1.0, poster_width=None, poster_format="jpg",
+                 preview=True, preview_start=0.0, preview_duration=3.0, preview_fps=10, preview_width=320, preview_format="gif"):
+        self.poster = poster
+        self.poster_offset = poster_offset
+        self.poster_width = poster_width
+        self.poster_format = poster_format
+        self.preview = preview
+        self.preview_start = preview_start
+        self.preview_duration = preview_duration
+        self.preview_fps = preview_fps
+        self.preview_width = preview_width
+        self.preview_format = preview_format
+
+    @classmethod
+    def from_dict(cls, data):
+        known = vars(cls())
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def output_paths(self, output):
+        """Return (poster_path, preview_path) for a clip; None for the parts that are off"""
+        stem = os.path.splitext(output)[0]
+        poster = f"{stem}_poster.{self.poster_format}" if self.poster else None
+        preview = f"{stem}_preview.{self.preview_format}" if self.preview else None
+        return poster, preview
+
+    def branch_count(self):
+        return int(bool(self.poster)) + int(bool(self.preview))
+
+    def build_branches(self, inputs, output):
+        """Return (filters, output_args, output_paths) reading from the given split labels"""
+        poster_path, preview_path = self.output_paths(output)
+        inputs = iter(inputs)
+        filters = []
+        output_args = []
+        paths = []
+        if poster_path:
+            scale = f",scale={self.poster_width}:-2" if self.poster_width else ""
+            filters.append(f"[{next(inputs)}]trim=start={self.poster_offset},setpts=PTS-STARTPTS{scale}[poster]")
+            output_args.extend(["-map", "[poster]", "-frames:v", "1", "-update", "1"])
+            if self.poster_format == "webp":
+                output_args.extend(["-c:v", "libwebp", "-quality", "85"])
             else:
-                if current_process is None:  # Process was terminated
-                    raise UserCancellationError("Processing was stopped by user")
-                else:
-                    raise RuntimeError("Error normalizing intro")
-
-        concat_list.append(temp_main)
-
-        if outro:
-            temp_outro = os.path.join(temp_dir, "temp_outro.mp4")
-            if normalize_video(outro, temp_outro, lossless, hw_encoder, hw_acceleration_enabled):
-                concat_list.append(temp_outro)
-                temp_files.append(temp_outro)
-            else:
-                 if current_process is None:  # Process was terminated
-                      raise UserCancellationError("Processing was stopped by user")
-                 else:
-                    raise RuntimeError("Error normalizing outro")
-
-        # After normalizing intro/outro:
-        if progress_callback:
-            progress_callback(66)  # 66% complete after normalization
-
-        # Step 3: Create concatenation file
-        concat_file = os.path.join(temp_dir, "concat.txt")
-        with open(concat_file, "w", encoding='utf-8') as f:
-            for file_path in concat_list:
-                f.write(f"file '{file_path}'\n")
-        temp_files.append(concat_file)
-
-        # Step 4: Concatenate all clips
-        concat_command = [
-            "-f", "concat",
-            "-safe", "0",
-            "-i", concat_file,
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "23" if not lossless else "18",
-            "-c:a", "aac",
-            "-b:a", "192k",
-            "-ar", "44100",
-            "-pix_fmt", "yuv420p",
-            "-y",
-            output
-        ]
-        try:
-           returncode, stdout, stderr = run_ffmpeg_command(concat_command, timeout=600)
-        except Exception as e:
-           raise Exception(f"Concatenation process timed out or failed: {e}")
-
-        if returncode != 0:
-             # Only show actual error messages, not progress output
-             error_lines = stderr.decode().strip().split('\n')
-             error_message = next((line for line in reversed(error_lines) if 'error' in line.lower()), 'Unknown error occurred')
-             raise Exception(f"Concatenation failed: {error_message}")
-
-        # After final concatenation:
-        if progress_callback:
-            progress_callback(100)  # 100% complete
-
-        return True, None
-
-    except UserCancellationError as e:
-        return False, str(e)
-    except Exception as e:
-        return False, f"Error: {e}"
-
-    finally:
-        # Clean up all temporary files
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-def process_clips(self, parsed_ranges, source_video, intro_clip, outro_clip, output_location, lossless, original_filename, hw_encoder=None, hw_acceleration_enabled=False):
-    self.total_clips = len(parsed_ranges)
-    self.start_time = time.time()
-    self.processed_clips = 0  # Reset processed clips counter
-
-    try:
-        for i, (start_time_str, end_time_str) in enumerate(parsed_ranges, 1):
-            if not self.processing_active:
-                return  # Exit if processing is stopped
-
-            output_filename = f"Clip_{i}_{original_filename}.mp4"
-            output_path = os.path.join(output_location, output_filename)
-
-            def progress_handler(progress):
-                if self.processing_active:
-                    clip_progress = ((i - 1) * 100 + progress) / self.total_clips
-                    self.root.after(0, lambda p=clip_progress: self.update_progress(p))
-
-            success, error_message = cut_video_segment(
-                source_video,
-                output_path,
-                start_time_str,
-                end_time_str,
-                lossless,
-                intro_clip if self.use_intro.get() else None,
-                outro_clip if self.use_outro.get() else None,
-                progress_callback=progress_handler,
-                hw_encoder=hw_encoder if hw_acceleration_enabled else None,
-                hw_acceleration_enabled=hw_acceleration_enabled
+                output_args.extend(["-q:v", "2"])
+            output_args.extend(["-y", poster_path])
+            paths.append(poster_path)
+        if preview_path:
+            filters.append(
+                f"[{next(inputs)}]trim=start={self.preview_start}:duration={self.preview_duration},setpts=PTS-STARTPTS,"
+                f"fps={self.preview_fps},scale={self.preview_width}:-2:flags=lanczos[preview_src]"
             )
-
-            if not success:
-                if "timeout" in error_message.lower():
-                    self.show_error(f"Clip {i} failed: FFmpeg concatenation timed out. Please check your input files or try again with fewer edits.")
-
-                else:
-                    self.show_error(f"Error processing clip {i}: {error_message}")
-                self.root.after(0, self.stop_processing)
-                return
-
-            self.processed_clips += 1
-
-            if not self.processing_active:
-                return  # Check again after each clip
-
-        if self.processing_active:
-            self.root.after(0, lambda: self.show_info("Video clipping completed!"))
-
-    except Exception as e:
-        self.show_error(f"An unexpected error occurred: {str(e)}")
-    finally:
-        self.root.after(0, self.stop_processing)
+            output_args.extend(["-map", "[preview]" if self.preview_format == "gif" else "[preview_src]"])
+            if self.preview_format == "gif":
+                # Build a palette from the preview frames only; the rest of the clip isn't buffered
+                filters.append("[preview_src]split[preview_a][preview_b];[preview_a]palettegen[preview_palette];"
+                               "[preview_b][preview_palette]paletteuse[preview]")
+            else:
+                output_args.extend(["-c:v", "libwebp", "-quality", "70"])
+            output_args.extend(["-an", "-loop", "0", "-y", preview_path])
+            paths.append(preview_path)
+        return filters, output_args, paths
+
+def build_rendition_outputs(renditions, output, lossless, video_input="0:v", audio_input="0:a?", thumbnails=None, audio_filter=None):
+    """Build the filter graph and output arguments that encode every rendition from one decode.
+
+    When thumbnails is a Thumbnails object, its poster and preview are extra branches of the
+    same split. audio_filter, if given, is applied to every rendition's audio.
+    Returns (filter_complex, output_args, output_paths).
+    """
+    count = len(renditions)
+    extra = thumbnails.branch_count() if thumbnails else 0
+    filters = [f"[{video_input}]split={count + extra}" + "".join(f"[s{i}]" for i in range(count + extra))]
+    output_args = []
+    output_paths = []
+    for i, rendition in enumerate(renditions):
+        filters.append(f"[s{i}]{rendition.scale_filter()}[v{i}]")
+        path = rendition.output_path(output)
+        output_args.extend(["-map", f"[v{i}]", "-map", audio_input])
+        output_args.extend(rendition.encoder_args(lossless))
+        if audio_filter:
+            output_args.extend(["-af", audio_filter])
+        output_args.extend(AUDIO_ARGS + PIXEL_FORMAT_ARGS + ["-y", path])
+        output_paths.append(path)
+    if extra:
+        thumb_filters, thumb_args, thumb_paths = thumbnails.build_branches([f"s{i}" for i in range(count, count + extra)], output)
+        filters.extend(thumb_filters)
+        output_args.extend(thumb_args)
+        output_paths.extend(thumb_paths)
+    return ";".join(filters), output_args, output_paths
 
 def validate_time_range(start_str, end_str, duration):
     try:
@@ -0,0 +1,329 @@
+# watch_folder.py
+"""Watch folders for finished recordings and clip them automatically.
+
+A recording is picked up once both the video and its sidecar range file exist and
+have stopped changing. The sidecar is named after the video (stream1.ranges or
+stream1.mp4.ranges) and holds time ranges in the usual format, one per line or
+comma separated. Optional "intro:", "outro:" and "output:" lines override the
+daemon's defaults, "audio: mp3" (or m4a/opus) extracts audio-only clips, and lines
+starting with # are ignored. Finished pairs get a .done (or .failed) marker next to
+the sidecar; delete it to process the pair again.
+
+Usage:
+    python watch_folder.py DIR [DIR ...] [--output clips/] [--intro intro.mp4] [--outro outro.mp4]
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from batch import BatchSource, parse_time_ranges
+from engine import CancellationToken, ClipEngine
+from loudness import LoudnessNormalizer
+from metrics import MetricsService
+from progress_bus import ProgressBus, JsonLinesSink
+from segment_cache import SegmentCache
+from video_processing import configure_watchdog, AudioOutput
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.flv', '.ts', '.webm', '.m4v')
+SIDECAR_EXTENSION = '.ranges'
+
+def find_sidecar(video_path):
+    stem = os.path.splitext(video_path)[0]
+    for candidate in (video_path + SIDECAR_EXTENSION, stem + SIDECAR_EXTENSION):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def parse_sidecar(sidecar_path):
+    """Return (ranges, options) from a sidecar file"""
+    options = {}
+    range_parts = []
+    with open(sidecar_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, sep, value = line.partition(':')
+            if sep and key.strip().lower() in ('intro', 'outro', 'output', 'audio'):
+                options[key.strip().lower()] = value.strip()
+            else:
+                range_parts.append(line)
+    return parse_time_ranges(', '.join(range_parts)), options
+
+class InotifyWatcher:
+    """Waits for file events with Linux inotify through libc, without extra dependencies"""
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.wake_read, self.wake_write = os.pipe()
+
+    def wait(self, timeout):
+        """Block until something changes or timeout passes. Returns True if there were events"""
+        readable, _, _ = select.select([self.fd, self.wake_read], [], [], timeout)
+        if self.wake_read in readable:
+            os.read(self.wake_read, 1)
+        if self.fd not in readable:
+            return False
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass  # Drain; the daemon rescans the folders rather than tracking single events
+        except BlockingIOError:
+            pass
+        return True
+
+    def wake(self):
+        os.write(self.wake_write, b'x')
+
+    def close(self):
+        for fd in (self.fd, self.wake_read, self.wake_write):
+            os.close(fd)
+
+class PollingWatcher:
+    """Fallback for platforms without inotify: every wait simply times out"""
+    def __init__(self, stopped):
+        self.stopped = stopped
+
+    def wait(self, timeout):
+        self.stopped.wait(timeout)
+        return True
+
+    def wake(self):
+        pass  # wait() already returns as soon as the stopped event is set
+
+    def close(self):
+        pass
+
+def create_watcher(directories, stopped):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    return PollingWatcher(stopped)
+
+class WatchFolderDaemon:
+    """Queues stable video + sidecar pairs through the normal clip pipeline"""
+    def __init__(self, directories, output_location=None, intro=None, outro=None, lossless=True,
+                 hw_encoder=None, max_concurrent_sources=1, clip_workers=None,
+                 settle_seconds=5.0, poll_interval=2.0, bus=None, segment_cache=None, readahead=False, loudness=None):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.output_location = output_location
+        self.intro = intro
+        self.outro = outro
+        self.lossless = lossless
+        self.hw_encoder = hw_encoder
+        self.clip_workers = clip_workers
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.bus = bus
+        self.segment_cache = segment_cache
+        self.readahead = readahead
+        self.loudness = loudness
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_sources)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.observed = {}
+        self.in_flight = set()
+        self.unmarked = set()  # Finished pairs whose marker couldn't be written
+        self.engines = {}
+        self.tokens = {}
+        self.watcher = None
+
+    def stop(self):
+        """Stop scanning and cancel the recordings being clipped; they are picked up again on restart"""
+        self.stopped.set()
+        with self.lock:
+            tokens = list(self.tokens.values())
+        for token in tokens:
+            token.cancel()
+        if self.watcher:
+            self.watcher.wake()
+
+    def progress_snapshot(self):
+        """batch_progress over every recording being clipped; they run side by side, so the ETA is the longest"""
+        with self.lock:
+            engines = list(self.engines.values())
+        snapshots = [engine.progress_snapshot() for engine in engines]
+        total = sum(snapshot['total'] for snapshot in snapshots)
+        return {
+            'progress': sum(snapshot['progress'] * snapshot['total'] for snapshot in snapshots) / total if total else 0.0,
+            'completed': sum(snapshot['completed'] for snapshot in snapshots),
+            'total': total,
+            'eta': max((snapshot['eta'] for snapshot in snapshots), default=0.0)
+        }
+
+    def run(self):
+        if self.bus:
+            self.bus.add_snapshot('batch_progress', self.progress_snapshot)
+        watcher = self.watcher = create_watcher(self.directories, self.stopped)
+        try:
+            while not self.stopped.is_set():
+                waiting = self.scan()
+                # Files that are still settling need a re-check even if no new events arrive
+                watcher.wait(min(self.poll_interval, self.settle_seconds) if waiting else 60)
+        finally:
+            self.stop()  # Also reached on Ctrl+C, before waiting for the running recordings
+            self.watcher = None
+            watcher.close()
+            self.executor.shutdown(wait=True)
+
+    def is_stable(self, path, now):
+        """True once a file's size and mtime have not changed for settle_seconds"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.observed.pop(path, None)
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self.observed.get(path)
+        if previous is None or previous[0] != signature:
+            self.observed[path] = (signature, now)
+            return False
+        return now - previous[1] >= self.settle_seconds
+
+    def scan(self):
+        """Submit every ready pair. Returns True if some pair is still settling"""
+        now = time.time()
+        waiting = False
+        for directory in self.directories:
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError as e:
+                print(f"Cannot read {directory}: {e}")
+                continue
+            for name in names:
+                if not name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                video_path = os.path.join(directory, name)
+                sidecar = find_sidecar(video_path)
+                if sidecar is None or os.path.exists(sidecar + '.done') or os.path.exists(sidecar + '.failed'):
+                    continue
+                with self.lock:
+                    if video_path in self.in_flight or video_path in self.unmarked:
+                        continue
+                video_stable = self.is_stable(video_path, now)
+                sidecar_stable = self.is_stable(sidecar, now)
+                if not (video_stable and sidecar_stable):
+                    waiting = True
+                    continue
+                with self.lock:
+                    self.in_flight.add(video_path)
+                self.executor.submit(self.process_pair, video_path, sidecar)
+        return waiting
+
+    def process_pair(self, video_path, sidecar):
+        error = None
+        token = CancellationToken()
+        with self.lock:
+            self.tokens[video_path] = token
+        if self.stopped.is_set():
+            token.cancel()  # Queued before stop(); leave it for the next start
+        try:
+            ranges, options = parse_sidecar(sidecar)
+            base_dir = os.path.dirname(sidecar)
+            def resolve(path):
+                return os.path.join(base_dir, path) if path and not os.path.isabs(path) else path
+            output_location = resolve(options.get('output')) or self.output_location or os.path.join(base_dir, 'clips')
+            os.makedirs(output_location, exist_ok=True)
+            source = BatchSource(
+                video_path,
+                ranges,
+                intro=resolve(options.get('intro')) or self.intro,
+                outro=resolve(options.get('outro')) or self.outro,
+                output_location=output_location,
+                audio=AudioOutput(options['audio']) if options.get('audio') else None
+            )
+            engine = ClipEngine(self.lossless, self.hw_encoder, self.hw_encoder is not None,
+                                max_workers=self.clip_workers, segment_cache=self.segment_cache, bus=self.bus,
+                                order="locality" if self.readahead else "lpt", readahead=self.readahead,
+                                loudness=self.loudness, batch_snapshot=False)
+            with self.lock:
+                self.engines[video_path] = engine
+            failures = [f"{result.job.describe()}: {result.error}" for result in engine.run([source], token) if not result.success]
+            if failures:
+                error = "\n".join(failures)
+        except Exception as e:
+            error = str(e)
+
+        try:
+            if token.cancelled:
+                print(f"Stopped clipping {os.path.basename(video_path)}; it will be processed again on the next start")
+                return
+            # Marker files keep the pair from being processed again, also after a restart
+            marker = sidecar + ('.failed' if error else '.done')
+            try:
+                with open(marker, 'w', encoding='utf-8') as f:
+                    f.write(error or time.strftime('%Y-%m-%d %H:%M:%S'))
+            except OSError as e:
+                print(f"Could not write {marker} ({e}); {os.path.basename(video_path)} is skipped until the next start")
+                with self.lock:
+                    self.unmarked.add(video_path)
+            if self.bus:
+                self.bus.publish('source_done', source=video_path, success=error is None, error=error)
+        finally:
+            with self.lock:
+                self.tokens.pop(video_path, None)
+                self.engines.pop(video_path, None)
+                self.in_flight.discard(video_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Clip recordings as soon as they land in a folder")
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument('--output', help="Output folder (default: <watched folder>/clips)")
+    parser.add_argument('--intro')
+    parser.add_argument('--outro')
+    parser.add_argument('--compressed', action='store_true', help="Use compressed instead of lossless quality")
+    parser.add_argument('--hw-encoder', help="Hardware encoder to try first, e.g. h264_nvenc")
+    parser.add_argument('--sources', type=int, default=1, help="Recordings processed at the same time")
+    parser.add_argument('--workers', type=int, help="Parallel clips per recording")
+    parser.add_argument('--stall-timeout', type=float, help="Kill an FFmpeg job after this many seconds without progress (0 disables)")
+    parser.add_argument('--readahead', action='store_true', help="Prefetch source data for slow or network storage")
+    parser.add_argument('--loudness', type=float, help="Normalize every clip to this integrated loudness (LUFS)")
+    parser.add_argument('--loudness-cache', help="Directory for the per-source loudness measurements")
+    parser.add_argument('--segment-cache', help="Directory of cached main segments, reused across recordings")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on this local port")
+    parser.add_argument('--metrics-file', help="Rewrite Prometheus metrics to this textfile periodically")
+    parser.add_argument('--settle', type=float, default=5.0, help="Seconds a file must stay unchanged")
+    args = parser.parse_args()
+    configure_watchdog(stall_timeout=args.stall_timeout)
+
+    bus = ProgressBus(refresh_interval=1.0)
+    bus.attach(JsonLinesSink(sys.stdout))
+    segment_cache = SegmentCache(args.segment_cache) if args.segment_cache else None
+    metrics = None
+    if args.metrics_port is not None or args.metrics_file:
+        metrics = MetricsService(bus, args.metrics_port, args.metrics_file, segment_cache)
+    daemon = WatchFolderDaemon(
+        args.directories, args.output, args.intro, args.outro, not args.compressed, args.hw_encoder,
+        max_concurrent_sources=args.sources, clip_workers=args.workers, settle_seconds=args.settle, bus=bus,
+        segment_cache=segment_cache, readahead=args.readahead,
+        loudness=LoudnessNormalizer(args.loudness_cache, target=args.loudness) if args.loudness is not None else None
+    )
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        bus.close()
+        if metrics:
+            metrics.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# worker.py
+"""Headless clip workers that share a job store.
+
+Usage:
+    python worker.py submit --store jobs.db batch.json [--compressed] [--hw-encoder h264_nvenc] [--loudness -16] [--draft]
+    python worker.py run --store jobs.db [--processes 4] [--loudness-cache DIR] [--verify]
+    python worker.py serve --store jobs.db [--port 8765]
+    python worker.py status --store jobs.db
+
+--store is either a SQLite file or the URL of a `serve` process (e.g.
+http://127.0.0.1:8765). A shared SQLite file relies on the filesystem's locking;
+for workers on several hosts, `serve` is the dependable choice.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+from batch import load_batch_file
+from engine import plan_batch
+from loudness import LoudnessNormalizer
+from overlays import OverlayCache, overlay_from_dict
+from job_store import open_job_store, serve_job_store, SQLiteJobStore, DEFAULT_LEASE_SECONDS
+from segment_cache import SegmentCache
+from stage_graph import cut_video_segment
+from verification import ClipVerifier, media_outputs
+from video_processing import terminate_current_process, configure_watchdog, AudioOutput, Draft, Rendition, Thumbnails
+
+def job_to_payload(job, lossless, hw_encoder=None, hw_acceleration_enabled=False, loudness=None):
+    """Describe a ClipJob as a JSON-serialisable dict for the job store"""
+    renditions = job.source.renditions
+    thumbnails = job.source.thumbnails
+    audio = job.source.audio
+    return {
+        'source': job.source.source_video,
+        'output': job.output_path,
+        'start': job.start,
+        'end': job.end,
+        'intro': job.source.intro,
+        'outro': job.source.outro,
+        'lossless': lossless,
+        'hw_encoder': hw_encoder if hw_acceleration_enabled else None,
+        'renditions': [r.to_dict() for r in renditions] if renditions else None,
+        'thumbnails': thumbnails.to_dict() if thumbnails else None,
+        'loudness': loudness.to_dict() if loudness else None,
+        'audio': audio.to_dict() if audio else None,
+        'audio_info': job.source.audio_info,
+        'expected_duration': job.output_duration(),
+        'overlays': [overlay.to_dict() for overlay in job.source.overlays] if job.source.overlays else None,
+        'draft': job.draft.to_dict() if job.draft else None
+    }
+
+def verify_payload(payload, verifier):
+    """Check the files a finished payload wrote. Returns an error message or None"""
+    if payload.get('draft'):
+        return verifier.verify([payload['output']], payload['expected_duration'], "video")
+    audio = payload.get('audio')
+    renditions = payload.get('renditions')
+    paths = media_outputs(payload['output'], [Rendition.from_dict(r) for r in renditions] if renditions else None, audio)
+    return verifier.verify(paths, payload['expected_duration'], "audio" if audio else "video")
+
+def run_payload(payload, segment_cache=None, loudness_cache=None, fallbacks=None, overlay_cache=None):
+    """Cut the clip described by a job payload. Returns an error message or None"""
+    renditions = payload.get('renditions')
+    thumbnails = payload.get('thumbnails')
+    loudness = payload.get('loudness')
+    audio = payload.get('audio')
+    overlays = payload.get('overlays')
+    draft = payload.get('draft')
+    if draft:
+        os.makedirs(os.path.dirname(payload['output']), exist_ok=True)
+    success, error_message = cut_video_segment(
+        payload['source'],
+        payload['output'],
+        payload['start'],
+        payload['end'],
+        payload['lossless'],
+        payload.get('intro'),
+        payload.get('outro'),
+        hw_encoder=payload.get('hw_encoder'),
+        hw_acceleration_enabled=bool(payload.get('hw_encoder')),
+        renditions=[Rendition.from_dict(r) for r in renditions] if renditions else None,
+        segment_cache=segment_cache,
+        thumbnails=Thumbnails.from_dict(thumbnails) if thumbnails is not None else None,
+        loudness=LoudnessNormalizer(loudness_cache, **loudness) if loudness else None,
+        fallbacks=fallbacks,
+        audio=AudioOutput.from_dict(audio) if audio else None,
+        source_audio=payload.get('audio_info'),
+        overlays=[overlay_from_dict(o) for o in overlays] if overlays else None,
+        overlay_cache=overlay_cache,
+        draft=Draft.from_dict(draft) if draft else None
+    )
+    return None if success else (error_message or "Unknown error")
+
+class Worker:
+    """Claims jobs from a store and keeps their leases alive while they run"""
+    def __init__(self, store, worker_id=None, poll_interval=2.0, heartbeat_interval=None, segment_cache=None, loudness_cache=None, verifier=None):
+        self.store = store
+        self.segment_cache = segment_cache
+        self.verifier = verifier
+        self.overlay_cache = OverlayCache()
+        # Loudness measurements go through this directory so each source is analyzed once per machine
+        self.loudness_cache = loudness_cache or os.path.join(tempfile.gettempdir(), "bulk_clip_loudness")
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        lease_seconds = getattr(store, 'lease_seconds', DEFAULT_LEASE_SECONDS)
+        self.heartbeat_interval = heartbeat_interval or max(1.0, lease_seconds / 3)
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self, exit_when_idle=False):
+        while not self.stopped.is_set():
+            claimed = self.store.claim(self.worker_id)
+            if claimed is None:
+                if exit_when_idle:
+                    return
+                self.stopped.wait(self.poll_interval)
+                continue
+            job_id, payload = claimed
+            self.run_job(job_id, payload)
+
+    def run_job(self, job_id, payload):
+        finished = threading.Event()
+
+        def keep_alive():
+            while not finished.wait(self.heartbeat_interval):
+                try:
+                    if not self.store.heartbeat(job_id, self.worker_id):
+                        # Another worker re-claimed the job; stop duplicating its work
+                        print(f"[{self.worker_id}] Lost lease on job {job_id}")
+                        terminate_current_process()
+                        return
+                except Exception as e:
+                    print(f"[{self.worker_id}] Heartbeat failed: {e}")
+
+        heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat_thread.start()
+        fallbacks = []
+        try:
+            error = run_payload(payload, self.segment_cache, self.loudness_cache, fallbacks, self.overlay_cache)
+            if error is None and self.verifier and 'expected_duration' in payload:
+                error = self.verify(payload, fallbacks)
+        except Exception as e:
+            error = str(e)
+        finally:
+            finished.set()
+            heartbeat_thread.join()
+
+        self.store.complete(job_id, self.worker_id, error)
+        status = "done" if error is None else f"failed: {error}"
+        if fallbacks:
+            wasted = sum(fallback['wasted'] for fallback in fallbacks)
+            status += f" ({len(fallbacks)} software fallback(s), {wasted:.1f}s lost)"
+        print(f"[{self.worker_id}] {os.path.basename(payload['output'])} {status}")
+
+    def verify(self, payload, fallbacks):
+        """Verify a finished job, re-encoding it once (without cached parts) if it fails.
+        A second failure is reported to the store, which re-queues the job until max_attempts"""
+        error = verify_payload(payload, self.verifier)
+        if error is None:
+            return None
+        print(f"[{self.worker_id}] {os.path.basename(payload['output'])} failed verification ({error}), re-encoding")
+        segment_cache = self.segment_cache.refreshing() if self.segment_cache else None
+        error = run_payload(payload, segment_cache, self.loudness_cache, fallbacks, self.overlay_cache) or verify_payload(payload, self.verifier)
+        return None if error is None else f"Verification failed: {error}"
+
+def submit_batch(store, batch_file, lossless=True, hw_encoder=None, loudness=None, draft=None):
+    job_ids = []
+    for job in plan_batch(load_batch_file(batch_file), draft):
+        job_ids.append(store.submit(job_to_payload(job, lossless, hw_encoder, hw_encoder is not None, loudness)))
+    return job_ids
+
+def worker_process(store_location, exit_when_idle, segment_cache_dir=None, lease_seconds=DEFAULT_LEASE_SECONDS, loudness_cache_dir=None, simulate=None, verify=None, stall_timeout=None):
+    # Module settings aren't inherited by spawned processes (Windows, macOS), so apply them here
+    configure_watchdog(stall_timeout=stall_timeout)
+    if simulate is not None:
+        from simulated_ffmpeg import install
+        install(simulate)
+    segment_cache = SegmentCache(segment_cache_dir) if segment_cache_dir else None
+    verifier = ClipVerifier(decode=verify == "decode") if verify else None
+    worker = Worker(open_job_store(store_location, lease_seconds), segment_cache=segment_cache, loudness_cache=loudness_cache_dir,
+                    verifier=verifier)
+    worker.run(exit_when_idle=exit_when_idle)
+
+def main():
+    # Options every command accepts, after the command name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--store', required=True, help="SQLite file or http:// URL of a job store")
+    common.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help="Lease length in seconds")
+    common.add_argument('--stall-timeout', type=float, help="Kill an FFmpeg job after this many seconds without progress (0 disables)")
+    common.add_argument('--simulate', metavar='SPEC', help="Use the simulated FFmpeg backend, e.g. speed=500,fail=0.01")
+
+    parser = argparse.ArgumentParser(description="Bulk Clip Generator headless workers")
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit = commands.add_parser('submit', parents=[common], help="Queue the clips of a batch file")
+    submit.add_argument('batch_file', help="JSON batch file")
+    submit.add_argument('--compressed', action='store_true', help="Use compressed instead of lossless quality")
+    submit.add_argument('--hw-encoder', help="Hardware encoder to try first, e.g. h264_nvenc")
+    submit.add_argument('--loudness', type=float, help="Normalize every clip to this integrated loudness in LUFS")
+    submit.add_argument('--draft', action='store_true', help="Submit quick low-resolution previews into a drafts folder")
+    run = commands.add_parser('run', parents=[common], help="Encode queued clips")
+    run.add_argument('--processes', type=int, default=1, help="Worker processes to start")
+    run.add_argument('--exit-when-idle', action='store_true', help="Stop once the queue is empty")
+    run.add_argument('--segment-cache', help="Directory of cached main segments shared by the workers")
+    run.add_argument('--loudness-cache', help="Directory of per-source loudness measurements")
+    run.add_argument('--verify', action='store_true', help="Probe every finished clip and re-encode the ones that came out wrong")
+    run.add_argument('--verify-decode', action='store_true', help="Also decode every finished clip completely (implies --verify)")
+    serve = commands.add_parser('serve', parents=[common], help="Share a SQLite job store over HTTP")
+    serve.add_argument('--host', default="127.0.0.1")
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--allowed-host', action='append', default=[], metavar='NAME',
+                       help="Another name workers use to reach this host (repeatable)")
+    commands.add_parser('status', parents=[common], help="Count the jobs in each state")
+    args = parser.parse_args()
+    configure_watchdog(stall_timeout=args.stall_timeout)
+    verify = None
+    if args.command == 'run':
+        verify = "decode" if args.verify_decode else "probe" if args.verify else None
+    if args.simulate is not None and args.command == 'submit':
+        from simulated_ffmpeg import install
+        install(args.simulate)  # Workers install it in their own processes below
+
+    if args.command == 'submit':
+        store = open_job_store(args.store, lease_seconds=args.lease)
+        loudness = LoudnessNormalizer(target=args.loudness) if args.loudness is not None else None
+        job_ids = submit_batch(store, args.batch_file, not args.compressed, args.hw_encoder, loudness,
+                               Draft() if args.draft else None)
+        print(f"Submitted {len(job_ids)} clip jobs")
+    elif args.command == 'run':
+        if args.processes == 1:
+            worker_process(args.store, args.exit_when_idle, args.segment_cache, args.lease, args.loudness_cache, args.simulate, verify,
+                           args.stall_timeout)
+        else:
+            processes = [
+                multiprocessing.Process(target=worker_process, args=(args.store, args.exit_when_idle, args.segment_cache, args.lease, args.loudness_cache, args.simulate, verify,
+                                                                 args.stall_timeout))
+                for _ in range(args.processes)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+    elif args.command == 'serve':
+        # Only this process opens the file, so the faster WAL journal is safe
+        store = SQLiteJobStore(args.store, lease_seconds=args.lease, journal_mode="WAL")
+        server = serve_job_store(store, args.host, args.port, args.allowed_host)
+        print(f"Serving job store {args.store} on http://{args.host}:{server.server_port}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == 'status':
+        print(open_job_store(args.store).counts())
+
+if __name__ == '__main__':
+    main()